@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+# Copyright 2022 Shang Xie.
+# All rights reserved.
+#
+# This file is part of the CatMOD distribution and
+# governed by your choice of the "CatMOD License Agreement"
+# or the "GNU General Public License v3.0".
+# Please see the LICENSE file that should
+# have been included as part of this package.
+"""Represent a current files conversion.
+
+What's here:
+
+Convert ONT current text files into a binary current table.
+-----------------------------------------------------------
+
+Classes:
+  - ConvertCurrent:
+  - CurrentPartWriter:
+
+Functions:
+  - convert_current_files:
+"""
+
+from json import dump
+from logging import getLogger
+from math import ceil
+from multiprocessing import cpu_count, Pool
+from pathlib import Path
+from shutil import rmtree
+
+import numpy as np
+
+from rich.progress import Progress
+
+from CatMOD.reader.current import (
+    CURRENT_TABLE_FILE, CurrentReader, parse_float_lines)
+from CatMOD.site_index import STRANDS
+from CatMOD.sys_output import Output
+
+logger = getLogger(__name__)  # pylint: disable=invalid-name
+
+_PART_FILES = 1024
+
+
+class ConvertCurrent(object):
+    """The convert current files process.
+
+    Current files are split into one part per pool task, every part is
+    written file by file so memory stays bounded by the largest file, and
+    the manifest is written last so an interrupted conversion is never
+    taken for a table.
+
+    Attributes:
+      - args: Arguments.
+      - output: Output info, warning and error.
+    """
+
+    def __init__(self, arguments):
+        """Initialize ConvertCurrent."""
+        self.args = arguments
+        self.output = Output()
+        self.output.info(
+            f'Initializing {self.__class__.__name__}: (args: {arguments}.')
+        logger.debug(
+            f'Initializing {self.__class__.__name__}: (args: {arguments}.')
+        self.threads = self.args.threads if self.args.threads else cpu_count()
+
+    def check_directory(self):
+        """Check output table directory."""
+        self.output.info('Checking output directory.')
+        self.output_path = Path(self.args.output)
+        if (self.output_path / CURRENT_TABLE_FILE).is_file():
+            if not self.args.overwrite:
+                self.output.error(
+                    f'{self.output_path} already holds a current table, '
+                    'use --overwrite to replace it.')
+                raise SystemExit
+            self.output.info(f'Overwriting {self.output_path}.')
+            (self.output_path / CURRENT_TABLE_FILE).unlink()
+        self.output_path.mkdir(parents=True, exist_ok=True)
+        for part_path in self.output_path.glob('part-*'):
+            rmtree(part_path)
+
+    def convert_current(self):
+        current_files = CurrentReader(self.args.current).current_files
+        part_files = max(1, min(_PART_FILES,
+                                ceil(len(current_files) / self.threads)))
+        convert_args_list = [
+            (str(self.output_path / f'part-{part_index:05d}'),
+             current_files[chunk_start:chunk_start+part_files],
+             self.args.dtype)
+            for part_index, chunk_start in enumerate(
+                range(0, len(current_files), part_files))]
+        threads = max(1, min(self.threads, len(convert_args_list)))
+        self.output.info(f'Using {threads} threads to convert current files.')
+        with Progress() as progress:
+            task = progress.add_task(
+                '[green]INFO    [cyan]Converting '
+                f'{len(current_files)} ONT current files...',
+                total=len(current_files))
+            with Pool(threads) as pool:
+                parts = []
+                for part, (_, part_current_files, _) in zip(
+                        pool.imap(convert_current_files, convert_args_list),
+                        convert_args_list):
+                    parts.append(part)
+                    progress.advance(task, len(part_current_files))
+        with open(self.output_path / CURRENT_TABLE_FILE, 'w') as open_table:
+            dump({'dtype': self.args.dtype, 'parts': parts}, open_table,
+                 indent=1)
+        self.output.info(
+            f'Completed converting {sum(part["lines"] for part in parts)} '
+            'current lines.')
+
+    def process(self):
+        """Call the convert current object."""
+        self.output.info('Starting convert current Process.')
+        logger.debug('Starting convert current Process.')
+        self.check_directory()
+        self.convert_current()
+        self.output.info('Completed convert current Process.')
+        logger.debug('Completed convert current Process.')
+
+
+def convert_current_files(convert_args: tuple[str, list[str], str]):
+    """Convert a chunk of current files into a current table part.
+
+    Args:
+        convert_args (tuple): part folder path, current file paths and float
+            dtype name.
+
+    Returns:
+        part (dict): part manifest, see CurrentTable.
+    """
+    part_folder, current_files, dtype = convert_args
+    part_writer = CurrentPartWriter(part_folder, dtype)
+    for current_file in current_files:
+        (chroms, strands, starts, ends, norm_means, norm_stdevs,
+            currents) = CurrentReader.read_current_file(current_file)
+        if not chroms:
+            continue
+        part_writer.write(
+            chroms, np.array([STRANDS.index(strand) for strand in strands],
+                             dtype=np.int8),
+            starts, ends, parse_float_lines(norm_means, current_file),
+            parse_float_lines(norm_stdevs, current_file),
+            np.array(','.join(currents).split(','), dtype=np.float64),
+            [each.count(',') + 1 for each in currents], current_file)
+    return part_writer.close()
+
+
+class CurrentPartWriter(object):
+    """The writer of a current table part.
+
+    Lines are appended batch by batch to the raw column files of the part,
+    see CurrentTable, so memory stays bounded by the largest batch.
+
+    Attributes:
+        part_path (Path): part folder path.
+        dtype (str): float dtype name of the norm and current columns.
+        lines (int): lines written.
+        values (int): current values written.
+        norm_width (int): values of every norm mean and stdev line.
+        chrom_index (dict): chromosome id -> chromosome code of the part.
+    """
+
+    columns = ('chrom', 'strand', 'start', 'end', 'norm_mean', 'norm_stdev',
+               'current', 'current_offsets')
+
+    def __init__(self, part_folder: str, dtype: str):
+        self.part_path = Path(part_folder)
+        self.part_path.mkdir()
+        self.dtype = dtype
+        self.lines, self.values, self.norm_width = 0, 0, 0
+        self.chrom_index = {}
+        self.open_columns = {column: open(self.part_path / f'{column}.bin',
+                                          'wb')
+                             for column in self.columns}
+        np.zeros(1, dtype=np.int64).tofile(
+            self.open_columns['current_offsets'])
+
+    def write(self, chroms: list[str], strands: np.ndarray, starts, ends,
+              norm_mean: np.ndarray, norm_stdev: np.ndarray,
+              current: np.ndarray, current_lengths, source: str = ''):
+        """Append a batch of lines.
+
+        Args:
+            chroms (list): chromosome id of every line.
+            strands (np.ndarray): strand code of every line.
+            starts (list): site start of every line.
+            ends (list): site end of every line.
+            norm_mean (np.ndarray): (lines, norm width) norm mean.
+            norm_stdev (np.ndarray): (lines, norm width) norm stdev.
+            current (np.ndarray): current of all lines concatenated.
+            current_lengths (list): current values of every line.
+            source (str): input of the batch named in errors.
+        """
+        if self.norm_width and norm_mean.shape[1] != self.norm_width:
+            raise ValueError(
+                f'Norm features of {source} hold {norm_mean.shape[1]} '
+                f'values, expected {self.norm_width}.')
+        self.norm_width = norm_mean.shape[1]
+        open_columns = self.open_columns
+        np.array([self.chrom_index.setdefault(chrom, len(self.chrom_index))
+                  for chrom in chroms],
+                 dtype=np.int32).tofile(open_columns['chrom'])
+        np.asarray(strands, dtype=np.int8).tofile(open_columns['strand'])
+        np.asarray(starts, dtype=np.int64).tofile(open_columns['start'])
+        np.asarray(ends, dtype=np.int64).tofile(open_columns['end'])
+        norm_mean.astype(self.dtype).tofile(open_columns['norm_mean'])
+        norm_stdev.astype(self.dtype).tofile(open_columns['norm_stdev'])
+        current.astype(self.dtype).tofile(open_columns['current'])
+        (self.values + np.cumsum(current_lengths, dtype=np.int64)).tofile(
+            open_columns['current_offsets'])
+        self.lines += len(chroms)
+        self.values += len(current)
+
+    def close(self):
+        """Close the column files and return the part manifest."""
+        for open_column in self.open_columns.values():
+            open_column.close()
+        return {'name': self.part_path.name, 'lines': self.lines,
+                'values': self.values, 'norm_width': self.norm_width,
+                'chroms': list(self.chrom_index)}
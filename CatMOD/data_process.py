@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+# Copyright 2022 Shang Xie.
+# All rights reserved.
+#
+# This file is part of the CatMOD distribution and
+# governed by your choice of the "CatMOD License Agreement"
+# or the "GNU General Public License v3.0".
+# Please see the LICENSE file that should
+# have been included as part of this package.
+"""Represent a fast5 data process.
+
+What's here:
+
+Extract site currents of resquiggled fast5 files into a current table.
+----------------------------------------------------------------------
+
+Classes:
+  - DataProcess:
+
+Functions:
+  - init_sites:
+  - process_fast5_files:
+  - read_fast5_reads:
+  - read_sites_current:
+"""
+
+from json import dump
+from logging import getLogger
+from math import ceil
+from multiprocessing import cpu_count, Pool
+from pathlib import Path
+from shutil import rmtree
+from typing import Optional
+
+import h5py
+import numpy as np
+
+from numpy.lib.stride_tricks import sliding_window_view
+from rich.progress import Progress
+
+from CatMOD.convert_current import CurrentPartWriter
+from CatMOD.reader.bed import BedReader
+from CatMOD.reader.current import CURRENT_TABLE_FILE
+from CatMOD.resample import resample_segments
+from CatMOD.site_index import SiteIndex, STRANDS
+from CatMOD.sys_output import Output
+
+logger = getLogger(__name__)  # pylint: disable=invalid-name
+
+_PART_FILES = 256
+_KMER = 5
+
+
+class DataProcess(object):
+    """The fast5 data process.
+
+    Every read resquiggled by tombo yields one line per position with a
+    full 5-mer around it: the norm mean and stdev of the 5 events and the
+    normalized current of their samples resampled to cur_window points, so
+    every line has the same current length. Fast5 files are split into one
+    current table part per pool task, see convert_current, so the lines
+    are written in binary columns without any text step.
+
+    Attributes:
+      - args: Arguments.
+      - output: Output info, warning and error.
+    """
+
+    def __init__(self, arguments):
+        """Initialize DataProcess."""
+        self.args = arguments
+        self.output = Output()
+        self.output.info(
+            f'Initializing {self.__class__.__name__}: (args: {arguments}.')
+        logger.debug(
+            f'Initializing {self.__class__.__name__}: (args: {arguments}.')
+        self.threads = self.args.threads if self.args.threads else cpu_count()
+
+    def check_directory(self):
+        """Check output table directory."""
+        self.output.info('Checking output directory.')
+        self.output_path = Path(self.args.output)
+        if (self.output_path / CURRENT_TABLE_FILE).is_file():
+            if not self.args.overwrite:
+                self.output.error(
+                    f'{self.output_path} already holds a current table, '
+                    'use --overwrite to replace it.')
+                raise SystemExit
+            self.output.info(f'Overwriting {self.output_path}.')
+            (self.output_path / CURRENT_TABLE_FILE).unlink()
+        self.output_path.mkdir(parents=True, exist_ok=True)
+        for part_path in self.output_path.glob('part-*'):
+            rmtree(part_path)
+
+    def read_sites(self):
+        """Index the wanted sites, default every position."""
+        self.site_index = None
+        if self.args.bed:
+            self.site_index = SiteIndex.from_region_set(
+                BedReader(self.args.bed).read_region_set().unique())
+            self.output.info(f'Keeping currents of {len(self.site_index)} '
+                             'sites.')
+        with open(self.args.reference + '.fai', 'r') as open_fai:
+            self.chroms = [eachline.split('\t', 1)[0]
+                           for eachline in open_fai if eachline.strip()]
+
+    def process_fast5(self):
+        fast5_files = sorted(
+            str(fast5_file)
+            for fast5_file in Path(self.args.current).rglob('*.fast5'))
+        if not fast5_files:
+            self.output.error(f'{self.args.current} holds no fast5 file.')
+            raise SystemExit
+        part_files = max(1, min(_PART_FILES,
+                                ceil(len(fast5_files) / self.threads)))
+        process_args_list = [
+            (str(self.output_path / f'part-{part_index:05d}'),
+             fast5_files[chunk_start:chunk_start+part_files],
+             self.args.dtype, self.args.corrected_group,
+             self.args.basecall_subgroup, self.args.dna,
+             self.args.cur_window, self.args.current_kind)
+            for part_index, chunk_start in enumerate(
+                range(0, len(fast5_files), part_files))]
+        threads = max(1, min(self.threads, len(process_args_list)))
+        self.output.info(f'Using {threads} threads to process fast5 files.')
+        with Progress() as progress:
+            task = progress.add_task(
+                '[green]INFO    [cyan]Processing '
+                f'{len(fast5_files)} fast5 files...', total=len(fast5_files))
+            with Pool(threads, initializer=init_sites,
+                      initargs=(self.site_index, self.chroms)) as pool:
+                parts, skipped_reads = [], 0
+                for (part, part_skipped), process_args in zip(
+                        pool.imap(process_fast5_files, process_args_list),
+                        process_args_list):
+                    parts.append(part)
+                    skipped_reads += part_skipped
+                    progress.advance(task, len(process_args[1]))
+        if skipped_reads:
+            self.output.warning(
+                f'Skipped {skipped_reads} reads without a successful '
+                f'{self.args.corrected_group} resquiggle.')
+        with open(self.output_path / CURRENT_TABLE_FILE, 'w') as open_table:
+            dump({'dtype': self.args.dtype, 'parts': parts}, open_table,
+                 indent=1)
+        self.output.info(
+            f'Completed processing {sum(part["lines"] for part in parts)} '
+            'current lines.')
+
+    def process(self):
+        """Call the data process object."""
+        self.output.info('Starting data process Process.')
+        logger.debug('Starting data process Process.')
+        self.check_directory()
+        self.read_sites()
+        self.process_fast5()
+        self.output.info('Completed data process Process.')
+        logger.debug('Completed data process Process.')
+
+
+def init_sites(site_index: Optional[SiteIndex], chroms: list[str]):
+    """Share the wanted sites and reference chromosomes with a pool worker."""
+    global process_site_index, process_chroms
+    process_site_index = site_index
+    process_chroms = set(chroms)
+
+
+def process_fast5_files(
+        process_args: tuple[str, list[str], str, str, str, bool, int, str]):
+    """Extract the site currents of a chunk of fast5 files into a part.
+
+    Args:
+        process_args (tuple): part folder path, fast5 file paths, float
+            dtype name, tombo corrected group, basecall subgroup, whether
+            reads are DNA, current window and interpolation kind.
+
+    Returns:
+        part (dict): part manifest, see CurrentTable.
+        skipped_reads (int): reads without a successful resquiggle.
+    """
+    (part_folder, fast5_files, dtype, corrected_group, basecall_subgroup,
+        dna, cur_window, current_kind) = process_args
+    part_writer = CurrentPartWriter(part_folder, dtype)
+    skipped_reads = 0
+    for fast5_file in fast5_files:
+        batch = ([], [], [], [], [], [], [], [])
+        with h5py.File(fast5_file, 'r') as open_fast5:
+            for read_group, raw_signal in read_fast5_reads(open_fast5):
+                if f'Analyses/{corrected_group}/{basecall_subgroup}' \
+                        not in read_group:
+                    skipped_reads += 1
+                    continue
+                read_sites = read_sites_current(
+                    read_group['Analyses'][corrected_group][
+                        basecall_subgroup], raw_signal, dna, cur_window,
+                    current_kind, fast5_file)
+                if read_sites is None:
+                    skipped_reads += 1
+                    continue
+                for column, values in zip(batch, read_sites):
+                    column.append(values)
+        if not batch[0]:
+            continue
+        chroms, strands, starts, ends, norm_mean, norm_stdev, current, \
+            current_lengths = [np.concatenate(column) for column in batch]
+        part_writer.write(chroms.tolist(), strands, starts, ends, norm_mean,
+                          norm_stdev, current, current_lengths, fast5_file)
+    return part_writer.close(), skipped_reads
+
+
+def read_fast5_reads(open_fast5: h5py.File):
+    """Yield the read group and raw signal of every read of a single-read
+    or multi-read fast5 file."""
+    if 'Raw/Reads' in open_fast5:
+        for raw_read in open_fast5['Raw/Reads'].values():
+            yield open_fast5, raw_read['Signal']
+        return None
+    for group_name, read_group in open_fast5.items():
+        if group_name.startswith('read_') and 'Raw/Signal' in read_group:
+            yield read_group, read_group['Raw/Signal']
+
+
+def read_sites_current(corrected_subgroup: h5py.Group,
+                       raw_signal: h5py.Dataset, dna: bool,
+                       cur_window: int = 256, current_kind: str = 'linear',
+                       fast5_file: str = ''):
+    """Extract the 5-mer features of every wanted position of a read.
+
+    Events of a resquiggled read run along the read, so the i-th event is
+    at mapped_start + i on the + strand and mapped_end - 1 - i on the -
+    strand. Direct RNA signal runs 3' to 5' and is reversed first. The
+    current of every position is resampled to cur_window points.
+
+    Returns:
+        tuple: chromosome id, strand code, site start, site end, norm mean,
+            norm stdev, concatenated current and current length arrays of
+            the positions, empty if no position is wanted, None if the
+            resquiggle failed.
+    """
+    if corrected_subgroup.attrs.get('status', 'success') not in (
+            'success', b'success') or 'Events' not in corrected_subgroup:
+        return None
+    alignment = corrected_subgroup['Alignment'].attrs
+    chrom = alignment['mapped_chrom']
+    chrom = chrom.decode() if isinstance(chrom, bytes) else str(chrom)
+    strand = alignment['mapped_strand']
+    strand = strand.decode() if isinstance(strand, bytes) else str(strand)
+    events_dataset = corrected_subgroup['Events']
+    events = events_dataset[()]
+    if chrom not in process_chroms or len(events) < _KMER:
+        return ()
+    if 'norm_stdev' not in events.dtype.names:
+        raise ValueError(
+            f'{fast5_file} events lack norm_stdev, resquiggle with '
+            '--include-event-stdev.')
+    half = _KMER // 2
+    center = np.arange(half, len(events) - half)
+    if strand == '+':
+        position = int(alignment['mapped_start']) + center
+    else:
+        position = int(alignment['mapped_end']) - 1 - center
+    strand_code = STRANDS.index(strand)
+    if process_site_index is not None:
+        wanted = process_site_index.lookup(
+            chrom, strand, position, position + 1) >= 0
+        center, position = center[wanted], position[wanted]
+    if not len(center):
+        return ()
+    event_starts = events['start'].astype(np.int64)
+    event_ends = event_starts + events['length']
+    signal = raw_signal[()]
+    if not dna:
+        signal = signal[::-1]
+    read_start = int(events_dataset.attrs['read_start_rel_to_raw'])
+    norm_signal = (signal[read_start:read_start+int(event_ends[-1])] -
+                   corrected_subgroup.attrs['shift']) / \
+        corrected_subgroup.attrs['scale']
+    current_starts = event_starts[center - half]
+    current_lengths = event_ends[center + half] - current_starts
+    current_index = np.arange(current_lengths.sum()) + np.repeat(
+        current_starts - (np.cumsum(current_lengths) - current_lengths),
+        current_lengths)
+    return (np.full(len(center), chrom, dtype=object),
+            np.full(len(center), strand_code, dtype=np.int8),
+            position, position + 1,
+            sliding_window_view(events['norm_mean'], _KMER)[center - half],
+            sliding_window_view(events['norm_stdev'], _KMER)[center - half],
+            resample_segments(norm_signal[current_index], current_lengths,
+                              cur_window, current_kind).ravel(),
+            np.full(len(center), cur_window, dtype=np.int64))
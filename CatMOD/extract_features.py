@@ -16,6 +16,10 @@ Preprocess positive and negative data sets.
 
 Classes:
   - ExtractFeatures:
+
+Functions:
+  - compact_chrom_alignment:
+  - summarize_chrom_alignment:
 """
 
 from logging import getLogger
@@ -26,18 +30,45 @@ import numpy as np
 
 from rich.progress import Progress
 
-from CatMOD.reader.bam import check_index
+from CatMOD.feature_store import FeatureStore, SegmentBuffer, STORE_FILE
+from CatMOD.reader.bam import check_index, read_depths
 from CatMOD.reader.bed import BedReader
+from CatMOD.reader.current import (
+    current_inputs, current_tasks, init_site_index)
 from CatMOD.reader.fasta import FastaReader
-from CatMOD.region import get_region_alignment
+from CatMOD.region import (
+    compact_alignment, Region, RegionSet, sweep_chrom_alignment)
+from CatMOD.run_manifest import input_checksum, MANIFEST_FILE, RunManifest
+from CatMOD.schedule import alignment_chunks, bounded_imap
+from CatMOD.shard import shard_index
+from CatMOD.site_index import SiteIndex
+from CatMOD.stats import RunningStats, summary_features
 from CatMOD.sys_output import Output
+from CatMOD.worker_context import init_worker, worker_context
 
 logger = getLogger(__name__)  # pylint: disable=invalid-name
 
+_SEQUENCE_BLOCK = 4096
+_CURRENT_FILES_CHUNK = 64
+_CURRENT_FEATURES = ('reads_norm_mean', 'reads_norm_stdev', 'reads_current')
+_ALIGNMENT_FEATURES = ('reads_alignment', 'reads_insertion', 'reads_quality')
+# store features written by every stage, with and without --summary.
+_STAGE_FEATURES = {
+    'sequence': ('ref_seq',),
+    'alignment': _ALIGNMENT_FEATURES + summary_features(
+        'reads_alignment') + summary_features('reads_quality'),
+    'current': _CURRENT_FEATURES + tuple(
+        summary_feature for feature in _CURRENT_FEATURES
+        for summary_feature in summary_features(feature))}
+
 
 class ExtractFeatures(object):
     """The extract featres process.
 
+    Every stage records its completed chunks in the run manifest of the
+    output folder, so an interrupted run resumes by skipping them, see
+    RunManifest.
+
     Attributes:
       - args: Arguments.
       - output: Output info, warning and error.
@@ -61,6 +92,46 @@ class ExtractFeatures(object):
         if not self.output_path.is_dir():
             self.output.info('Creating output directory.')
             self.output_path.mkdir()
+        store_path = self.output_path / STORE_FILE
+        manifest_path = self.output_path / MANIFEST_FILE
+        if self.args.overwrite and store_path.is_file():
+            self.output.info(f'Overwriting {store_path}.')
+            store_path.unlink()
+        if manifest_path.is_file() and (
+                self.args.overwrite or not store_path.is_file()):
+            manifest_path.unlink()
+        self.store = FeatureStore(str(store_path))
+        self.manifest = RunManifest(str(manifest_path))
+
+    def resume_stage(self, stage: str, checksum: str):
+        """Prepare a stage to resume from the run manifest.
+
+        A stage started on the same inputs has its store features truncated
+        to the segments of its last completed chunk, a stage started on
+        other inputs is extracted again.
+
+        Returns:
+            np.ndarray: indices of the sites completed by the stage.
+        """
+        recorded = self.manifest.checksum(stage)
+        if recorded == checksum:
+            segments = self.manifest.segments(stage)
+            for feature in _STAGE_FEATURES[stage]:
+                self.store.truncate(feature, segments.get(feature, 0))
+            return self.manifest.sites(stage)
+        if recorded is not None:
+            self.output.warning(
+                f'Inputs of {stage} features changed, extracting them again.')
+        for feature in _STAGE_FEATURES[stage]:
+            self.store.drop(feature)
+        self.manifest.start(stage, checksum)
+        return np.zeros(0, dtype=np.int64)
+
+    def commit_chunk(self, stage: str, chunk, sites=None):
+        """Record chunks whose features are all in the store."""
+        self.manifest.commit(stage, chunk, {
+            feature: self.store.segments(feature)
+            for feature in _STAGE_FEATURES[stage]}, sites)
 
     def extract_features(self):
         self.extract_sequence()
@@ -69,116 +140,207 @@ class ExtractFeatures(object):
 
     def extract_sequence(self):
         self.output.info('Reading bed file and extracting sequence features.')
-        bed_reader = BedReader(self.args.bed)
         fasta_reader = FastaReader(self.args.reference)
         self.chr_length = {}
         with open(self.args.reference + '.fai', 'r') as open_fai:
             for eachline in open_fai.readlines():
                 spline = eachline.strip().split()
                 self.chr_length.update({spline[0]: int(spline[1])})
-        self.region_list = []
-        self.region_str_set = set()
-        bed_regions = len(open(self.args.bed).readlines())
+        bed_region_set = BedReader(self.args.bed).read_region_set(
+            self.args.bed_region)
+        self.region_set = bed_region_set.unique()
+        # predict reads the shard back to pick the same sites.
+        self.store.write_attr('shard', None)
+        if self.args.shard:
+            depths = read_depths(check_index(
+                self.args.align, self.threads, self.args.csi)) \
+                if self.args.shard_by == 'reads' else None
+            self.region_set = self.region_set.subset(shard_index(
+                self.region_set, self.args.shard, depths))
+            self.store.write_attr('shard', {
+                'shard': self.args.shard, 'shard_by': self.args.shard_by,
+                'depths': depths})
+            self.output.info(f'Keeping {len(self.region_set)} sites of '
+                             f'shard {self.args.shard}.')
+        self.region_strings = self.region_set.strings()
+        self.site_index = SiteIndex.from_region_set(self.region_set)
+        self.output.info(f'Read {len(bed_region_set)} bed lines of '
+                         f'{len(self.region_set)} sites.')
+        seq_region_set = self.region_set.copy()
+        seq_region_set.resize(self.args.seq_window, self.chr_length)
+        completed_index = self.resume_stage('sequence', input_checksum(
+            [self.args.bed, self.args.reference],
+            bed_region=self.args.bed_region, shard=self.args.shard,
+            shard_by=self.args.shard_by,
+            seq_window=self.args.seq_window))
+        pending_index = np.setdiff1d(
+            np.arange(len(self.region_strings)), completed_index)
+        first_chunk = self.manifest.next_chunk('sequence')
+        # sorted by chromosome so that every chromosome is encoded once.
+        pending_index = np.concatenate(
+            [chrom_index for _, chrom_index in seq_region_set.chrom_groups(
+                pending_index)] + [np.zeros(0, dtype=np.int64)])
         with Progress() as progress:
             task = progress.add_task(
-                f'[green]INFO    [cyan]Reading {bed_regions} bed lines...',
-                total=bed_regions)
-            for each_region in bed_reader.read_bed():
-                self.region_list.append(each_region.copy())
-                region_string = str(each_region)
-                self.region_str_set.add(region_string)
-                each_region.resize(self.args.seq_window,
-                                   self.chr_length.get(each_region.chrom, None))
-                if self.args.overwrite:
-                    np.save(f'{self.output_str}/{region_string}.ref_seq.npy',
-                            fasta_reader.fetch_region(each_region, True))
-                else:
-                    ref_seq_path = Path(
-                        f'{self.output_str}/{region_string}.ref_seq.npy')
-                    if not ref_seq_path.is_file():
-                        np.save(f'{self.output_str}/{region_string}.ref_seq.npy',
-                                fasta_reader.fetch_region(each_region, True))
-                progress.advance(task)
+                '[green]INFO    [cyan]Extracting sequence of '
+                f'{len(pending_index)} sites...', total=len(pending_index))
+            for block_start in range(0, len(pending_index), _SEQUENCE_BLOCK):
+                block_index = pending_index[
+                    block_start:block_start+_SEQUENCE_BLOCK]
+                self.save_sequence(fasta_reader, seq_region_set, block_index)
+                self.commit_chunk(
+                    'sequence', first_chunk + block_start // _SEQUENCE_BLOCK,
+                    block_index)
+                progress.advance(task, len(block_index))
         fasta_reader.fasta_file.close()
         self.output.info('Completed extracting sequence features.')
 
+    def save_sequence(self, fasta_reader: FastaReader,
+                      seq_region_set: RegionSet, block_index: np.ndarray):
+        """Encode a block of resized regions at once and save them."""
+        block_index = np.asarray(block_index, dtype=np.int64)
+        # resized regions keep the window and run past the end of
+        # chromosomes shorter than it.
+        full_index = block_index[
+            (seq_region_set.start[block_index] >= 0) &
+            (seq_region_set.end[block_index] <= seq_region_set.chrom_limits(
+                self.chr_length)[block_index])]
+        if len(full_index) < len(block_index):
+            self.output.warning(
+                f'Skipping {len(block_index) - len(full_index)} regions on '
+                f'chromosomes shorter than {self.args.seq_window}.')
+        self.store.append(
+            'ref_seq', [self.region_strings[index] for index in full_index],
+            fasta_reader.fetch_region_set(seq_region_set, full_index)[
+                :, np.newaxis])
+
     def extract_alignment(self):
-        threads = min(self.threads, len(self.region_list))
+        ali_region_set = self.region_set.copy()
+        ali_region_set.resize(self.args.ali_window, self.chr_length)
+        completed_index = self.resume_stage('alignment', input_checksum(
+            [self.args.bed, self.args.reference, self.args.align],
+            bed_region=self.args.bed_region, shard=self.args.shard,
+            shard_by=self.args.shard_by,
+            ali_window=self.args.ali_window,
+            summary=self.args.summary))
+        pending_index = np.setdiff1d(
+            np.arange(len(self.region_strings)), completed_index)
+        indexed_bam = check_index(self.args.align, self.threads,
+                                  self.args.csi)
+        chunks = alignment_chunks(ali_region_set, pending_index,
+                                  read_depths(indexed_bam), self.threads)
+        sweep_chrom_alignment_args_list = [
+            (chrom, [(ali_region_set[index], self.region_strings[index])
+                     for index in chunk_index],
+             indexed_bam, self.args.ali_window)
+            for chrom, chunk_index in chunks]
+        # chunks come back unordered, known by the key of their first site.
+        first_chunk = self.manifest.next_chunk('alignment')
+        chunk_numbers = {
+            self.region_strings[chunk_index[0]]: (first_chunk + chunk,
+                                                  chunk_index)
+            for chunk, (_, chunk_index) in enumerate(chunks)}
+        if not sweep_chrom_alignment_args_list:
+            self.output.info('All alignment & quality features exist.')
+            return None
+        threads = min(self.threads, len(sweep_chrom_alignment_args_list))
         self.output.info(
             f'Using {threads} threads to extract '
             'alignment & quality features.')
-        indexed_bam = check_index(self.args.align)
-        get_region_alignment_args_list = []
-        for each_region in self.region_list:
-            ali_region = each_region.copy()
-            ali_region.resize(
-                self.args.ali_window,
-                self.chr_length.get(each_region.chrom, None))
-            get_region_alignment_args_list.append((
-                ali_region, str(each_region), indexed_bam,
-                self.args.ali_window, self.output_str,
-                self.args.overwrite))
-        with Pool(threads) as pool:
-            _ = pool.map(get_region_alignment, get_region_alignment_args_list)
+        with Progress() as progress:
+            task = progress.add_task(
+                '[green]INFO    [cyan]Sweeping '
+                f'{len(sweep_chrom_alignment_args_list)} region chunks...',
+                total=len(sweep_chrom_alignment_args_list))
+            # cores left over by the chunks decompress alignment blocks.
+            with Pool(threads, initializer=init_worker,
+                      initargs=(indexed_bam, self.args.reference,
+                                self.threads // threads)) as pool:
+                for chunk_features in pool.imap_unordered(
+                        summarize_chrom_alignment if self.args.summary
+                        else compact_chrom_alignment,
+                        sweep_chrom_alignment_args_list):
+                    self.save_alignment(*chunk_features)
+                    self.commit_chunk('alignment', *chunk_numbers[
+                        chunk_features[0][0]])
+                    progress.advance(task)
         self.output.info('Completed extracting alignment & quality features.')
 
+    def save_alignment(self, region_strings: list[str], *chunk_features):
+        """Save the compact read arrays, or the read summaries, of swept
+        regions."""
+        if self.args.summary:
+            alignment_stats, quality_stats = chunk_features
+            self.store.append_summary(
+                'reads_alignment', region_strings, alignment_stats)
+            self.store.append_summary(
+                'reads_quality', region_strings, quality_stats)
+            return None
+        reads_alignment, reads_insertion, reads_quality = chunk_features
+        counts = [len(each) for each in reads_alignment]
+        self.store.append('reads_alignment', region_strings,
+                          np.concatenate(reads_alignment), counts)
+        self.store.append('reads_insertion', region_strings,
+                          np.concatenate(reads_insertion),
+                          [len(each) for each in reads_insertion])
+        self.store.append('reads_quality', region_strings,
+                          np.concatenate(reads_quality), counts)
+
     def extract_current(self):
         self.output.info('Reading ONT current files.')
-        region_info_dict = {}
-        site_str_set = set()
-        current_files = len(open(self.args.current).readlines())
-        with Progress() as progress:
-            task = progress.add_task(
-                f'[green]INFO    [cyan]Reading {current_files} ONT current files...',
-                total=current_files)
-            with open(self.args.current, 'r') as open_list:
-                for eachlist in open_list.readlines():
-                    with open(eachlist.strip(), 'r') as open_current:
-                        for eachline in open_current.readlines():
-                            spline = eachline.strip().split()
-                            site_string = (spline[0] + '_' + spline[5] + '_' +
-                                        str(int(spline[1]) + 2) + '-' +
-                                        str(int(spline[2]) - 2))
-                            if site_string in self.region_str_set:
-                                # region_info_dict.setdefault(
-                                #     site_string, {}).setdefault(
-                                #         'reads_id', []).append(
-                                #             eachlist.strip().split(
-                                #                 '/')[-1].split('.')[0])
-                                region_info_dict.setdefault(
-                                    site_string, {}).setdefault(
-                                        'reads_norm_mean', []).append(
-                                            [float(nm) for nm in
-                                            spline[6].split(',')])
-                                region_info_dict.setdefault(
-                                    site_string, {}).setdefault(
-                                        'reads_norm_stdev', []).append(
-                                            [float(ns) for ns in
-                                            spline[7].split(',')])
-                                region_info_dict.setdefault(
-                                    site_string, {}).setdefault(
-                                        'reads_current', []).append(
-                                            [float(cs) for cs
-                                            in spline[8].split(',')])
-                                site_str_set.add(site_string)
-                    progress.advance(task)
+        self.resume_stage('current', input_checksum(
+            [self.args.bed] + current_inputs(self.args.current),
+            bed_region=self.args.bed_region, shard=self.args.shard,
+            shard_by=self.args.shard_by,
+            cur_window=self.args.cur_window,
+            current_kind=self.args.current_kind,
+            summary=self.args.summary))
+        worker, tasks, task_sizes, unit = current_tasks(
+            self.args.current, _CURRENT_FILES_CHUNK)
+        completed_chunks = self.manifest.chunks('current')
+        pending_chunks = [chunk for chunk in range(len(tasks))
+                          if chunk not in completed_chunks]
+        if not pending_chunks:
+            self.output.info('All current features exist.')
+            return None
+        tasks = [tasks[chunk] for chunk in pending_chunks]
+        task_sizes = [task_sizes[chunk] for chunk in pending_chunks]
+        current_buffer = SegmentBuffer(
+            self.store, _CURRENT_FEATURES, self.args.max_memory << 20,
+            key_names=self.region_strings, summarize=self.args.summary)
+        threads = max(1, min(self.threads, len(tasks)))
+        self.output.info(
+            f'Using {threads} threads to extract current features.')
         with Progress() as progress:
             task = progress.add_task(
-                f'[green]INFO    [cyan]Saving {len(site_str_set)} ONT current features...',
-                total=len(site_str_set))
-            for region_string in site_str_set:
-                region_info = region_info_dict[region_string]
-                # np.save(f'{self.output_str}/{region_string}.reads_id.cur.npy',
-                #         region_info['reads_id'])
-                np.save(f'{self.output_str}/{region_string}.reads_norm_mean.npy',
-                        region_info['reads_norm_mean'])
-                np.save(f'{self.output_str}/{region_string}.reads_norm_stdev.npy',
-                        region_info['reads_norm_stdev'])
-                np.save(f'{self.output_str}/{region_string}.reads_current.npy',
-                        region_info['reads_current'])
-                # del region_info_dict[region_string]
-                # collect()
-                progress.advance(task)
+                f'[green]INFO    [cyan]Reading {sum(task_sizes)} {unit}...',
+                total=sum(task_sizes))
+            # chunks whose lines are all stored or buffered.
+            buffered_chunks = []
+            with Pool(threads, initializer=init_site_index,
+                      initargs=(self.site_index, self.args.cur_window,
+                                self.args.current_kind)) as pool:
+                for (site_ids, current_features), task_size, chunk in zip(
+                        bounded_imap(pool, worker, tasks, 2 * threads),
+                        task_sizes, pending_chunks):
+                    # a flush holds whole chunks unless a chunk alone
+                    # overflows the buffers, which is committed with the
+                    # flush after it.
+                    if current_buffer.keys and \
+                            len(site_ids) > current_buffer.room():
+                        current_buffer.flush()
+                        self.commit_chunk('current', buffered_chunks)
+                        buffered_chunks = []
+                    if len(site_ids):
+                        current_buffer.extend(site_ids, current_features)
+                    buffered_chunks.append(chunk)
+                    if not current_buffer.keys:
+                        self.commit_chunk('current', buffered_chunks)
+                        buffered_chunks = []
+                    progress.advance(task, task_size)
+            current_buffer.flush()
+            if buffered_chunks:
+                self.commit_chunk('current', buffered_chunks)
         self.output.info('Completed extracting current features.')
 
     def process(self):
@@ -187,5 +349,60 @@ class ExtractFeatures(object):
         logger.debug('Starting extracting featres Process.')
         self.check_directory()
         self.extract_features()
+        self.store.close()
+        self.manifest.close()
         self.output.info('Completed extracting featres Process.')
         logger.debug('Completed extracting featres Process.')
+
+
+def compact_chrom_alignment(
+        sweep_args: tuple[str, list[tuple[Region, str]], str, int]):
+    """Sweep a chromosome span and compact the read arrays of every region.
+
+    Args:
+        sweep_args (tuple): chromosome id, list of (resized region, region
+            string) pairs sorted by start, alignment file path and
+            alignment window.
+
+    Returns:
+        region_strings (list): region strings.
+        reads_alignment (list): (reads, ali_window, 5) uint8 array of every
+            region.
+        reads_insertion (list): (insertions, 3) int64 array of every region,
+            see compact_alignment.
+        reads_quality (list): (reads, ali_window) float16 array of every
+            region.
+    """
+    chrom, region_list, alignment_file, ali_window = sweep_args
+    context = worker_context()
+    region_strings, reads_alignment, reads_quality = sweep_chrom_alignment((
+        chrom, region_list, context.alignment(alignment_file), ali_window))
+    reads_alignment, reads_insertion = zip(*[
+        compact_alignment(region_alignment)
+        for region_alignment in reads_alignment]) if reads_alignment \
+        else ((), ())
+    return (region_strings, list(reads_alignment), list(reads_insertion),
+            [region_quality.astype(np.float16)
+             for region_quality in reads_quality])
+
+
+def summarize_chrom_alignment(
+        sweep_args: tuple[str, list[tuple[Region, str]], str, int]):
+    """Sweep a chromosome span and summarize the reads of every region.
+
+    Args:
+        sweep_args (tuple): see compact_chrom_alignment.
+
+    Returns:
+        region_strings (list): region strings.
+        alignment_stats (RunningStats): read alignment summary of the regions.
+        quality_stats (RunningStats): read quality summary of the regions.
+    """
+    chrom, region_list, alignment_file, ali_window = sweep_args
+    context = worker_context()
+    region_strings, reads_alignment, reads_quality = sweep_chrom_alignment((
+        chrom, region_list, context.alignment(alignment_file), ali_window))
+    counts = [len(each) for each in reads_alignment]
+    return (region_strings,
+            RunningStats.from_rows(np.concatenate(reads_alignment), counts),
+            RunningStats.from_rows(np.concatenate(reads_quality), counts))
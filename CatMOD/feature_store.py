@@ -0,0 +1,388 @@
+# -*- coding: utf-8 -*-
+# Copyright 2022 Shang Xie.
+# All rights reserved.
+#
+# This file is part of the CatMOD distribution and
+# governed by your choice of the "CatMOD License Agreement"
+# or the "GNU General Public License v3.0".
+# Please see the LICENSE file that should
+# have been included as part of this package.
+"""Represent a feature store.
+
+What's here:
+
+Chunked, append-friendly HDF5 store of site features.
+-----------------------------------------------------
+
+Classes:
+  - FeatureStore
+  - SegmentBuffer
+"""
+
+from json import dumps, loads
+from pathlib import Path
+
+import h5py
+import numpy as np
+
+from CatMOD.stats import RunningStats, summary_features
+
+
+STORE_FILE = 'features.h5'
+
+_CHUNK_BYTES = 1 << 20
+_INDEX_CHUNK = 4096
+
+
+class FeatureStore(object):
+    """The feature store.
+
+    Every feature is a group of three datasets:
+      - values: rows of all segments concatenated along the first axis, e.g.
+        one row per read for read features or one row per site for site
+        features.
+      - offsets: (segments + 1,) row offsets of the segments in values.
+      - keys: (segments,) site key of every segment.
+    A site may be appended in several segments, which are concatenated in
+    order when the site is read. A summarized feature is stored as count,
+    mean and m2 features holding one RunningStats row per segment, which
+    are combined when the site is read.
+
+    Attributes:
+        store_file (str): store file path.
+        h5_file (h5py.File): opened store file.
+    """
+
+    def __init__(self, store_file: str, mode: str = 'a'):
+        """Initialize FeatureStore.
+
+        Args:
+            store_file (str): store file path, or a folder holding the
+                features.h5 store file.
+            mode (str): h5py file mode, default 'a'.
+        """
+        if Path(store_file).is_dir():
+            store_file = f'{store_file}/{STORE_FILE}'
+        self.store_file = store_file
+        self.h5_file = h5py.File(store_file, mode)
+        self._offsets = {}
+        self._key_index = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __contains__(self, feature: str):
+        return feature in self.h5_file
+
+    def close(self):
+        self.h5_file.close()
+
+    def features(self):
+        """Return the names of all stored features."""
+        return list(self.h5_file)
+
+    def write_attr(self, name: str, value):
+        """Save a JSON-serializable value of the whole store."""
+        self.h5_file.attrs[name] = dumps(value)
+        self.h5_file.flush()
+
+    def read_attr(self, name: str, default=None):
+        """Read a value saved by write_attr, default if missing."""
+        if name not in self.h5_file.attrs:
+            return default
+        return loads(self.h5_file.attrs[name])
+
+    def create(self, feature: str, row_shape: tuple, dtype):
+        """Create an empty feature group."""
+        group = self.h5_file.create_group(feature)
+        chunk_rows = max(1, _CHUNK_BYTES // max(
+            1, np.dtype(dtype).itemsize * int(np.prod(row_shape))))
+        group.create_dataset(
+            'values', shape=(0, *row_shape), maxshape=(None, *row_shape),
+            chunks=(chunk_rows, *row_shape), dtype=dtype, compression='lzf')
+        group.create_dataset(
+            'offsets', data=np.zeros(1, dtype=np.int64), maxshape=(None,),
+            chunks=(_INDEX_CHUNK,))
+        group.create_dataset(
+            'keys', shape=(0,), maxshape=(None,), chunks=(_INDEX_CHUNK,),
+            dtype=h5py.string_dtype())
+
+    def drop(self, feature: str):
+        """Delete a feature group."""
+        if feature in self.h5_file:
+            del self.h5_file[feature]
+        self._offsets.pop(feature, None)
+        self._key_index.pop(feature, None)
+
+    def segments(self, feature: str):
+        """Return the segments of a feature, 0 if missing."""
+        if feature not in self.h5_file:
+            return 0
+        return len(self.offsets(feature)) - 1
+
+    def truncate(self, feature: str, segments: int):
+        """Keep the first segments of a feature, dropping rows and segments
+        appended after them, also by an interrupted append."""
+        if feature not in self.h5_file:
+            return None
+        if not segments:
+            self.drop(feature)
+            return None
+        group = self.h5_file[feature]
+        offsets = group['offsets'][:segments + 1]
+        group['values'].resize(offsets[-1], axis=0)
+        group['offsets'].resize(segments + 1, axis=0)
+        group['keys'].resize(segments, axis=0)
+        self._offsets[feature] = offsets
+        self._key_index.pop(feature, None)
+        self.h5_file.flush()
+
+    def append(self, feature: str, keys: list[str], values: np.ndarray,
+               counts=None):
+        """Append site segments to a feature.
+
+        Args:
+            feature (str): feature name.
+            keys (list): site key of every segment.
+            values (np.ndarray): rows of all segments concatenated.
+            counts (list): rows of every segment, default one row each.
+        """
+        if not len(keys):
+            return None
+        counts = np.ones(len(keys), dtype=np.int64) if counts is None \
+            else np.asarray(counts, dtype=np.int64)
+        if counts.sum() != len(values):
+            raise ValueError(
+                f'{feature} segments hold {counts.sum()} rows, '
+                f'got {len(values)} rows.')
+        if feature not in self.h5_file:
+            self.create(feature, values.shape[1:], values.dtype)
+        group = self.h5_file[feature]
+        values_dataset = group['values']
+        if values.shape[1:] != values_dataset.shape[1:]:
+            raise ValueError(
+                f'{feature} rows should be {values_dataset.shape[1:]}, '
+                f'got {values.shape[1:]}.')
+        rows = values_dataset.shape[0]
+        values_dataset.resize(rows + len(values), axis=0)
+        values_dataset[rows:] = values.astype(values_dataset.dtype,
+                                              copy=False)
+        offsets = self.offsets(feature)
+        segments = len(offsets) - 1
+        new_offsets = rows + np.cumsum(counts)
+        group['offsets'].resize(segments + 1 + len(keys), axis=0)
+        group['offsets'][segments + 1:] = new_offsets
+        group['keys'].resize(segments + len(keys), axis=0)
+        group['keys'][segments:] = list(keys)
+        self._offsets[feature] = np.concatenate((offsets, new_offsets))
+        if feature in self._key_index:
+            key_index = self._key_index[feature]
+            for segment, key in enumerate(keys, segments):
+                key_index.setdefault(key, []).append(segment)
+        self.h5_file.flush()
+
+    def append_summary(self, feature: str, keys: list[str],
+                       stats: RunningStats):
+        """Append one summary segment per site to a summarized feature."""
+        for summary_feature, values in zip(
+                summary_features(feature),
+                (stats.count, stats.mean, stats.m2)):
+            self.append(summary_feature, keys, values)
+
+    def has_summary(self, feature: str):
+        return summary_features(feature)[0] in self.h5_file
+
+    def read_summary(self, feature: str, keys: list[str]):
+        """Read and combine all summary segments of sites.
+
+        Args:
+            feature (str): summarized feature name.
+            keys (list): site keys, missing sites have zero count.
+
+        Returns:
+            RunningStats: summary of every site.
+        """
+        count_feature, mean_feature, m2_feature = summary_features(feature)
+        count, segments = self.read_sites(count_feature, keys)
+        mean, _ = self.read_sites(mean_feature, keys)
+        m2, _ = self.read_sites(m2_feature, keys)
+        return RunningStats.combine(count, mean, m2, segments)
+
+    def offsets(self, feature: str):
+        """Return the (segments + 1,) row offsets of a feature."""
+        if feature not in self._offsets:
+            self._offsets[feature] = self.h5_file[feature]['offsets'][:]
+        return self._offsets[feature]
+
+    def key_index(self, feature: str):
+        """Return the site key -> segments index of a feature."""
+        if feature not in self._key_index:
+            key_index = {}
+            if feature in self.h5_file:
+                for segment, key in enumerate(
+                        self.h5_file[feature]['keys'].asstr()[:]):
+                    key_index.setdefault(key, []).append(segment)
+            self._key_index[feature] = key_index
+        return self._key_index[feature]
+
+    def has(self, feature: str, key: str):
+        return key in self.key_index(feature)
+
+    def keys(self, feature: str):
+        return list(self.key_index(feature))
+
+    def row_shape(self, feature: str):
+        return self.h5_file[feature]['values'].shape[1:]
+
+    def read(self, feature: str, key: str):
+        """Read all rows of a site."""
+        values, _ = self.read_sites(feature, [key])
+        return values
+
+    def read_sites(self, feature: str, keys: list[str]):
+        """Read the rows of many sites at once.
+
+        Args:
+            feature (str): feature name.
+            keys (list): site keys, missing sites have no rows.
+
+        Returns:
+            values (np.ndarray): rows of the sites concatenated in order.
+            counts (np.ndarray): (sites,) rows of every site.
+        """
+        key_index = self.key_index(feature)
+        values_dataset = self.h5_file[feature]['values']
+        site_segments = [key_index.get(key, []) for key in keys]
+        segments = np.array(
+            [segment for each in site_segments for segment in each],
+            dtype=np.int64)
+        offsets = self.offsets(feature)
+        starts, stops = offsets[segments], offsets[segments + 1]
+        lengths = stops - starts
+        counts = np.zeros(len(keys), dtype=np.int64)
+        np.add.at(counts,
+                  np.repeat(np.arange(len(keys)),
+                            [len(each) for each in site_segments]),
+                  lengths)
+        if not lengths.sum():
+            return np.zeros((0, *values_dataset.shape[1:]),
+                            dtype=values_dataset.dtype), counts
+        low, high = starts.min(), stops.max()
+        if high - low <= 4 * lengths.sum() + _INDEX_CHUNK:
+            # read the covering span at once, sites written together are
+            # mostly contiguous.
+            rows = np.repeat(starts - low - np.cumsum(lengths) + lengths,
+                             lengths) + np.arange(lengths.sum())
+            return values_dataset[low:high][rows], counts
+        return np.concatenate([
+            values_dataset[start:stop]
+            for start, stop in zip(starts, stops)]), counts
+
+
+class SegmentBuffer(object):
+    """The preallocated row buffer of a feature store.
+
+    Rows of several features are added one site at a time into fixed-size
+    buffers, and appended to the store grouped by site key whenever the
+    buffers are full, so memory stays bounded by the buffer budget. With
+    summarize set, only the RunningStats of every site are appended.
+
+    Attributes:
+        store (FeatureStore): feature store to flush into.
+        features (tuple): feature names.
+        max_bytes (int): buffer budget in bytes.
+        key_names (list): site key of every integer key, or None if keys
+            are site keys.
+        summarize (bool): append site summaries instead of rows.
+        capacity (int): rows held before flushing.
+    """
+
+    def __init__(self, store: FeatureStore, features: tuple, max_bytes: int,
+                 dtype=np.float32, key_names=None, summarize: bool = False):
+        """Initialize SegmentBuffer.
+
+        Args:
+            store (FeatureStore): feature store to flush into.
+            features (tuple): feature names.
+            max_bytes (int): buffer budget in bytes.
+            dtype: buffer dtype, default np.float32.
+            key_names (list): site key of every integer key, default None.
+            summarize (bool): append site summaries, default False.
+        """
+        self.store = store
+        self.features = features
+        self.max_bytes = max_bytes
+        self.key_names = key_names
+        self.summarize = summarize
+        self.dtype = np.dtype(dtype)
+        self.capacity = 0
+        self.buffers = None
+        self.keys = []
+
+    def room(self):
+        """Return the rows added before the buffers are full, None before
+        the first row sizes them."""
+        if self.buffers is None:
+            return None
+        return self.capacity - len(self.keys)
+
+    def add(self, key: str, rows: tuple):
+        """Add one row of every feature for a site."""
+        if self.buffers is None:
+            row_bytes = self.dtype.itemsize * sum(
+                int(np.prod(np.shape(row))) for row in rows)
+            self.capacity = max(1, self.max_bytes // row_bytes)
+            self.buffers = [np.empty((self.capacity, *np.shape(row)),
+                                     dtype=self.dtype) for row in rows]
+        size = len(self.keys)
+        for feature, buffer, row in zip(self.features, self.buffers, rows):
+            if np.shape(row) != buffer.shape[1:]:
+                raise ValueError(
+                    f'{feature} rows should be {buffer.shape[1:]}, '
+                    f'got {np.shape(row)}.')
+            buffer[size] = row
+        self.keys.append(key)
+        if len(self.keys) == self.capacity:
+            self.flush()
+
+    def extend(self, keys: list[str], rows: tuple):
+        """Add many rows of every feature, one row per key."""
+        start = 0
+        while start < len(keys):
+            if self.buffers is None:
+                self.add(keys[start], tuple(row[start] for row in rows))
+                start += 1
+                continue
+            size = len(self.keys)
+            stop = min(len(keys), start + self.capacity - size)
+            for feature, buffer, row in zip(self.features, self.buffers, rows):
+                if row.shape[1:] != buffer.shape[1:]:
+                    raise ValueError(
+                        f'{feature} rows should be {buffer.shape[1:]}, '
+                        f'got {row.shape[1:]}.')
+                buffer[size:size+stop-start] = row[start:stop]
+            self.keys.extend(keys[start:stop])
+            start = stop
+            if len(self.keys) == self.capacity:
+                self.flush()
+
+    def flush(self):
+        """Append the buffered rows to the store grouped by site key."""
+        if not self.keys:
+            return None
+        keys, inverse, counts = np.unique(
+            self.keys, return_inverse=True, return_counts=True)
+        order = np.argsort(inverse, kind='stable')
+        keys = keys.tolist() if self.key_names is None else [
+            self.key_names[key] for key in keys]
+        for feature, buffer in zip(self.features, self.buffers):
+            rows = buffer[:len(self.keys)][order]
+            if self.summarize:
+                self.store.append_summary(
+                    feature, keys, RunningStats.from_rows(rows, counts))
+            else:
+                self.store.append(feature, keys, rows, counts)
+        self.keys = []
@@ -41,9 +41,13 @@ Parse the sub-command line arguments.
 
 Classes:
   - DPArgs
+  - IndexReferenceArgs
+  - ConvertCurrentArgs
   - EFArgs
   - TrainArgs
   - PredictArgs
+  - RunArgs
+  - MergeArgs
 """
 
 from argparse import ArgumentParser, HelpFormatter
@@ -279,12 +283,151 @@ class DPArgs(CatmodArgs):
         #     'type': str,
         #     'nargs': '+',
         #     'help': 'input negative bed files.'})
+        argument_list.append({
+            'opts': ('-b', '--bed'),
+            'dest': 'bed',
+            'required': False,
+            'type': str,
+            'default': None,
+            'help': 'only keep the currents of the sites of a bed file '
+                    '[default=all positions].'})
+        argument_list.append({
+            'opts': ('-cg', '--corrected_group'),
+            'dest': 'corrected_group',
+            'required': False,
+            'type': str,
+            'default': 'RawGenomeCorrected_000',
+            'help': 'tombo resquiggle analysis group '
+                    '[default=RawGenomeCorrected_000].'})
+        argument_list.append({
+            'opts': ('-bs', '--basecall_subgroup'),
+            'dest': 'basecall_subgroup',
+            'required': False,
+            'type': str,
+            'default': 'BaseCalled_template',
+            'help': 'tombo resquiggle basecall subgroup '
+                    '[default=BaseCalled_template].'})
+        argument_list.append({
+            'opts': ('-d', '--dtype'),
+            'dest': 'dtype',
+            'required': False,
+            'type': str,
+            'default': 'float32',
+            'choices': ('float16', 'float32'),
+            'help': 'float type of the norm and current columns '
+                    '[default=float32].'})
+        argument_list.append({
+            'opts': ('-cw', '--cur_window'),
+            'dest': 'cur_window',
+            'required': False,
+            'type': int,
+            'default': 256,
+            'help': 'length every site current is resampled to '
+                    '[default=256].'})
+        argument_list.append({
+            'opts': ('-ck', '--current_kind'),
+            'dest': 'current_kind',
+            'required': False,
+            'type': str,
+            'default': 'linear',
+            'help': 'interpolation kind resampling currents, see '
+                    'extract_features --current_kind [default=linear].'})
+        argument_list.append({
+            'opts': ('-t', '--threads'),
+            'dest': 'threads',
+            'required': False,
+            'type': int,
+            'default': 0,
+            'help': 'number of threads to use [default=all].'})
+        argument_list.append({
+            'opts': ('--dna',),
+            'dest': 'dna',
+            'required': False,
+            'type': bool,
+            'default': False,
+            'help': 'reads are DNA, whose signal is not reversed '
+                    '[default=False].'})
+        argument_list.append({
+            'opts': ('--overwrite',),
+            'dest': 'overwrite',
+            'required': False,
+            'type': bool,
+            'default': False,
+            'help': 'overwrite [default=False].'})
         argument_list.append({
             'opts': ('-o', '--output'),
             'dest': 'output',
             'required': True,
             'type': str,
-            'help': 'output folder path.'})
+            'help': 'output current table folder path.'})
+        return argument_list
+
+
+class IndexReferenceArgs(CatmodArgs):
+    """."""
+
+    @staticmethod
+    def get_argument_list():
+        """Put the arguments in a list so that they are accessible."""
+        argument_list = []
+        argument_list.append({
+            'opts': ('-r', '--ref'),
+            'dest': 'reference',
+            'required': True,
+            'type': str,
+            'help': 'input reference fasta file.'})
+        argument_list.append({
+            'opts': ('--overwrite',),
+            'dest': 'overwrite',
+            'required': False,
+            'type': bool,
+            'default': False,
+            'help': 'overwrite [default=False].'})
+        return argument_list
+
+
+class ConvertCurrentArgs(CatmodArgs):
+    """."""
+
+    @staticmethod
+    def get_argument_list():
+        """Put the arguments in a list so that they are accessible."""
+        argument_list = []
+        argument_list.append({
+            'opts': ('-c', '--current'),
+            'dest': 'current',
+            'required': True,
+            'type': str,
+            'help': 'input ONT current index file.'})
+        argument_list.append({
+            'opts': ('-d', '--dtype'),
+            'dest': 'dtype',
+            'required': False,
+            'type': str,
+            'default': 'float32',
+            'choices': ('float16', 'float32'),
+            'help': 'float type of the norm and current columns '
+                    '[default=float32].'})
+        argument_list.append({
+            'opts': ('-t', '--threads'),
+            'dest': 'threads',
+            'required': False,
+            'type': int,
+            'default': 0,
+            'help': 'number of threads to use [default=all].'})
+        argument_list.append({
+            'opts': ('--overwrite',),
+            'dest': 'overwrite',
+            'required': False,
+            'type': bool,
+            'default': False,
+            'help': 'overwrite [default=False].'})
+        argument_list.append({
+            'opts': ('-o', '--output'),
+            'dest': 'output',
+            'required': True,
+            'type': str,
+            'help': 'output current table folder path.'})
         return argument_list
 
 
@@ -301,6 +444,15 @@ class EFArgs(CatmodArgs):
             'required': True,
             'type': str,
             'help': 'input all samples bed file.'})
+        argument_list.append({
+            'opts': ('-br', '--bed_region'),
+            'dest': 'bed_region',
+            'required': False,
+            'type': str,
+            'default': None,
+            'help': 'only read the sites of a chromosome or chrom:start-end '
+                    'interval from a bgzip-compressed, tabix-indexed bed '
+                    'file [default=all].'})
         argument_list.append({
             'opts': ('-r', '--ref'),
             'dest': 'reference',
@@ -313,12 +465,21 @@ class EFArgs(CatmodArgs):
             'required': True,
             'type': str,
             'help': 'input ONT alignment bam file.'})
+        argument_list.append({
+            'opts': ('--csi',),
+            'dest': 'csi',
+            'required': False,
+            'type': bool,
+            'default': False,
+            'help': 'index an unindexed alignment file with csi instead of '
+                    'bai, as done anyway for chromosomes longer than 2^29 '
+                    '[default=False].'})
         argument_list.append({
             'opts': ('-c', '--current'),
             'dest': 'current',
             'required': True,
             'type': str,
-            'help': 'input ONT current folder or index file.'})
+            'help': 'input ONT current table folder or index file.'})
         argument_list.append({
             'opts': ('-sw', '--seq_window'),
             'dest': 'seq_window',
@@ -358,6 +519,26 @@ class EFArgs(CatmodArgs):
                     'half-integers (e.g. 0.5, 1.5) in that `nearest-up` '
                     'rounds up and `nearest` rounds down. Default is `linear`.'
         })
+        argument_list.append({
+            'opts': ('-sh', '--shard'),
+            'dest': 'shard',
+            'required': False,
+            'type': str,
+            'default': None,
+            'help': 'only extract the sites of shard K of N given as K/N, '
+                    'K counting from 1, of the genome cut into N runs '
+                    'of 1 Mb bins; merge shard outputs with catmod merge '
+                    '[default=all].'})
+        argument_list.append({
+            'opts': ('-sb', '--shard_by'),
+            'dest': 'shard_by',
+            'required': False,
+            'type': str,
+            'choices': ('sites', 'reads'),
+            'default': 'sites',
+            'help': 'balance shards by site count, or by site count times '
+                    'the mapped reads per base of the alignment index '
+                    '[default=sites].'})
         argument_list.append({
             'opts': ('-t', '--threads'),
             'dest': 'threads',
@@ -372,6 +553,22 @@ class EFArgs(CatmodArgs):
             'type': int,
             'default': 0,
             'help': 'random seed for sampling to use [default=0].'})
+        argument_list.append({
+            'opts': ('-mm', '--max_memory'),
+            'dest': 'max_memory',
+            'required': False,
+            'type': int,
+            'default': 4096,
+            'help': 'memory in MB to buffer current features before '
+                    'writing [default=4096].'})
+        argument_list.append({
+            'opts': ('--summary',),
+            'dest': 'summary',
+            'required': False,
+            'type': bool,
+            'default': False,
+            'help': 'only store the read count, mean and variance of read '
+                    'features per site [default=False].'})
         argument_list.append({
             'opts': ('--use_memory',),
             'dest': 'use_memory',
@@ -402,6 +599,91 @@ class TrainArgs(CatmodArgs):
     def get_argument_list():
         """Put the arguments in a list so that they are accessible."""
         argument_list = []
+        argument_list.append({
+            'opts': ('-p', '--pos'),
+            'dest': 'positive',
+            'required': True,
+            'type': str,
+            'nargs': '+',
+            'help': 'input positive bed files.'})
+        argument_list.append({
+            'opts': ('-n', '--neg'),
+            'dest': 'negative',
+            'required': True,
+            'type': str,
+            'nargs': '+',
+            'help': 'input negative bed files.'})
+        argument_list.append({
+            'opts': ('-d', '--datasets'),
+            'dest': 'datasets',
+            'required': True,
+            'type': str,
+            'nargs': '+',
+            'help': 'input datasets folder paths.'})
+        argument_list.append({
+            'opts': ('-i', '--iterations'),
+            'dest': 'iterations',
+            'required': False,
+            'type': int,
+            'default': 1000,
+            'help': 'number of boosting iterations [default=1000].'})
+        argument_list.append({
+            'opts': ('-lr', '--learning_rate'),
+            'dest': 'learning_rate',
+            'required': False,
+            'type': float,
+            'default': None,
+            'help': 'learning rate [default=chosen by CatBoost].'})
+        argument_list.append({
+            'opts': ('-dp', '--depth'),
+            'dest': 'depth',
+            'required': False,
+            'type': int,
+            'default': 6,
+            'help': 'depth of the trees [default=6].'})
+        argument_list.append({
+            'opts': ('-bc', '--border_count'),
+            'dest': 'border_count',
+            'required': False,
+            'type': int,
+            'default': 254,
+            'help': 'number of borders quantizing every feature '
+                    '[default=254].'})
+        argument_list.append({
+            'opts': ('-pc', '--pool_cache'),
+            'dest': 'pool_cache',
+            'required': False,
+            'type': str,
+            'default': None,
+            'help': 'quantized pool file reused by later runs on the same '
+                    'inputs [default=None].'})
+        argument_list.append({
+            'opts': ('-t', '--threads'),
+            'dest': 'threads',
+            'required': False,
+            'type': int,
+            'default': 0,
+            'help': 'number of threads to use [default=all].'})
+        argument_list.append({
+            'opts': ('-s', '--seed'),
+            'dest': 'seed',
+            'required': False,
+            'type': int,
+            'default': 0,
+            'help': 'random seed for training to use [default=0].'})
+        argument_list.append({
+            'opts': ('--overwrite',),
+            'dest': 'overwrite',
+            'required': False,
+            'type': bool,
+            'default': False,
+            'help': 'rebuild the quantized pool cache [default=False].'})
+        argument_list.append({
+            'opts': ('-o', '--output'),
+            'dest': 'output',
+            'required': True,
+            'type': str,
+            'help': 'output model .cbm file path.'})
         return argument_list
 
 
@@ -418,6 +700,15 @@ class PredictArgs(CatmodArgs):
             'required': True,
             'type': str,
             'help': 'input all samples bed file.'})
+        argument_list.append({
+            'opts': ('-br', '--bed_region'),
+            'dest': 'bed_region',
+            'required': False,
+            'type': str,
+            'default': None,
+            'help': 'only read the sites of a chromosome or chrom:start-end '
+                    'interval from a bgzip-compressed, tabix-indexed bed '
+                    'file [default=all].'})
         argument_list.append({
             'opts': ('-d', '--datasets'),
             'dest': 'datasets',
@@ -430,6 +721,44 @@ class PredictArgs(CatmodArgs):
             'required': True,
             'type': str,
             'help': 'input saved model file path.'})
+        argument_list.append({
+            'opts': ('-sh', '--shard'),
+            'dest': 'shard',
+            'required': False,
+            'type': str,
+            'default': None,
+            'help': 'only predict the sites of shard K of N given as K/N, '
+                    'K counting from 1, of the genome cut into N runs '
+                    'of 1 Mb bins; merge shard outputs with catmod merge '
+                    '[default=all].'})
+        argument_list.append({
+            'opts': ('-sb', '--shard_by'),
+            'dest': 'shard_by',
+            'required': False,
+            'type': str,
+            'choices': ('sites', 'reads'),
+            'default': 'sites',
+            'help': 'balance shards by site count, or by site count times '
+                    'the mapped reads per base of the alignment index, as '
+                    'extract_features did; read from the datasets of a '
+                    'shard [default=sites].'})
+        argument_list.append({
+            'opts': ('-a', '--align'),
+            'dest': 'align',
+            'required': False,
+            'type': str,
+            'default': None,
+            'help': 'input ONT alignment bam file, only to balance shards '
+                    'of datasets that do not record them by reads.'})
+        argument_list.append({
+            'opts': ('--csi',),
+            'dest': 'csi',
+            'required': False,
+            'type': bool,
+            'default': False,
+            'help': 'index an unindexed alignment file with csi instead of '
+                    'bai, as done anyway for chromosomes longer than 2^29 '
+                    '[default=False].'})
         argument_list.append({
             'opts': ('-t', '--threads'),
             'dest': 'threads',
@@ -444,3 +773,144 @@ class PredictArgs(CatmodArgs):
             'type': str,
             'help': 'output file path.'})
         return argument_list
+
+
+class RunArgs(CatmodArgs):
+    """."""
+
+    @staticmethod
+    def get_argument_list():
+        """Put the arguments in a list so that they are accessible."""
+        argument_list = []
+        argument_list.append({
+            'opts': ('-b', '--bed'),
+            'dest': 'bed',
+            'required': True,
+            'type': str,
+            'help': 'input all samples bed file.'})
+        argument_list.append({
+            'opts': ('-br', '--bed_region'),
+            'dest': 'bed_region',
+            'required': False,
+            'type': str,
+            'default': None,
+            'help': 'only read the sites of a chromosome or chrom:start-end '
+                    'interval from a bgzip-compressed, tabix-indexed bed '
+                    'file [default=all].'})
+        argument_list.append({
+            'opts': ('-r', '--ref'),
+            'dest': 'reference',
+            'required': True,
+            'type': str,
+            'help': 'input reference fasta file.'})
+        argument_list.append({
+            'opts': ('-a', '--align'),
+            'dest': 'align',
+            'required': True,
+            'type': str,
+            'help': 'input ONT alignment bam file.'})
+        argument_list.append({
+            'opts': ('--csi',),
+            'dest': 'csi',
+            'required': False,
+            'type': bool,
+            'default': False,
+            'help': 'index an unindexed alignment file with csi instead of '
+                    'bai, as done anyway for chromosomes longer than 2^29 '
+                    '[default=False].'})
+        argument_list.append({
+            'opts': ('-c', '--current'),
+            'dest': 'current',
+            'required': True,
+            'type': str,
+            'help': 'input ONT current table folder or index file.'})
+        argument_list.append({
+            'opts': ('-m', '--model'),
+            'dest': 'model',
+            'required': True,
+            'type': str,
+            'help': 'input saved model file path.'})
+        argument_list.append({
+            'opts': ('-sw', '--seq_window'),
+            'dest': 'seq_window',
+            'required': False,
+            'type': int,
+            'default': 101,
+            'help': 'length of sequence window to use [default=101].'})
+        argument_list.append({
+            'opts': ('-aw', '--ali_window'),
+            'dest': 'ali_window',
+            'required': False,
+            'type': int,
+            'default': 41,
+            'help': 'length of alignment window to use [default=41].'})
+        argument_list.append({
+            'opts': ('-cw', '--cur_window'),
+            'dest': 'cur_window',
+            'required': False,
+            'type': int,
+            'default': 256,
+            'help': 'length of current window window to use [default=256].'})
+        argument_list.append({
+            'opts': ('-ck', '--current_kind'),
+            'dest': 'current_kind',
+            'required': False,
+            'type': str,
+            'default': 'linear',
+            'help': 'Specifies the kind of interpolation as a string or as an '
+                    'integer specifying the order of the spline interpolator '
+                    'to use. The string has to be one of `linear`, `nearest`, '
+                    '`nearest-up`, `zero`, `slinear`, `quadratic`, `cubic`, '
+                    '`previous`, or `next`. `zero`, `slinear`, `quadratic` '
+                    'and `cubic` refer to a spline interpolation of zeroth, '
+                    'first, second or third order; `previous` and `next` '
+                    'simply return the previous or next value of the point; '
+                    '`nearest-up` and `nearest` differ when interpolating '
+                    'half-integers (e.g. 0.5, 1.5) in that `nearest-up` '
+                    'rounds up and `nearest` rounds down. Default is `linear`.'
+        })
+        argument_list.append({
+            'opts': ('-t', '--threads'),
+            'dest': 'threads',
+            'required': False,
+            'type': int,
+            'default': 0,
+            'help': 'number of threads to use [default=all].'})
+        argument_list.append({
+            'opts': ('-o', '--output'),
+            'dest': 'output',
+            'required': True,
+            'type': str,
+            'help': 'output file path.'})
+        return argument_list
+
+
+class MergeArgs(CatmodArgs):
+    """."""
+
+    @staticmethod
+    def get_argument_list():
+        """Put the arguments in a list so that they are accessible."""
+        argument_list = []
+        argument_list.append({
+            'opts': ('-i', '--input'),
+            'dest': 'input',
+            'required': True,
+            'nargs': '+',
+            'type': str,
+            'help': 'input datasets folders or prediction tables of the '
+                    'shards.'})
+        argument_list.append({
+            'opts': ('--overwrite',),
+            'dest': 'overwrite',
+            'required': False,
+            'type': bool,
+            'default': False,
+            'help': 'overwrite [default=False].'})
+        argument_list.append({
+            'opts': ('-o', '--output'),
+            'dest': 'output',
+            'required': True,
+            'type': str,
+            'help': 'output datasets folder or prediction table path.'})
+        return argument_list
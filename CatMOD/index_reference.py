@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+# Copyright 2022 Shang Xie.
+# All rights reserved.
+#
+# This file is part of the CatMOD distribution and
+# governed by your choice of the "CatMOD License Agreement"
+# or the "GNU General Public License v3.0".
+# Please see the LICENSE file that should
+# have been included as part of this package.
+"""Represent a reference encoding.
+
+What's here:
+
+Write the memory-mappable encoded reference of a fasta file.
+------------------------------------------------------------
+
+Classes:
+  - IndexReference:
+"""
+
+from json import dump
+from logging import getLogger
+from pathlib import Path
+
+import numpy as np
+
+from rich.progress import Progress
+
+from CatMOD.reader.fasta import (
+    FastaReader, REFERENCE_CODES_SUFFIX, REFERENCE_INDEX_SUFFIX, seq2codes)
+from CatMOD.sys_output import Output
+
+logger = getLogger(__name__)  # pylint: disable=invalid-name
+
+
+class IndexReference(object):
+    """The index reference process.
+
+    Every base is stored as one uint8 code of the IUPAC one-hot table of
+    reader.fasta, 255 for invalid bases, and chromosomes are concatenated
+    in .fai order. The offset table is written last into the json index,
+    so an interrupted run is never used.
+
+    Attributes:
+      - args: Arguments.
+      - output: Output info, warning and error.
+    """
+
+    def __init__(self, arguments):
+        """Initialize IndexReference."""
+        self.args = arguments
+        self.output = Output()
+        self.output.info(
+            f'Initializing {self.__class__.__name__}: (args: {arguments}.')
+        logger.debug(
+            f'Initializing {self.__class__.__name__}: (args: {arguments}.')
+
+    def index_reference(self):
+        codes_path = Path(self.args.reference + REFERENCE_CODES_SUFFIX)
+        index_path = Path(self.args.reference + REFERENCE_INDEX_SUFFIX)
+        if index_path.is_file() and not self.args.overwrite:
+            self.output.info(f'{codes_path} exists, use --overwrite to '
+                             'rewrite it.')
+            return None
+        index_path.unlink(missing_ok=True)
+        fasta_reader = FastaReader(self.args.reference)
+        chroms, lengths = [], []
+        with open(self.args.reference + '.fai', 'r') as open_fai:
+            for eachline in open_fai:
+                spline = eachline.strip().split()
+                chroms.append(spline[0])
+                lengths.append(int(spline[1]))
+        offsets = np.concatenate(([0], np.cumsum(lengths)[:-1])).astype(
+            np.int64).tolist()
+        codes = np.lib.format.open_memmap(
+            codes_path, mode='w+', dtype=np.uint8, shape=(sum(lengths),))
+        with Progress() as progress:
+            invalid = 0
+            task = progress.add_task(
+                f'[green]INFO    [cyan]Encoding {len(chroms)} chromosomes...',
+                total=sum(lengths))
+            for chrom, offset, length in zip(chroms, offsets, lengths):
+                chrom_codes = seq2codes(
+                    fasta_reader.fasta_file.fetch(chrom), check=False)
+                codes[offset:offset+length] = chrom_codes
+                invalid += int((chrom_codes == 255).sum())
+                progress.advance(task, length)
+        codes.flush()
+        del codes
+        fasta_reader.fasta_file.close()
+        if invalid:
+            self.output.warning(
+                f'{self.args.reference} holds {invalid} non-IUPAC bases, '
+                'windows covering them are rejected.')
+        fasta_stat = Path(self.args.reference).stat()
+        with open(index_path, 'w') as open_index:
+            dump({'chroms': chroms, 'offsets': offsets, 'lengths': lengths,
+                  'fasta_size': fasta_stat.st_size,
+                  'fasta_mtime_ns': fasta_stat.st_mtime_ns}, open_index)
+        self.output.info(f'Completed writing {codes_path}.')
+
+    def process(self):
+        """Call the index reference object."""
+        self.output.info('Starting index reference Process.')
+        logger.debug('Starting index reference Process.')
+        self.index_reference()
+        self.output.info('Completed index reference Process.')
+        logger.debug('Completed index reference Process.')
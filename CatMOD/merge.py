@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+# Copyright 2022 Shang Xie.
+# All rights reserved.
+#
+# This file is part of the CatMOD distribution and
+# governed by your choice of the "CatMOD License Agreement"
+# or the "GNU General Public License v3.0".
+# Please see the LICENSE file that should
+# have been included as part of this package.
+"""Represent a merge process.
+
+What's here:
+
+Merge the feature stores or prediction tables of shards.
+--------------------------------------------------------
+
+Classes:
+  - Merge:
+"""
+
+from logging import getLogger
+from pathlib import Path
+
+from rich.progress import Progress
+
+from CatMOD.feature_store import FeatureStore, STORE_FILE
+from CatMOD.shard import site_key
+from CatMOD.sys_output import Output
+
+logger = getLogger(__name__)  # pylint: disable=invalid-name
+
+_MERGE_SITES = 4096
+
+
+class Merge(object):
+    """The merge process.
+
+    Shards of extract_features and predict cover disjoint sites, so the
+    feature stores of shards merge into one store holding every site once,
+    with all segments of a site in one segment, and the prediction tables
+    of shards into one table. Both are sorted by chromosome, start, end and
+    strand, so the result does not depend on the order of the shards.
+
+    Attributes:
+      - args: Arguments.
+      - output: Output info, warning and error.
+    """
+
+    def __init__(self, arguments):
+        """Initialize Merge."""
+        self.args = arguments
+        self.output = Output()
+        self.output.info(
+            f'Initializing {self.__class__.__name__}: (args: {arguments}.')
+        logger.debug(
+            f'Initializing {self.__class__.__name__}: (args: {arguments}.')
+        self.stores = [Path(each_input).is_dir()
+                       for each_input in self.args.input]
+        if any(self.stores) and not all(self.stores):
+            raise ValueError(
+                'Inputs should be all datasets folders or all prediction '
+                'tables.')
+        for each_input, is_store in zip(self.args.input, self.stores):
+            if is_store and not (Path(each_input) / STORE_FILE).is_file():
+                raise FileNotFoundError(
+                    f'{each_input} lacks {STORE_FILE} feature store.')
+            if not is_store and not Path(each_input).is_file():
+                raise FileNotFoundError(f'{each_input} does not exist.')
+
+    def merge_stores(self):
+        """Merge the feature stores of shards feature by feature."""
+        output_path = Path(self.args.output)
+        store_path = output_path / STORE_FILE
+        if store_path.is_file():
+            if not self.args.overwrite:
+                self.output.error(
+                    f'{output_path} already holds a feature store, use '
+                    '--overwrite to replace it.')
+                raise SystemExit
+            self.output.info(f'Overwriting {store_path}.')
+            store_path.unlink()
+        output_path.mkdir(parents=True, exist_ok=True)
+        input_stores = [FeatureStore(each_input, 'r')
+                        for each_input in self.args.input]
+        features = list(dict.fromkeys(
+            feature for input_store in input_stores
+            for feature in input_store.features()))
+        with FeatureStore(str(store_path), 'w') as store, \
+                Progress() as progress:
+            task = progress.add_task(
+                f'[green]INFO    [cyan]Merging {len(features)} features of '
+                f'{len(input_stores)} feature stores...',
+                total=len(features))
+            for feature in features:
+                self.merge_feature(store, input_stores, feature)
+                progress.advance(task)
+        for input_store in input_stores:
+            input_store.close()
+        self.output.info(f'Saved merged feature store {store_path}.')
+
+    def merge_feature(self, store: FeatureStore, input_stores: list,
+                      feature: str):
+        """Append the sites of a feature in all stores in sorted order."""
+        site_stores = {}
+        for store_number, input_store in enumerate(input_stores):
+            if feature not in input_store:
+                continue
+            for key in input_store.keys(feature):
+                if site_stores.setdefault(key, store_number) != store_number:
+                    raise ValueError(
+                        f'{key} {feature} is in both '
+                        f'{self.args.input[site_stores[key]]} and '
+                        f'{self.args.input[store_number]}, shards should '
+                        'hold disjoint sites.')
+        keys = sorted(site_stores, key=site_key)
+        for block_start in range(0, len(keys), _MERGE_SITES):
+            block_keys = keys[block_start:block_start+_MERGE_SITES]
+            # runs of sites of the same store are read at once.
+            run_start = 0
+            for run_end in range(1, len(block_keys) + 1):
+                if run_end < len(block_keys) and site_stores[
+                        block_keys[run_end]] == site_stores[
+                            block_keys[run_start]]:
+                    continue
+                run_keys = block_keys[run_start:run_end]
+                values, counts = input_stores[
+                    site_stores[run_keys[0]]].read_sites(feature, run_keys)
+                store.append(feature, run_keys, values, counts)
+                run_start = run_end
+
+    def merge_tables(self):
+        """Merge the prediction tables of shards into one sorted table."""
+        lines = []
+        for each_input in self.args.input:
+            with open(each_input, 'r') as open_table:
+                lines.extend(eachline.rstrip('\n').split('\t')
+                             for eachline in open_table if eachline.strip())
+        lines.sort(key=lambda spline: (
+            spline[0], int(spline[1]), int(spline[2]), spline[5]))
+        if Path(self.args.output).is_file() and not self.args.overwrite:
+            self.output.error(
+                f'{self.args.output} already exists, use --overwrite to '
+                'replace it.')
+            raise SystemExit
+        with open(self.args.output, 'w') as open_output:
+            for spline in lines:
+                open_output.write('\t'.join(spline) + '\n')
+        self.output.info(
+            f'Saved {len(lines)} merged predictions {self.args.output}.')
+
+    def process(self):
+        """Call the merging object."""
+        self.output.info('Starting merging Process.')
+        logger.debug('Starting merging Process.')
+        if all(self.stores):
+            self.merge_stores()
+        else:
+            self.merge_tables()
+        self.output.info('Completed merging Process.')
+        logger.debug('Completed merging Process.')
@@ -19,18 +19,29 @@ Classes:
 """
 
 from logging import getLogger
-from multiprocessing import cpu_count, Pool
+from multiprocessing import cpu_count
 from pathlib import Path
 
 import numpy as np
 
 from catboost import CatBoostClassifier
 
+from CatMOD.feature_store import FeatureStore, STORE_FILE
+from CatMOD.reader.bam import check_index, read_depths
 from CatMOD.reader.bed import BedReader
+from CatMOD.shard import shard_index
+from CatMOD.site_index import SiteIndex, STRANDS
+from CatMOD.stats import summary_features
 from CatMOD.sys_output import Output
 
 logger = getLogger(__name__)  # pylint: disable=invalid-name
 
+_SITE_BLOCK = 4096
+_PREDICT_CHUNK = 65536
+_CUR_WINDOW = 256
+_ENSEMBLE_FEATURES = ('ref_seq', 'reads_alignment', 'reads_quality',
+                      'reads_norm_mean', 'reads_norm_stdev', 'reads_current')
+
 
 class Predict(object):
     """The predict process.
@@ -51,32 +62,87 @@ class Predict(object):
         datasets_path = Path(self.args.datasets)
         if not datasets_path.is_dir():
             raise FileNotFoundError(f'{self.args.datasets} is not a directory.')
+        if not (datasets_path / STORE_FILE).is_file():
+            raise FileNotFoundError(
+                f'{self.args.datasets} lacks {STORE_FILE} feature store.')
         self.threads = self.args.threads if self.args.threads else cpu_count()
 
     def get_all_samples(self):
         self.output.info('Reading bed file.')
-        bed_reader = BedReader(self.args.bed)
-        # self.region_list = []
-        self.datasets_region_set = set()
-        for each_region in bed_reader.read_bed():
-            # self.region_list.append(each_region.copy())
-            region_string = str(each_region)
-            self.datasets_region_set.add(self.args.datasets+'/'+region_string)
+        region_set = BedReader(self.args.bed).read_region_set(
+            self.args.bed_region).unique()
+        if self.args.shard:
+            region_set = region_set.subset(shard_index(
+                region_set, self.args.shard, self.shard_depths()))
+            self.output.info(f'Keeping {len(region_set)} sites of shard '
+                             f'{self.args.shard}.')
+        self.region_list = region_set.strings()
+        self.site_index = SiteIndex.from_region_set(region_set)
         self.output.info('Completed reading bed file.')
 
+    def shard_depths(self):
+        """Return the depths weighing the shards, as extract_features did.
+
+        A store extracted with --shard records its shard, which has to be
+        the predicted one, and the depths it was weighed by, so predict
+        keeps the same sites without reading the alignment index again.
+        """
+        with FeatureStore(self.args.datasets, 'r') as store:
+            extracted_shard = store.read_attr('shard')
+        if extracted_shard is not None:
+            if (extracted_shard['shard'], extracted_shard['shard_by']) != (
+                    self.args.shard, self.args.shard_by):
+                self.output.error(
+                    f'{self.args.datasets} holds shard '
+                    f'{extracted_shard["shard"]} by '
+                    f'{extracted_shard["shard_by"]}, not shard '
+                    f'{self.args.shard} by {self.args.shard_by}.')
+                raise SystemExit
+            return extracted_shard['depths']
+        if self.args.shard_by != 'reads':
+            return None
+        if not self.args.align:
+            self.output.error('--shard_by reads needs --align.')
+            raise SystemExit
+        return read_depths(check_index(self.args.align, self.threads,
+                                       self.args.csi))
+
     def ensemble_features(self):
-        threads = min(self.threads, len(self.datasets_region_set))
-        with Pool(processes=threads) as pool:
-            _ = pool.map(ensemble_features, self.datasets_region_set)
+        with FeatureStore(self.args.datasets) as store:
+            store.drop('ensemble_features')
+            for block_start in range(0, len(self.region_list), _SITE_BLOCK):
+                try:
+                    region_strings, features_array = ensemble_features(
+                        store, self.region_list[
+                            block_start:block_start+_SITE_BLOCK])
+                except ValueError as error:
+                    self.output.error(f'{self.args.datasets}: {error}')
+                    raise SystemExit
+                store.append('ensemble_features', region_strings,
+                             features_array)
 
     def predict_all_samples(self):
-        threads = min(self.threads, len(self.datasets_region_set))
-        global cbc
         cbc = CatBoostClassifier()
         cbc.load_model(self.args.model)
-        with Pool(processes=threads) as pool:
-            self.all_samples_results = pool.map(
-                predict_sample, self.datasets_region_set)
+        self.all_samples_results = []
+        with FeatureStore(self.args.datasets, 'r') as store:
+            if 'ensemble_features' not in store:
+                return None
+            site_ids = [
+                site_id for site_id, region_string in enumerate(
+                    self.region_list)
+                if store.has('ensemble_features', region_string)]
+            self.output.info(
+                f'Using {self.threads} threads to predict '
+                f'{len(site_ids)} samples.')
+            for chunk_start in range(0, len(site_ids), _PREDICT_CHUNK):
+                chunk_ids = site_ids[chunk_start:chunk_start+_PREDICT_CHUNK]
+                features_array, _ = store.read_sites(
+                    'ensemble_features',
+                    [self.region_list[site_id] for site_id in chunk_ids])
+                self.all_samples_results.extend(predict_samples(
+                    cbc, self.site_index, chunk_ids, features_array,
+                    self.threads))
 
     def write_all_results(self):
         with open(self.args.output, 'w') as open_output:
@@ -96,47 +162,148 @@ class Predict(object):
         logger.debug('Completed predicting Process.')
 
 
-def ensemble_features(datasets_region: str):
-    sequence_path = Path(
-        f'{datasets_region}.ref_seq.npy')
-    alignment_path = Path(
-        f'{datasets_region}.reads_alignment.npy')
-    quality_path = Path(
-        f'{datasets_region}.reads_quality.npy')
-    norm_mean_path = Path(
-        f'{datasets_region}.reads_norm_mean.npy')
-    norm_stdev_path = Path(
-        f'{datasets_region}.reads_norm_stdev.npy')
-    current_path = Path(
-        f'{datasets_region}.reads_current.npy')
-    if sequence_path.is_file() and alignment_path.is_file() and quality_path.is_file() and norm_mean_path.is_file() and norm_stdev_path.is_file() and current_path.is_file():
-        reads_alignment = np.load(alignment_path)
-        reads_quality = np.load(quality_path).astype(np.float32)
-        if reads_alignment.shape[0] == reads_quality.shape[0] > 0 and reads_alignment.shape[1] == reads_quality.shape[1] and reads_alignment.shape[2] == 6:
-            reads_norm_mean = np.load(norm_mean_path).astype(np.float32)
-            reads_norm_stdev = np.load(norm_stdev_path).astype(np.float32)
-            reads_current = np.load(current_path).astype(np.float32)
-            if reads_norm_mean.shape[0] == reads_norm_stdev.shape[0] == reads_current.shape[0] > 0 and reads_norm_mean.shape[1] == reads_norm_stdev.shape[1] == 5: #and reads_current.shape[1] == 256:
-                reads_alignment = reads_alignment.reshape(reads_alignment.shape[0], -1).astype(np.float32)
-                sequence = np.load(sequence_path)
-                sequence = sequence.flatten().astype(np.float32)
-                np.save(f'{datasets_region}.ensemble_features.npy',
-                        np.array([np.concatenate((
-                            sequence, reads_alignment.mean(0), reads_quality.mean(0),
-                            reads_norm_mean.mean(0), reads_norm_stdev.mean(0), reads_current.mean(0)))], dtype=np.float32))
-
-
-def predict_sample(datasets_region):
-    region_path = Path(f'{datasets_region}.ensemble_features.npy')
-    if region_path.is_file():
-        region_features_array = np.load(region_path)
-        region_pred_proba = cbc.predict_proba(
-            region_features_array, thread_count=1)
-        region_pred_array = np.rint(region_pred_proba[:,1]).astype(np.int32)
-        spregion = datasets_region.split('/')[1].split('_')
-        spposition = spregion[2].split('-')
-        return [spregion[0], spposition[0], spposition[1],
-                str(region_pred_array[0]), str(region_pred_proba[0,1]),
-                spregion[1]]
-    else:
-        return []
\ No newline at end of file
+def mean_sites(values: np.ndarray, counts: np.ndarray):
+    """Average the rows of every site, sites without rows are zeros."""
+    means = np.zeros((len(counts), *values.shape[1:]), dtype=np.float64)
+    nonempty = counts > 0
+    if nonempty.any():
+        starts = (np.cumsum(counts) - counts)[nonempty]
+        means[nonempty] = np.add.reduceat(
+            values, starts, axis=0, dtype=np.float64) / counts[
+                nonempty].reshape(-1, *[1] * (values.ndim - 1))
+    return means
+
+
+def read_site_means(store: FeatureStore, feature: str,
+                    region_strings: list[str]):
+    """Average a read feature per site, from its summaries when stored.
+
+    Returns:
+        means (np.ndarray): (sites, *row_shape) float64 means.
+        counts (np.ndarray): (sites,) reads of every site.
+        row_shape (tuple): row shape of the feature.
+    """
+    if store.has_summary(feature):
+        stats = store.read_summary(feature, region_strings)
+        return (stats.mean, stats.count,
+                store.row_shape(summary_features(feature)[1]))
+    values, counts = store.read_sites(feature, region_strings)
+    if feature == 'reads_alignment':
+        return read_alignment_means(store, region_strings, values, counts)
+    return mean_sites(values, counts), counts, store.row_shape(feature)
+
+
+def read_alignment_means(store: FeatureStore, region_strings: list[str],
+                         alignment: np.ndarray, counts: np.ndarray):
+    """Average compact read alignments per site, see compact_alignment.
+
+    The uint8 one-hot columns are averaged by mean_sites and the sparse
+    insertion codes are summed per site position, so the (reads,
+    ali_window, 6) int64 array is never rebuilt.
+
+    Returns:
+        means (np.ndarray): (sites, ali_window, 6) float64 means.
+        counts (np.ndarray): (sites,) reads of every site.
+        row_shape (tuple): (ali_window, 6) row shape.
+    """
+    means = mean_sites(alignment, counts)
+    insertion_sums = np.zeros(means.shape[:2], dtype=np.float64)
+    if 'reads_insertion' in store:
+        insertion, insertion_counts = store.read_sites(
+            'reads_insertion', region_strings)
+        np.add.at(insertion_sums,
+                  (np.repeat(np.arange(len(region_strings)),
+                             insertion_counts), insertion[:, 1]),
+                  insertion[:, 2].astype(np.float64))
+    insertion_means = np.divide(
+        insertion_sums, counts[:, np.newaxis],
+        out=np.zeros_like(insertion_sums), where=counts[:, np.newaxis] > 0)
+    return (np.concatenate((means, insertion_means[:, :, np.newaxis]),
+                           axis=2), counts,
+            (*store.row_shape('reads_alignment')[:-1], 6))
+
+
+def ensemble_features(store: FeatureStore, region_strings: list[str],
+                      cur_window: int = _CUR_WINDOW):
+    """Concatenate the sequence and read-averaged features of sites.
+
+    Read features are averaged from their per-read rows, or combined from
+    their per-site summaries when extracted with --summary.
+
+    Args:
+        store (FeatureStore): extracted feature store.
+        region_strings (list): region strings of the sites.
+        cur_window (int): current length, default 256 as the models.
+
+    Returns:
+        region_strings (list): region strings of the sites with all features.
+        features_array (np.ndarray): (sites, features) float32 array.
+
+    Raises:
+        ValueError: if read features have other rows than the models, e.g.
+            currents not resampled to cur_window points.
+    """
+    if any(feature not in store and not store.has_summary(feature)
+           for feature in _ENSEMBLE_FEATURES):
+        return [], np.zeros((0, 0), dtype=np.float32)
+    features_means, features_counts, features_shapes = [], {}, {}
+    for feature in _ENSEMBLE_FEATURES:
+        means, counts, row_shape = read_site_means(
+            store, feature, region_strings)
+        features_means.append(means.reshape(len(region_strings), -1))
+        features_counts[feature] = counts
+        features_shapes[feature] = row_shape
+    alignment_shape = tuple(features_shapes['reads_alignment'])
+    for feature, expected_shape in (
+            ('reads_alignment', (*alignment_shape[:1], 6)),
+            ('reads_quality', alignment_shape[:1]),
+            ('reads_norm_mean', (5,)), ('reads_norm_stdev', (5,)),
+            ('reads_current', (cur_window,))):
+        if tuple(features_shapes[feature]) != expected_shape:
+            raise ValueError(
+                f'Stored {feature} rows are {tuple(features_shapes[feature])}'
+                f', the models expect {expected_shape}.')
+    valid = (features_counts['ref_seq'] > 0) & (
+        features_counts['reads_alignment'] > 0) & (
+        features_counts['reads_alignment'] ==
+        features_counts['reads_quality']) & (
+        features_counts['reads_norm_mean'] > 0) & (
+        features_counts['reads_norm_mean'] ==
+        features_counts['reads_norm_stdev']) & (
+        features_counts['reads_norm_mean'] ==
+        features_counts['reads_current'])
+    return ([region_string for region_string, each_valid in zip(
+                region_strings, valid) if each_valid],
+            np.concatenate(features_means, axis=1)[valid].astype(np.float32))
+
+
+def predict_samples(cbc: CatBoostClassifier, site_index: SiteIndex,
+                    site_ids: list[int], features_array: np.ndarray,
+                    threads: int):
+    """Predict a chunk of samples with one predict_proba call.
+
+    Args:
+        cbc (CatBoostClassifier): loaded model.
+        site_index (SiteIndex): index of the samples.
+        site_ids (list): site ids of the samples.
+        features_array (np.ndarray): (samples, features) ensemble features.
+        threads (int): CatBoost prediction threads.
+
+    Returns:
+        list: chrom, start, end, prediction, probability and strand of every
+            sample.
+    """
+    if not len(site_ids):
+        return []
+    pred_proba = cbc.predict_proba(features_array, thread_count=threads)
+    pred_array = np.rint(pred_proba[:,1]).astype(np.int32)
+    samples_results = []
+    for chrom, strand, start, end, region_pred, region_proba in zip(
+            site_index.chrom[site_ids].tolist(),
+            site_index.strand[site_ids].tolist(),
+            site_index.start[site_ids].tolist(),
+            site_index.end[site_ids].tolist(), pred_array, pred_proba[:,1]):
+        samples_results.append([
+            site_index.chroms[chrom], str(start), str(end), str(region_pred),
+            str(region_proba), STRANDS[strand]])
+    return samples_results
@@ -16,28 +16,41 @@ What's here:
 
 Functions:
   - check_index:
+  - read_depths:
 """
 
+from typing import Optional
+
 import pysam
 
 from CatMOD.sys_output import Output
 
+# bai indexes address positions below 2^29, longer chromosomes need csi.
+_BAI_MAX_LENGTH = (1 << 29) - 1
+
 
-def open_xam(input_xam: str):
+def open_xam(input_xam: str, reference: Optional[str] = None,
+             threads: int = 1):
     """Check input and open.
 
     Args:
         input_xam (str): input sam or bam file path string.
+        reference (str): reference fasta path decoding cram, default the
+            reference given in the cram header.
+        threads (int): threads decompressing bam/cram blocks, default 1.
 
     Returns:
         xamfile (AlignmentFile): pysam opened bam/cram/sam file handle.
         input_format (str): return input_xam format, sam or bam.
     """
     if input_xam.endswith('cram'):
-        xamfile = pysam.AlignmentFile(input_xam, 'rc', check_sq=False)
+        xamfile = pysam.AlignmentFile(input_xam, 'rc', check_sq=False,
+                                      reference_filename=reference,
+                                      threads=threads)
         input_format = 'cram'
     elif input_xam.endswith('bam'):
-        xamfile = pysam.AlignmentFile(input_xam, 'rb', check_sq=False)
+        xamfile = pysam.AlignmentFile(input_xam, 'rb', check_sq=False,
+                                      threads=threads)
         input_format = 'bam'
     elif input_xam.endswith('sam'):
         xamfile = pysam.AlignmentFile(input_xam, 'r', check_sq=False)
@@ -50,22 +63,27 @@ def open_xam(input_xam: str):
     return xamfile, input_format
 
 
-def check_index(input_xam: str, threads: int = 1):
+def check_index(input_xam: str, threads: int = 1, csi: bool = False):
     """Build index for bam if not exists.
 
     Args:
         input_xam (str): input sam or bam file path string.
         threads (int): threads using for pysam sort and index, default 1.
+        csi (bool): build a csi index instead of a bai index, default only
+            for chromosomes too long for bai.
     """
     xamfile, input_format = open_xam(input_xam)
+    index_format = '-c' if csi or max(
+        xamfile.lengths, default=0) > _BAI_MAX_LENGTH else '-b'
     try:
         xamfile.check_index()
+        xamfile.close()
         return input_xam
     except ValueError:
         output = Output()
         output.warning(f'{input_xam} lacks .bai or .csi index.')
         output.info(f'Preparing samtools index for input {input_xam}')
-        pysam.index(input_xam, '-b', '-@', str(threads))
+        pysam.index(input_xam, index_format, '-@', str(threads))
         xamfile.close()
         return input_xam
     except AttributeError:
@@ -76,10 +94,35 @@ def check_index(input_xam: str, threads: int = 1):
             input_bam = input_xam[:-3] + 'bam'
             pysam.sort('-o', input_bam, '--output-fmt', 'BAM',
                        '--threads', str(threads), input_xam)
-            pysam.index(input_bam, '-b', '-@', str(threads))
+            pysam.index(input_bam, index_format, '-@', str(threads))
             xamfile.close()
             return input_bam
         else:
             output.error('Input error: input --bam must be a'
                          ' bam, cram or sam file.')
             exit()
+
+
+def read_depths(input_xam: str):
+    """Estimate the mapped reads per base of every chromosome.
+
+    Mapped read counts are taken from the index, so no read is decoded.
+
+    Args:
+        input_xam (str): indexed bam or cram file path string.
+
+    Returns:
+        dict: chromosome id -> mapped reads per base, empty if the index
+            holds no statistics.
+    """
+    xamfile, _ = open_xam(input_xam)
+    chrom_lengths = dict(zip(xamfile.references, xamfile.lengths))
+    try:
+        index_statistics = xamfile.get_index_statistics()
+    except (AttributeError, NotImplementedError, ValueError):
+        index_statistics = []
+    xamfile.close()
+    return {stats.contig: stats.mapped / chrom_lengths[stats.contig]
+            for stats in index_statistics
+            if chrom_lengths.get(stats.contig)}
+
@@ -16,28 +16,145 @@ What's here:
 
 Classes:
   - BedReader:
+
+Functions:
+  - open_bed:
 """
 
-from CatMOD.region import Region
+import gzip
+from typing import Optional
+
+import numpy as np
+import pysam
+
+from CatMOD.region import Region, RegionSet
+
+_BED_BLOCK = 1 << 24
+_TABIX_BLOCK = 1 << 18
+
+
+def open_bed(bed_file: str):
+    """Open a plain or gzip/bgzip-compressed bed file as text."""
+    with open(bed_file, 'rb') as open_bed:
+        magic = open_bed.read(2)
+    if magic == b'\x1f\x8b':
+        return gzip.open(bed_file, 'rt')
+    return open(bed_file, 'r')
 
 
 class BedReader(object):
+    """The bed file reader.
+
+    Bed lines are read in large blocks and parsed column-wise into typed
+    arrays, plain or gzip/bgzip-compressed. A bgzip-compressed bed file
+    with a tabix index can also be read for a single chromosome or
+    interval.
+
+    Attributes:
+        bed_file (str): bed file path.
+        use_memory (bool): read the whole file into memory in read_bed.
+        lines (int): bed lines parsed by the last read_region_set.
+        chrom_codes (dict): chromosome id -> chromosome code of the last
+            read_region_set.
+    """
 
     def __init__(self, bed_file: str, use_memory: bool = False):
         self.bed_file = bed_file
         self.use_memory = use_memory
+        self.lines = 0
+        self.chrom_codes = {}
 
     def read_bed(self):
-        with open(self.bed_file, 'r') as open_bed:
+        with open_bed(self.bed_file) as open_bed_file:
             if self.use_memory:
-                for eachline in open_bed.readlines():
+                for eachline in open_bed_file.readlines():
                     if eachline[0] != '#':
                         spline = eachline.strip().split('\t')
                         yield Region(spline[0], int(spline[1]), int(spline[2]),
                                      spline[5], spline[3]+'\t'+spline[4])
             else:
-                for eachline in open_bed:
+                for eachline in open_bed_file:
                     if eachline[0] != '#':
                         spline = eachline.strip().split('\t')
                         yield Region(spline[0], int(spline[1]), int(spline[2]),
                                      spline[5], spline[3]+'\t'+spline[4])
+
+    def read_region_set(self, region: Optional[str] = None):
+        """Read all regions into a RegionSet in one pass.
+
+        Args:
+            region (str): chromosome or 'chrom:start-end' interval to read
+                through the tabix index of a bgzip-compressed bed file,
+                default the whole file.
+
+        Returns:
+            RegionSet: regions in file order.
+        """
+        self.lines = 0
+        self.chrom_codes = {}
+        blocks = [self.parse_lines(lines)
+                  for lines in self.iter_line_blocks(region)]
+        return RegionSet(
+            list(self.chrom_codes),
+            *[np.concatenate([block[column] for block in blocks] + [
+                np.zeros(0, dtype=dtype)]) for column, dtype in enumerate(
+                    (np.int32, np.int64, np.int64, np.int8))])
+
+    def iter_line_blocks(self, region: Optional[str] = None):
+        """Yield blocks of complete bed lines."""
+        if region:
+            with pysam.TabixFile(self.bed_file) as tabix_file:
+                if region not in tabix_file.contigs and \
+                        region.rsplit(':', 1)[0] not in tabix_file.contigs:
+                    return None
+                lines = []
+                for eachline in tabix_file.fetch(region=region):
+                    lines.append(eachline)
+                    if len(lines) == _TABIX_BLOCK:
+                        yield lines
+                        lines = []
+                if lines:
+                    yield lines
+            return None
+        with open_bed(self.bed_file) as open_bed_file:
+            remainder = ''
+            while True:
+                text = open_bed_file.read(_BED_BLOCK)
+                if not text:
+                    break
+                lines = (remainder + text).split('\n')
+                remainder = lines.pop()
+                yield lines
+            if remainder:
+                yield [remainder]
+
+    def parse_lines(self, lines: list[str]):
+        """Parse a block of bed lines column-wise.
+
+        Returns:
+            tuple: chromosome code, start, end and strand code arrays.
+        """
+        split_lines = [eachline.strip().split('\t', 6)
+                       for eachline in lines
+                       if eachline and eachline[0] != '#']
+        self.lines += len(split_lines)
+        if not split_lines:
+            return (np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int64),
+                    np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int8))
+        if min(len(spline) for spline in split_lines) < 6:
+            raise ValueError(f'{self.bed_file} lines need 6 columns.')
+        chroms, starts, ends, _, _, strands = list(zip(*split_lines))[:6]
+        block_chroms, first_index, inverse = np.unique(
+            chroms, return_index=True, return_inverse=True)
+        for chrom in block_chroms[np.argsort(first_index)].tolist():
+            self.chrom_codes.setdefault(chrom, len(self.chrom_codes))
+        chrom_codes = np.array([self.chrom_codes[chrom]
+                                for chrom in block_chroms.tolist()],
+                               dtype=np.int32)
+        strands = np.array(strands)
+        if not np.isin(strands, ('+', '-')).all():
+            raise ValueError("Region strand should be '+' or '-'.")
+        return (chrom_codes[inverse.reshape(-1)],
+                np.array(starts).astype(np.int64),
+                np.array(ends).astype(np.int64),
+                (strands == '-').astype(np.int8))
@@ -0,0 +1,332 @@
+# -*- coding: utf-8 -*-
+# Copyright 2022 Shang Xie.
+# All rights reserved.
+#
+# This file is part of the CatMOD distribution and
+# governed by your choice of the "CatMOD License Agreement"
+# or the "GNU General Public License v3.0".
+# Please see the LICENSE file that should
+# have been included as part of this package.
+""".
+
+What's here:
+
+.
+-------------------------------------------
+
+Classes:
+  - CurrentReader:
+  - CurrentTable:
+
+Functions:
+  - init_site_index:
+  - parse_current_files:
+  - parse_float_lines:
+  - parse_ragged_lines:
+  - parse_current_part:
+  - current_tasks:
+  - current_inputs:
+"""
+
+from json import load
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from CatMOD.resample import resample_segments
+from CatMOD.site_index import SiteIndex
+
+CURRENT_TABLE_FILE = 'current_table.json'
+
+
+class CurrentReader(object):
+    """The ONT current files reader.
+
+    Every line of a current file holds chrom, 5-mer start, 5-mer end, two
+    information columns, strand and the comma-joined norm mean, norm stdev
+    and current of a read at a site.
+
+    Attributes:
+        current_file (str): index file listing the current files.
+        current_files (list): current file paths.
+    """
+
+    def __init__(self, current_file: str):
+        self.current_file = current_file
+        with open(current_file, 'r') as open_list:
+            self.current_files = [
+                eachline.strip() for eachline in open_list if eachline.strip()]
+
+    @staticmethod
+    def read_current_file(current_file: str):
+        """Read the columns of all lines of a current file.
+
+        Returns:
+            chroms (list): chromosome id of every line.
+            strands (list): strand of every line.
+            starts (list): site start of every line.
+            ends (list): site end of every line.
+            norm_means (list): unparsed norm mean of every line.
+            norm_stdevs (list): unparsed norm stdev of every line.
+            currents (list): unparsed current of every line.
+        """
+        columns = ([], [], [], [], [], [], [])
+        (chroms, strands, starts, ends, norm_means, norm_stdevs,
+            currents) = columns
+        with open(current_file, 'r') as open_current:
+            for eachline in open_current:
+                spline = eachline.split()
+                if not spline:
+                    continue
+                chroms.append(spline[0])
+                strands.append(spline[5])
+                starts.append(int(spline[1]) + 2)
+                ends.append(int(spline[2]) - 2)
+                norm_means.append(spline[6])
+                norm_stdevs.append(spline[7])
+                currents.append(spline[8])
+        return columns
+
+    @staticmethod
+    def parse_current_file(current_file: str, site_index: SiteIndex,
+                           cur_window: Optional[int] = None,
+                           current_kind: str = 'linear'):
+        """Parse the lines of the wanted sites of a current file at once.
+
+        Args:
+            current_file (str): current file path.
+            site_index (SiteIndex): wanted sites.
+            cur_window (int): length every current is resampled to, default
+                None keeping currents of equal length as they are.
+            current_kind (str): interpolation kind, see resample_segments.
+
+        Returns:
+            site_ids (np.ndarray): site id of every parsed line.
+            norm_mean (np.ndarray): (lines, 5) float64 array.
+            norm_stdev (np.ndarray): (lines, 5) float64 array.
+            current (np.ndarray): (lines, current length) float64 array.
+        """
+        (chroms, strands, starts, ends, norm_means, norm_stdevs,
+            currents) = CurrentReader.read_current_file(current_file)
+        site_ids = site_index.lookup_sites(chroms, strands, starts, ends)
+        lines = np.flatnonzero(site_ids >= 0)
+        current_strings = [currents[line] for line in lines]
+        if cur_window:
+            current = resample_segments(
+                *parse_ragged_lines(current_strings), cur_window,
+                current_kind)
+        else:
+            current = parse_float_lines(current_strings, current_file)
+        return (site_ids[lines],
+                parse_float_lines([norm_means[line] for line in lines],
+                                  current_file),
+                parse_float_lines([norm_stdevs[line] for line in lines],
+                                  current_file),
+                current)
+
+
+class CurrentTable(object):
+    """The binary current table written by convert_current.
+
+    A table is a folder of parts, every part a folder of raw column files
+    which are memory-mapped when read:
+      - chrom: (lines,) int32 index into the chromosome names of the part.
+      - strand: (lines,) int8 index into site_index.STRANDS.
+      - start, end: (lines,) int64 site start and end.
+      - norm_mean, norm_stdev: (lines, norm width) norm mean and stdev.
+      - current: (values,) current of all lines concatenated.
+      - current_offsets: (lines + 1,) int64 offsets of every line in current.
+    The current_table.json manifest holds the float dtype and the lines,
+    values, norm width and chromosome names of every part.
+
+    Attributes:
+        table_folder (str): table folder path.
+        dtype (np.dtype): float dtype of the norm and current columns.
+        parts (list): manifest of every part.
+    """
+
+    def __init__(self, table_folder: str):
+        self.table_folder = table_folder
+        with open(Path(table_folder, CURRENT_TABLE_FILE), 'r') as open_table:
+            manifest = load(open_table)
+        self.dtype = np.dtype(manifest['dtype'])
+        self.parts = manifest['parts']
+
+    @staticmethod
+    def is_table(current: str):
+        """Whether a current input is a converted current table."""
+        return Path(current, CURRENT_TABLE_FILE).is_file()
+
+    def column_layout(self, part: dict):
+        """Return the dtype and shape of every column of a part."""
+        lines, width = part['lines'], part['norm_width']
+        return {
+            'chrom': (np.int32, (lines,)),
+            'strand': (np.int8, (lines,)),
+            'start': (np.int64, (lines,)),
+            'end': (np.int64, (lines,)),
+            'norm_mean': (self.dtype, (lines, width)),
+            'norm_stdev': (self.dtype, (lines, width)),
+            'current': (self.dtype, (part['values'],)),
+            'current_offsets': (np.int64, (lines + 1,))}
+
+    def read_part(self, part: dict):
+        """Memory-map every column of a part."""
+        part_folder = Path(self.table_folder, part['name'])
+        columns = {}
+        for column, (dtype, shape) in self.column_layout(part).items():
+            if int(np.prod(shape)):
+                columns[column] = np.memmap(
+                    part_folder / f'{column}.bin', dtype=dtype, mode='r',
+                    shape=shape)
+            else:
+                columns[column] = np.zeros(shape, dtype=dtype)
+        return columns
+
+
+def init_site_index(site_index: SiteIndex, cur_window: Optional[int] = None,
+                    current_kind: str = 'linear'):
+    """Share the wanted sites and the current resampling with a pool
+    worker."""
+    global current_site_index, current_window, current_interpolation
+    current_site_index = site_index
+    current_window = cur_window
+    current_interpolation = current_kind
+
+
+def parse_current_files(current_files: list[str]):
+    """Parse a chunk of current files in a pool worker.
+
+    Returns:
+        site_ids (np.ndarray): site id of every parsed line.
+        features (tuple): float32 norm mean, norm stdev and current arrays,
+            or None if no line belongs to a wanted site.
+    """
+    site_ids_list, features_list = [], []
+    for current_file in current_files:
+        file_site_ids, *file_features = CurrentReader.parse_current_file(
+            current_file, current_site_index, current_window,
+            current_interpolation)
+        if len(file_site_ids):
+            # features are stored as float32, halving what is sent back.
+            site_ids_list.append(file_site_ids)
+            features_list.append(tuple(
+                each_feature.astype(np.float32)
+                for each_feature in file_features))
+    if not site_ids_list:
+        return np.zeros(0, dtype=np.int64), None
+    return np.concatenate(site_ids_list), tuple(
+        np.concatenate(each_feature) for each_feature in zip(*features_list))
+
+
+def parse_float_lines(float_strings: list[str], current_file: str = ''):
+    """Parse equal-length comma-joined float lines into one float64 array."""
+    if not float_strings:
+        return np.zeros((0, 0), dtype=np.float64)
+    values = np.array(','.join(float_strings).split(','), dtype=np.float64)
+    if values.size % len(float_strings):
+        raise ValueError(
+            f'Lines of {current_file} hold different numbers of values.')
+    return values.reshape(len(float_strings), -1)
+
+
+def parse_ragged_lines(float_strings: list[str]):
+    """Parse comma-joined float lines of any length.
+
+    Returns:
+        values (np.ndarray): float64 values of all lines concatenated.
+        lengths (np.ndarray): values of every line.
+    """
+    if not float_strings:
+        return np.zeros(0, dtype=np.float64), np.zeros(0, dtype=np.int64)
+    lengths = np.array([float_string.count(',') + 1
+                        for float_string in float_strings], dtype=np.int64)
+    return (np.array(','.join(float_strings).split(','), dtype=np.float64),
+            lengths)
+
+
+def parse_current_part(part_args: tuple[str, dict]):
+    """Gather the lines of the wanted sites of a current table part.
+
+    Args:
+        part_args (tuple): current table folder and part manifest.
+
+    Returns:
+        site_ids (np.ndarray): site id of every gathered line.
+        features (tuple): float32 norm mean, norm stdev and current arrays,
+            or None if no line belongs to a wanted site.
+    """
+    table_folder, part = part_args
+    columns = CurrentTable(table_folder).read_part(part)
+    chrom_codes = np.array(
+        [current_site_index.chrom_codes.get(chrom, -1)
+         for chrom in part['chroms']], dtype=np.int64)
+    site_ids = current_site_index.lookup_codes(
+        chrom_codes[columns['chrom']], columns['strand'], columns['start'],
+        columns['end'])
+    lines = np.flatnonzero(site_ids >= 0)
+    if not len(lines):
+        return np.zeros(0, dtype=np.int64), None
+    offsets = columns['current_offsets']
+    starts = np.asarray(offsets[lines])
+    lengths = np.asarray(offsets[lines + 1]) - starts
+    if current_window:
+        current = resample_segments(
+            columns['current'][np.arange(lengths.sum()) + np.repeat(
+                starts - (np.cumsum(lengths) - lengths), lengths)],
+            lengths, current_window, current_interpolation).astype(
+                np.float32)
+    else:
+        if (lengths != lengths[0]).any():
+            raise ValueError(
+                f'Lines of {table_folder}/{part["name"]} hold different '
+                'numbers of values.')
+        current = columns['current'][
+            starts[:, np.newaxis] + np.arange(lengths[0])].astype(np.float32)
+    return site_ids[lines], (
+        columns['norm_mean'][lines].astype(np.float32),
+        columns['norm_stdev'][lines].astype(np.float32),
+        current)
+
+
+def current_tasks(current: str, chunk_files: int):
+    """Split a current input into pool tasks.
+
+    Args:
+        current (str): current table folder or index file listing the
+            current files.
+        chunk_files (int): current files per task of an index file.
+
+    Returns:
+        worker (function): parse_current_part or parse_current_files.
+        tasks (list): worker arguments.
+        task_sizes (list): current files or table lines of every task.
+        unit (str): name of the task size unit.
+    """
+    if CurrentTable.is_table(current):
+        current_table = CurrentTable(current)
+        return (parse_current_part,
+                [(current, part) for part in current_table.parts],
+                [part['lines'] for part in current_table.parts],
+                'ONT current table lines')
+    current_files = CurrentReader(current).current_files
+    tasks = [current_files[chunk_start:chunk_start+chunk_files]
+             for chunk_start in range(0, len(current_files), chunk_files)]
+    return (parse_current_files, tasks, [len(task) for task in tasks],
+            'ONT current files')
+
+
+def current_inputs(current: str):
+    """Return every file read from a current input, the current table
+    manifest with the column files of its parts or the index file with
+    the current files it lists."""
+    if CurrentTable.is_table(current):
+        current_table = CurrentTable(current)
+        return [str(Path(current, CURRENT_TABLE_FILE))] + [
+            str(Path(current, part['name'], f'{column}.bin'))
+            for part in current_table.parts
+            for column, (_, shape) in current_table.column_layout(
+                part).items()
+            if int(np.prod(shape))]
+    return [current] + CurrentReader(current).current_files
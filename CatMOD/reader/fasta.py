@@ -16,15 +16,20 @@ What's here:
 
 Classes:
   - FastaReader:
+
+Functions:
+  - load_reference_codes:
 """
 
+from json import load
 from pathlib import Path
 
 import numpy as np
 
+from numpy.lib.stride_tricks import sliding_window_view
 from pysam import faidx, FastaFile
 
-from CatMOD.region import Region
+from CatMOD.region import Region, RegionSet
 from CatMOD.sys_output import Output
 
 
@@ -78,10 +83,40 @@ _BASE_ONEHOT_REV = {
     'V': [0., 1/3, 1/3, 1/3],
     'N': [0.25, 0.25, 0.25, 0.25]}
 
+# byte -> base code, 255 for invalid bases.
+_BASE_CODES = np.full(256, 255, dtype=np.uint8)
+# base code -> one-hot of the base, and of the base on the reverse strand.
+_CODE_ONEHOT = np.zeros((256, 4), dtype=np.float32)
+_CODE_ONEHOT_REV = np.zeros((256, 4), dtype=np.float32)
+for _code, _base in enumerate(_BASE_ONEHOT):
+    _BASE_CODES[ord(_base)] = _code
+    _CODE_ONEHOT[_code] = _BASE_ONEHOT[_base]
+    _CODE_ONEHOT_REV[_code] = _BASE_ONEHOT_REV[_base]
+
+
+REFERENCE_CODES_SUFFIX = '.codes.npy'
+REFERENCE_INDEX_SUFFIX = '.codes.json'
+
 
 class FastaReader(object):
+    """The reference fasta reader.
+
+    Windows of a RegionSet are sliced from uint8 base code buffers. When
+    catmod index_reference has written the encoded reference next to the
+    fasta file, buffers are slices of its memory map, shared through the
+    page cache by all processes. Otherwise the covering span of every
+    chromosome is encoded once, or the whole chromosome when cache_chroms
+    is set, and the last buffer is kept for the next call, so sorted site
+    sets read every chromosome only once.
 
-    def __init__(self, fasta_file: str):
+    Attributes:
+        fasta_file (FastaFile): opened fasta file.
+        cache_chroms (bool): encode whole chromosomes instead of spans.
+        reference_codes (tuple): memory-mapped base codes and chromosome id
+            -> (offset, length) table, or None without encoded reference.
+    """
+
+    def __init__(self, fasta_file: str, cache_chroms: bool = True):
         fai_path = Path(fasta_file + '.fai')
         if not fai_path.is_file():
             self.output = Output()
@@ -89,6 +124,9 @@ class FastaReader(object):
             self.output.info(f'Attempting to create {fasta_file}.fai index.')
             faidx(fasta_file)
         self.fasta_file = FastaFile(fasta_file)
+        self.cache_chroms = cache_chroms
+        self.reference_codes = load_reference_codes(fasta_file)
+        self._buffer = (None, 0, np.zeros(0, dtype=np.uint8))
 
     def fetch(self, chrom: str, start: int, end: int, strand: str = '+',
               return_array: bool = False):
@@ -115,10 +153,119 @@ class FastaReader(object):
             region.chrom, region.start, region.end,
             region.strand, return_array)
 
+    def fetch_codes(self, chrom: str, start: int, end: int):
+        """Return the uint8 base codes of a span, 255 for invalid bases."""
+        if self.reference_codes is not None:
+            codes, chrom_offsets = self.reference_codes
+            offset, length = chrom_offsets[chrom]
+            return codes[offset+min(start, length):offset+min(end, length)]
+        buffer_chrom, buffer_start, buffer_codes = self._buffer
+        if chrom == buffer_chrom and buffer_start <= start and \
+                end <= buffer_start + len(buffer_codes):
+            return buffer_codes[start-buffer_start:end-buffer_start]
+        if self.cache_chroms:
+            start_codes = 0
+            codes = seq2codes(self.fasta_file.fetch(chrom), check=False)
+        else:
+            start_codes = start
+            codes = seq2codes(self.fasta_file.fetch(chrom, start, end),
+                              check=False)
+        self._buffer = (chrom, start_codes, codes)
+        return codes[start-start_codes:end-start_codes]
+
+    def fetch_region_set(self, region_set: RegionSet, index=None):
+        """Fetch equal-length regions of a RegionSet.
+
+        Args:
+            region_set (RegionSet): regions.
+            index (np.ndarray): region indices to fetch, default all.
+
+        Returns:
+            np.ndarray: (regions, length, 4) float32 array in index order.
+        """
+        if index is not None:
+            region_set = region_set.subset(np.asarray(index, dtype=np.int64))
+        lengths = np.unique(region_set.end - region_set.start)
+        if len(lengths) > 1:
+            raise ValueError(
+                f'Regions should have the same length, got {lengths}.')
+        length = int(lengths[0]) if len(lengths) else 0
+        codes = np.zeros((len(region_set), length), dtype=np.uint8)
+        for chrom, group in region_set.chrom_groups():
+            if not length:
+                break
+            span_start = int(region_set.start[group].min())
+            span_end = int(region_set.end[group].max())
+            span_codes = self.fetch_codes(chrom, span_start, span_end)
+            if len(span_codes) < span_end - span_start:
+                raise ValueError(
+                    f'Regions exceed the end of {chrom} at '
+                    f'{span_start + len(span_codes)}.')
+            codes[group] = sliding_window_view(span_codes, length)[
+                region_set.start[group] - span_start]
+        if (codes == 255).any():
+            raise ValueError(
+                'Invalid base in region ' +
+                region_set.strings()[np.argmax((codes == 255).any(axis=1))])
+        return codes2array(codes, region_set.strand == 1)
+
+
+def load_reference_codes(fasta_file: str):
+    """Memory-map the encoded reference written by catmod index_reference.
+
+    Returns:
+        codes (np.memmap): uint8 base codes of all chromosomes.
+        chrom_offsets (dict): chromosome id -> (offset, length) in codes.
+        None if the encoded reference is missing or older than the fasta.
+    """
+    codes_path = Path(fasta_file + REFERENCE_CODES_SUFFIX)
+    index_path = Path(fasta_file + REFERENCE_INDEX_SUFFIX)
+    if not codes_path.is_file() or not index_path.is_file():
+        return None
+    with open(index_path, 'r') as open_index:
+        reference_index = load(open_index)
+    fasta_stat = Path(fasta_file).stat()
+    if reference_index['fasta_size'] != fasta_stat.st_size or \
+            reference_index['fasta_mtime_ns'] != fasta_stat.st_mtime_ns:
+        Output().warning(
+            f'Ignoring {codes_path}, {fasta_file} changed since indexing.')
+        return None
+    return (np.load(codes_path, mmap_mode='r'),
+            {chrom: (offset, length) for chrom, offset, length in zip(
+                reference_index['chroms'], reference_index['offsets'],
+                reference_index['lengths'])})
+
+
+def seq2codes(sequence: str, check: bool = True):
+    """Convert a sequence to uint8 base codes, 255 for invalid bases."""
+    codes = _BASE_CODES[np.frombuffer(sequence.upper().encode(),
+                                      dtype=np.uint8)]
+    if check and (codes == 255).any():
+        raise ValueError(f'Invalid base in sequence: {sequence}')
+    return codes
+
+
+def codes2array(codes: np.ndarray, if_reverse=False):
+    """Convert base codes to one-hot arrays.
+
+    Args:
+        codes (np.ndarray): (length,) or (sequences, length) base codes.
+        if_reverse (bool or np.ndarray): reverse complement the sequence, or
+            a (sequences,) mask of the sequences to reverse complement.
+
+    Returns:
+        np.ndarray: (length, 4) or (sequences, length, 4) float32 array.
+    """
+    if codes.ndim == 1:
+        if if_reverse:
+            return _CODE_ONEHOT_REV[codes[::-1]]
+        return _CODE_ONEHOT[codes]
+    onehot = _CODE_ONEHOT[codes]
+    if_reverse = np.asarray(if_reverse, dtype=bool)
+    if if_reverse.any():
+        onehot[if_reverse] = _CODE_ONEHOT_REV[codes[if_reverse, ::-1]]
+    return onehot
+
 
 def seq2array(sequence: str, if_reverse: bool = False):
-    if if_reverse:
-        return np.array([_BASE_ONEHOT_REV[b] for b in sequence[::-1]],
-                        dtype=np.float32)
-    else:
-        return np.array([_BASE_ONEHOT[b] for b in sequence], dtype=np.float32)
+    return codes2array(seq2codes(sequence), if_reverse)
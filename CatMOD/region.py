@@ -16,16 +16,16 @@ What's here:
 
 Classes:
   - Region:
+  - RegionSet:
 """
 
 import math
-from pathlib import Path
 from typing import Optional
 
 import numpy as np
 
-from pysam import AlignmentFile
 
+STRANDS = '+-'
 
 _BASE_INTS = {
     'A': 0,
@@ -35,6 +35,17 @@ _BASE_INTS = {
     '-': 4,
     '^': 5}
 
+_BASE_CODES = np.full(256, -1, dtype=np.int8)
+for _base, _code in _BASE_INTS.items():
+    if _code < 4:
+        _BASE_CODES[ord(_base)] = _code
+
+# CIGAR operations M, I, D, N, S, H, P, =, X, B.
+_CIGAR_QUERY = np.array([1, 1, 0, 0, 1, 0, 0, 1, 1, 0], dtype=bool)
+_CIGAR_REF = np.array([1, 0, 1, 1, 0, 0, 0, 1, 1, 0], dtype=bool)
+_CIGAR_MATCH = np.array([1, 0, 0, 0, 0, 0, 0, 1, 1, 0], dtype=bool)
+_CIGAR_DELETION = np.array([0, 0, 1, 1, 0, 0, 0, 0, 0, 0], dtype=bool)
+
 _BASE_INDEX = {
     'A': '0',
     'C': '1',
@@ -127,106 +138,400 @@ class Region(object):
             self.resize(window, limit)
 
 
-def get_region_alignment(region_args: tuple[Region, str, str, int, str, bool]):
-    """Get region alignment."""
-    (region, region_string, alignment_file,
-        ali_window, output_dir, overwrite) = region_args
-    if not overwrite:
-        region_done = Path(f'{output_dir}/{region_string}.ali.done')
-        if region_done.is_file():
-            return None
-    else:
-        region_done = Path(f'{output_dir}/{region_string}.ali.done')
-    reads_id_list, reads_alignment, reads_quality = [], [], []
-    sam_query_reader = AlignmentFile(alignment_file, 'rb')
-    for read in sam_query_reader.fetch(region.chrom, region.start, region.end):
-        read_features_dict = get_read_alignment(read, region, ali_window)
-        if read_features_dict:
-            # reads_id_list.append(read_features_dict['read_id'])
-            reads_alignment.append(read_features_dict['alignment'])
-            reads_quality.append(read_features_dict['quality'])
-    sam_query_reader.close()
-    # np.save(f'{output_dir}/{region_string}.reads_id.npy', reads_id_list)
-    np.save(f'{output_dir}/{region_string}.reads_alignment.npy',
-            np.array(reads_alignment, dtype=np.int64))
-    np.save(f'{output_dir}/{region_string}.reads_quality.npy',
-            np.array(reads_quality, dtype=np.float32))
-    region_done.touch()
-
-
-def get_read_alignment(read, region: Region, ali_window: int):
-    read_strand = '-' if read.is_reverse else '+'
-    if read_strand != region.strand:
-        return {}
-    range_one_hot = np.zeros((ali_window, 6), dtype=np.int64)
-    range_quality = np.zeros(ali_window, dtype=np.float32)
-    in_range, insert_seq_list, insert_qual_list = False, [], []
-    for read_index, ref_index in read.get_aligned_pairs():
-        if ref_index == region.start:
-            in_range = True
-        elif ref_index:
-            if ref_index >= region.end:
-                break
-        if in_range:
-            if read_index:
-                if ref_index:
-                    # match encoding
-                    if insert_seq_list:
-                        if region.strand == '+':
-                            range_one_hot[ref_index-region.start-1, 5] = \
-                                insert_seq_index(insert_seq_list)
-                            range_quality[ref_index-region.start-1] = \
-                                insert_requality(
-                                    [range_quality[ref_index-region.start-1]] +
-                                    insert_qual_list)
-                        else:
-                            range_one_hot[ref_index-region.start, 5] = \
-                                insert_seq_index(insert_seq_list)
-                            range_one_hot[
-                                ref_index-region.start,
-                                _BASE_INTS[read.query_sequence[
-                                    read_index]]] = 1
-                            range_quality[ref_index-region.start] = \
-                                insert_requality(insert_qual_list + [
-                                    read.query_qualities[read_index]])
-                        insert_seq_list, insert_qual_list = [], []
-                    else:
-                        range_one_hot[ref_index-region.start,
-                                      _BASE_INTS[read.query_sequence[
-                                          read_index]]] = 1
-                        range_quality[ref_index-region.start] = \
-                            read.query_qualities[read_index]
-                else:
-                    # insertion encoding
-                    if insert_seq_list and insert_qual_list:
-                        insert_seq_list.append(read.query_sequence[read_index])
-                        insert_qual_list.append(
-                            read.query_qualities[read_index])
-                    else:
-                        insert_seq_list = [read.query_sequence[read_index]]
-                        insert_qual_list = [read.query_qualities[read_index]]
-            elif ref_index:
-                # deletion encoding
-                if insert_seq_list:
-                    if region.strand == '+':
-                        range_one_hot[ref_index-region.start-1, 5] = \
-                            insert_seq_index(insert_seq_list)
-                        range_quality[ref_index-region.start-1] = \
-                            insert_requality([range_quality[
-                                ref_index-region.start-1]]+insert_qual_list)
-                    else:
-                        range_one_hot[ref_index-region.start, 5] = \
-                            insert_seq_index(insert_seq_list)
-                        range_one_hot[ref_index-region.start, 4] = 1
-                    insert_seq_list, insert_qual_list = [], []
-                else:
-                    range_one_hot[ref_index-region.start, 4] = 1
-    if range_one_hot.any():
-        return {'read_id': read.query_name,
-                'alignment': range_one_hot,
-                'quality': range_quality}
-    else:
-        return {}
+
+class RegionSet(object):
+    """The array-backed set of regions.
+
+    Attributes:
+        chroms (list): chromosome ids.
+        chrom (np.ndarray): (regions,) int32 index into chroms.
+        start (np.ndarray): (regions,) int64 start positions, 0-based.
+        end (np.ndarray): (regions,) int64 end positions.
+        strand (np.ndarray): (regions,) int8 index into STRANDS.
+        offset (np.ndarray): (regions,) int8 Region offsets.
+    """
+
+    def __init__(self,
+                 chroms: list[str],
+                 chrom: np.ndarray,
+                 start: np.ndarray,
+                 end: np.ndarray,
+                 strand: np.ndarray,
+                 offset: Optional[np.ndarray] = None):
+        """Initialize RegionSet.
+
+        Args:
+            chroms (list): chromosome ids.
+            chrom (np.ndarray): chromosome code of every region.
+            start (np.ndarray): start position of every region, 0-based.
+            end (np.ndarray): end position of every region.
+            strand (np.ndarray): strand code of every region.
+            offset (np.ndarray): offset of every region, default zeros.
+        """
+        self.chroms = list(chroms)
+        self.chrom = np.asarray(chrom, dtype=np.int32)
+        self.start = np.asarray(start, dtype=np.int64)
+        self.end = np.asarray(end, dtype=np.int64)
+        self.strand = np.asarray(strand, dtype=np.int8)
+        self.offset = np.zeros(len(self.start), dtype=np.int8) \
+            if offset is None else np.asarray(offset, dtype=np.int8)
+        if (self.start > self.end).any():
+            index = np.argmax(self.start > self.end)
+            raise ValueError(
+                f'Start position {self.start[index]} is larger than end '
+                f'position {self.end[index]}.')
+
+    def __len__(self):
+        return len(self.start)
+
+    def __getitem__(self, index: int):
+        return Region(self.chroms[self.chrom[index]], int(self.start[index]),
+                      int(self.end[index]), STRANDS[self.strand[index]],
+                      offset=int(self.offset[index]))
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    @classmethod
+    def from_regions(cls, regions: list[Region]):
+        """Collect Region objects into a RegionSet."""
+        chrom_codes = {}
+        chrom = [chrom_codes.setdefault(region.chrom, len(chrom_codes))
+                 for region in regions]
+        return cls(list(chrom_codes), chrom,
+                   [region.start for region in regions],
+                   [region.end for region in regions],
+                   [STRANDS.index(region.strand) for region in regions],
+                   [region.offset for region in regions])
+
+    def copy(self):
+        return self.subset(slice(None))
+
+    def subset(self, index):
+        """Return the regions at an index, slice or mask."""
+        return RegionSet(self.chroms, self.chrom[index].copy(),
+                         self.start[index].copy(), self.end[index].copy(),
+                         self.strand[index].copy(), self.offset[index].copy())
+
+    def unique(self):
+        """Return the first occurrence of every region in order."""
+        order = np.lexsort((self.end, self.start, self.strand, self.chrom))
+        duplicated = np.ones(len(order), dtype=bool)
+        for column in (self.chrom, self.strand, self.start, self.end):
+            duplicated[1:] &= column[order[1:]] == column[order[:-1]]
+        duplicated[:1] = False
+        return self.subset(np.sort(order[~duplicated]))
+
+    def chrom_groups(self, index=None):
+        """Group region indices by chromosome, sorted by start and end.
+
+        Args:
+            index (np.ndarray): region indices to group, default all.
+
+        Returns:
+            list: (chromosome id, region indices) of every chromosome.
+        """
+        index = np.arange(len(self)) if index is None else np.asarray(
+            index, dtype=np.int64)
+        order = index[np.lexsort(
+            (self.end[index], self.start[index], self.chrom[index]))]
+        bounds = np.flatnonzero(np.diff(self.chrom[order])) + 1
+        return [(self.chroms[self.chrom[group[0]]], group)
+                for group in np.split(order, bounds) if len(group)]
+
+    def chrom_limits(self, chrom_lengths: Optional[dict] = None):
+        """Return the chromosome length of every region, 0 if unknown."""
+        chrom_lengths = chrom_lengths or {}
+        lengths = np.array([chrom_lengths.get(chrom_id) or 0
+                            for chrom_id in self.chroms], dtype=np.int64)
+        return lengths[self.chrom]
+
+    def strings(self):
+        """Return the Region string of every region."""
+        return [f'{self.chroms[chrom]}_{STRANDS[strand]}_{start}-{end}'
+                for chrom, strand, start, end in zip(
+                    self.chrom.tolist(), self.strand.tolist(),
+                    self.start.tolist(), self.end.tolist())]
+
+    def resize(self, window: int, chrom_lengths: Optional[dict] = None):
+        """Resize all regions as Region.resize does.
+
+        Args:
+            window (int): window length.
+            chrom_lengths (dict): chromosome id -> chromosome length,
+                default no clamping at chromosome ends.
+        """
+        limit = self.chrom_limits(chrom_lengths)
+        start, end, offset = self.start, self.end, self.offset
+        # longer regions shrink to their middle base, offsets unchanged.
+        shrink = end - start > window
+        mid = (start[shrink] + end[shrink] - offset[shrink]) // 2
+        start[shrink], end[shrink] = mid, mid + 1
+        grow = end - start < window
+        length = end - start
+        flank = (window - length) // 2
+        left = grow & (start - flank - offset <= 0)
+        right = grow & ~left & (limit > 0) & (
+            end + flank + 1 - offset >= limit)
+        inner = grow & ~left & ~right
+        even = inner & ((window - length) % 2 == 0)
+        odd_shift = inner & ~even & (offset != 0)
+        odd_extend = inner & ~even & (offset == 0)
+        start[even] -= flank[even]
+        end[even] += flank[even]
+        start[odd_shift] -= flank[odd_shift] + 1
+        end[odd_shift] += flank[odd_shift]
+        offset[odd_shift] = 0
+        start[odd_extend] -= flank[odd_extend]
+        end[odd_extend] += flank[odd_extend] + 1
+        offset[odd_extend] = 1
+        start[left], end[left] = 0, window
+        start[right], end[right] = limit[right] - window, limit[right]
+
+
+def sweep_chrom_alignment(
+        sweep_args: tuple[str, list[tuple[Region, object]], object, int]):
+    """Sweep a chromosome span of the alignment file for its regions.
+
+    The alignment file is fetched once over the span of all regions, from
+    a handle kept open by the caller, and each read is fed into every
+    region window it overlaps. A window is encoded as soon as the sweep
+    has passed its end.
+
+    Args:
+        sweep_args (tuple): chromosome id, list of (resized region, site
+            key) pairs sorted by start, open AlignmentFile and alignment
+            window. Site keys are region strings or site ids.
+
+    Returns:
+        site_keys (list): site keys.
+        reads_alignment (list): (reads, ali_window, 6) array of every region.
+        reads_quality (list): (reads, ali_window) array of every region.
+    """
+    chrom, region_list, sam_query_reader, ali_window = sweep_args
+    starts = np.array([region.start for region, _ in region_list])
+    ends = np.array([region.end for region, _ in region_list])
+    window_reads = [[] for _ in region_list]
+    reads_alignment, reads_quality = [], []
+    first = 0
+    for read in sam_query_reader.fetch(chrom, int(starts[0]), int(ends.max())):
+        read_start, read_end = read.reference_start, read.reference_end
+        if read_end is None:
+            continue
+        # reads come sorted by start, no later read overlaps these windows.
+        while first < len(region_list) and ends[first] <= read_start:
+            region_alignment, region_quality = get_reads_alignment(
+                window_reads[first], region_list[first][0], ali_window)
+            reads_alignment.append(region_alignment)
+            reads_quality.append(region_quality)
+            window_reads[first] = None
+            first += 1
+        last = np.searchsorted(starts, read_end, side='left')
+        read_encoding = None
+        for index in range(first, last):
+            if ends[index] <= read_start:
+                continue
+            if read_encoding is None:
+                read_encoding = ReadEncoding(read)
+            window_reads[index].append(read_encoding)
+    for index in range(first, len(region_list)):
+        region_alignment, region_quality = get_reads_alignment(
+            window_reads[index], region_list[index][0], ali_window)
+        reads_alignment.append(region_alignment)
+        reads_quality.append(region_quality)
+    return ([site_key for _, site_key in region_list],
+            reads_alignment, reads_quality)
+
+
+class ReadEncoding(object):
+    """The reference-coordinate encoding of an aligned read.
+
+    The read is decoded once from its CIGAR, match and deletion blocks are
+    laid out over the reference span of the read, and insertions are kept
+    as events at the reference position they are flushed into. Any region
+    window can then be encoded from it with the same results as walking
+    the aligned pairs of the read, including its quirks around the first
+    query base, which is never encoded as an insertion and is taken for a
+    deletion when matched, so existing models see the same encoding.
+
+    Attributes:
+        strand (str): '+' or '-'.
+        start (int): reference start position of the read, 0-based.
+        end (int): reference end position of the read.
+        base (np.ndarray): matched base code per reference position, -1 if
+            not matched.
+        quality (np.ndarray): matched base quality per reference position.
+        deletion (np.ndarray): whether the reference position is deleted.
+        insertion (dict): reference position -> (inserted bases, inserted
+            qualities) flushed into the position.
+    """
+
+    def __init__(self, read):
+        """Initialize ReadEncoding.
+
+        Args:
+            read (AlignedSegment): pysam aligned read.
+        """
+        self.strand = '-' if read.is_reverse else '+'
+        self.start = read.reference_start
+        self.end = read.reference_end
+        span = self.end - self.start
+        self.base = np.full(span, -1, dtype=np.int8)
+        self.quality = np.zeros(span, dtype=np.uint8)
+        self.deletion = np.zeros(span, dtype=bool)
+        self.insertion = {}
+        query_sequence = read.query_sequence
+        query_codes = _BASE_CODES[
+            np.frombuffer(query_sequence.encode(), dtype=np.uint8)]
+        query_qualities = np.asarray(read.query_qualities, dtype=np.uint8)
+        cigar = np.array(read.cigartuples, dtype=np.int64).reshape(-1, 2)
+        ops, lengths = cigar[:, 0], cigar[:, 1]
+        query_lengths = lengths * _CIGAR_QUERY[ops]
+        ref_lengths = lengths * _CIGAR_REF[ops]
+        query_begins = np.cumsum(query_lengths) - query_lengths
+        ref_begins = np.cumsum(ref_lengths) - ref_lengths
+        # match blocks.
+        match_ops = _CIGAR_MATCH[ops]
+        query_index, ref_index = expand_blocks(
+            query_begins[match_ops], ref_begins[match_ops],
+            lengths[match_ops])
+        self.base[ref_index] = query_codes[query_index]
+        self.quality[ref_index] = query_qualities[query_index]
+        # the first query base is taken for a deletion by the aligned pairs.
+        if query_index.size and query_index[0] == 0:
+            self.base[ref_index[0]] = -1
+            self.quality[ref_index[0]] = 0
+            self.deletion[ref_index[0]] = True
+        # deletion and skipped blocks.
+        deletion_ops = _CIGAR_DELETION[ops]
+        _, ref_index = expand_blocks(
+            query_begins[deletion_ops], ref_begins[deletion_ops],
+            lengths[deletion_ops])
+        self.deletion[ref_index] = True
+        # insertion and soft clipped blocks inside the read.
+        insertion_ops = np.flatnonzero(
+            _CIGAR_QUERY[ops] & ~_CIGAR_REF[ops] &
+            (ref_begins > 0) & (ref_begins < span))
+        for op_index in insertion_ops:
+            # the first query base is dropped from insertions by the aligned
+            # pairs, as after a leading deletion or skip.
+            query_begin = max(int(query_begins[op_index]), 1)
+            query_end = int(query_begins[op_index] + lengths[op_index])
+            if query_begin >= query_end:
+                continue
+            insert_seq, insert_qual = self.insertion.setdefault(
+                self.start + int(ref_begins[op_index]), ([], []))
+            insert_seq.extend(query_sequence[query_begin:query_end])
+            insert_qual.extend(
+                query_qualities[query_begin:query_end].tolist())
+
+    def encode_window(self, start: int, end: int, strand: str,
+                      range_one_hot: np.ndarray, range_quality: np.ndarray):
+        """Encode the read in a region window.
+
+        Args:
+            start (int): window start position, 0-based.
+            end (int): window end position.
+            strand (str): window strand, '+' or '-'.
+            range_one_hot (np.ndarray): zeroed (window, 6) output array.
+            range_quality (np.ndarray): zeroed (window,) output array.
+
+        Returns:
+            bool: whether anything is encoded.
+        """
+        if not self.start <= start < self.end:
+            return False
+        stop = min(end, self.end)
+        base = self.base[start-self.start:stop-self.start]
+        quality = self.quality[start-self.start:stop-self.start]
+        deletion = self.deletion[start-self.start:stop-self.start]
+        insertion = self.insertion
+        if start == 0:
+            # reference position 0 is taken for an insertion by the aligned
+            # pairs, flushed with the insertion before position 1.
+            base, quality = base.copy(), quality.copy()
+            deletion = deletion.copy()
+            if base[0] >= 0:
+                insertion = dict(insertion)
+                insert_seq, insert_qual = insertion.get(1, ([], []))
+                insertion[1] = (['ACGT'[base[0]]] + insert_seq,
+                                [int(quality[0])] + insert_qual)
+            base[0], quality[0], deletion[0] = -1, 0, False
+        match_index = np.flatnonzero(base >= 0)
+        range_one_hot[match_index, base[match_index]] = 1
+        range_quality[match_index] = quality[match_index]
+        range_one_hot[np.flatnonzero(deletion), 4] = 1
+        for ref_index in sorted(insertion):
+            if not start < ref_index < stop:
+                continue
+            insert_seq_list, insert_qual_list = insertion[ref_index]
+            index = ref_index - start
+            if strand == '+':
+                range_one_hot[index-1, 5] = insert_seq_index(insert_seq_list)
+                range_quality[index-1] = insert_requality(
+                    [range_quality[index-1]] + insert_qual_list)
+                range_one_hot[index, :5] = 0
+                range_quality[index] = 0
+            else:
+                range_one_hot[index, 5] = insert_seq_index(insert_seq_list)
+                if base[index] >= 0:
+                    range_quality[index] = insert_requality(
+                        insert_qual_list + [int(quality[index])])
+        return range_one_hot.any()
+
+
+def expand_blocks(query_begins: np.ndarray, ref_begins: np.ndarray,
+                  lengths: np.ndarray):
+    """Expand CIGAR blocks to query and reference positions."""
+    offsets = np.arange(lengths.sum()) - np.repeat(
+        np.cumsum(lengths) - lengths, lengths)
+    return (np.repeat(query_begins, lengths) + offsets,
+            np.repeat(ref_begins, lengths) + offsets)
+
+
+def get_reads_alignment(read_encodings: list[ReadEncoding], region: Region,
+                        ali_window: int):
+    """Encode a batch of reads in a region window.
+
+    Args:
+        read_encodings (list): ReadEncoding of the reads.
+        region (Region): resized region window.
+        ali_window (int): alignment window.
+
+    Returns:
+        reads_alignment (np.ndarray): (reads, ali_window, 6) int64 array.
+        reads_quality (np.ndarray): (reads, ali_window) float32 array.
+    """
+    reads_alignment = np.zeros(
+        (len(read_encodings), ali_window, 6), dtype=np.int64)
+    reads_quality = np.zeros(
+        (len(read_encodings), ali_window), dtype=np.float32)
+    encoded = np.zeros(len(read_encodings), dtype=bool)
+    for index, read_encoding in enumerate(read_encodings):
+        if read_encoding.strand == region.strand:
+            encoded[index] = read_encoding.encode_window(
+                region.start, region.end, region.strand,
+                reads_alignment[index], reads_quality[index])
+    return reads_alignment[encoded], reads_quality[encoded]
+
+
+def compact_alignment(reads_alignment: np.ndarray):
+    """Split read alignment into compact one-hot and insertion arrays.
+
+    Args:
+        reads_alignment (np.ndarray): (reads, ali_window, 6) int64 array.
+
+    Returns:
+        alignment (np.ndarray): (reads, ali_window, 5) uint8 base and
+            deletion one-hot.
+        insertion (np.ndarray): (insertions, 3) int64 read index, window
+            position and insertion code of every insertion.
+    """
+    read_index, position = np.nonzero(reads_alignment[:, :, 5])
+    return (reads_alignment[:, :, :5].astype(np.uint8),
+            np.stack((read_index, position,
+                      reads_alignment[read_index, position, 5]), axis=1))
 
 
 def insert_requality(insert_qual_list: list):
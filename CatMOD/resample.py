@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+# Copyright 2022 Shang Xie.
+# All rights reserved.
+#
+# This file is part of the CatMOD distribution and
+# governed by your choice of the "CatMOD License Agreement"
+# or the "GNU General Public License v3.0".
+# Please see the LICENSE file that should
+# have been included as part of this package.
+"""Represent a current resampler.
+
+What's here:
+
+Resample ragged current segments to a fixed window.
+---------------------------------------------------
+
+Functions:
+  - resample_segments:
+  - spline_segments:
+"""
+
+from typing import Union
+
+import numpy as np
+
+from scipy.interpolate import interp1d
+
+# kinds resampled by index arithmetic, the others by scipy splines.
+_INDEX_KINDS = ('linear', 'slinear', 'nearest', 'nearest-up', 'previous',
+                'next')
+_SPLINE_ORDERS = {'zero': 0, 'quadratic': 2, 'cubic': 3}
+
+
+def resample_segments(values: np.ndarray, lengths: np.ndarray, window: int,
+                      kind: Union[str, int] = 'linear'):
+    """Resample every segment of a ragged array to window points.
+
+    A segment of n values is taken at n evenly spaced points and read at
+    window points evenly spaced over the same span, as
+    scipy.interpolate.interp1d(np.arange(n), segment, kind)(
+    np.linspace(0, n - 1, window)). Point positions are computed exactly
+    in integers, so segments of window values are returned unchanged.
+    Index kinds are resampled for all segments at once, spline kinds and
+    integer orders segment by segment with scipy.
+
+    Args:
+        values (np.ndarray): values of all segments concatenated.
+        lengths (np.ndarray): (segments,) values of every segment.
+        window (int): points of every resampled segment.
+        kind (str or int): interp1d kind, see --current_kind.
+
+    Returns:
+        np.ndarray: (segments, window) float64 array, zeros for empty
+            segments.
+    """
+    if isinstance(kind, str) and kind.isdigit():
+        kind = int(kind)
+    if kind not in _INDEX_KINDS and kind not in _SPLINE_ORDERS and \
+            not isinstance(kind, int):
+        raise ValueError(f'Unknown current interpolation kind: {kind}.')
+    values = np.asarray(values, dtype=np.float64)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    if kind not in _INDEX_KINDS:
+        return spline_segments(values, lengths, window, kind)
+    resampled = np.zeros((len(lengths), window), dtype=np.float64)
+    nonempty = lengths > 0
+    if not nonempty.any():
+        return resampled
+    starts = (np.cumsum(lengths) - lengths)[nonempty, np.newaxis]
+    last = lengths[nonempty, np.newaxis] - 1
+    # point j of a segment of n values sits at j * (n - 1) / (window - 1),
+    # that is low + remainder / span.
+    span = max(window - 1, 1)
+    low, remainder = np.divmod(np.arange(window) * last, span)
+    if kind in ('linear', 'slinear'):
+        low_values = values[starts + low]
+        high_values = values[starts + np.minimum(low + 1, last)]
+        resampled[nonempty] = low_values + (
+            high_values - low_values) * (remainder / span)
+        return resampled
+    if kind == 'nearest':
+        low += 2 * remainder > span
+    elif kind == 'nearest-up':
+        low += 2 * remainder >= span
+    elif kind == 'next':
+        low += remainder > 0
+    resampled[nonempty] = values[starts + low]
+    return resampled
+
+
+def spline_segments(values: np.ndarray, lengths: np.ndarray, window: int,
+                    kind: Union[str, int]):
+    """Resample segments one by one with scipy splines, linearly when a
+    segment is too short for the spline order."""
+    order = _SPLINE_ORDERS.get(kind, kind)
+    resampled = np.zeros((len(lengths), window), dtype=np.float64)
+    for segment, (start, length) in enumerate(zip(
+            np.cumsum(lengths) - lengths, lengths)):
+        if not length:
+            continue
+        if length <= max(order, 1):
+            resampled[segment] = resample_segments(
+                values[start:start+length], [length], window)[0]
+            continue
+        resampled[segment] = interp1d(
+            np.arange(length), values[start:start+length], kind=kind)(
+                np.linspace(0, length - 1, window))
+    return resampled
@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+# Copyright 2022 Shang Xie.
+# All rights reserved.
+#
+# This file is part of the CatMOD distribution and
+# governed by your choice of the "CatMOD License Agreement"
+# or the "GNU General Public License v3.0".
+# Please see the LICENSE file that should
+# have been included as part of this package.
+"""Represent a streaming extract and predict run.
+
+What's here:
+
+Extract features and predict without intermediate files.
+--------------------------------------------------------
+
+Classes:
+  - Run:
+"""
+
+from logging import getLogger
+from multiprocessing import cpu_count, Pool
+
+import numpy as np
+
+from catboost import CatBoostClassifier
+from rich.progress import Progress
+
+from CatMOD.predict import mean_sites, predict_samples
+from CatMOD.reader.bam import check_index, read_depths
+from CatMOD.reader.bed import BedReader
+from CatMOD.reader.current import current_tasks, init_site_index
+from CatMOD.region import Region, RegionSet, sweep_chrom_alignment
+from CatMOD.schedule import alignment_chunks, bounded_imap
+from CatMOD.site_index import SiteIndex
+from CatMOD.sys_output import Output
+from CatMOD.worker_context import init_worker, worker_context
+
+logger = getLogger(__name__)  # pylint: disable=invalid-name
+
+_CURRENT_FILES_CHUNK = 64
+_PREDICT_CHUNK = 65536
+
+
+class Run(object):
+    """The streaming run process.
+
+    Current features are averaged per site in memory, then every chunk of
+    swept sites is averaged, concatenated and predicted in batches.
+
+    Attributes:
+      - args: Arguments.
+      - output: Output info, warning and error.
+    """
+
+    def __init__(self, arguments):
+        """Initialize Run."""
+        self.args = arguments
+        self.output = Output()
+        self.output.info(
+            f'Initializing {self.__class__.__name__}: (args: {arguments}.')
+        logger.debug(
+            f'Initializing {self.__class__.__name__}: (args: {arguments}.')
+        self.threads = self.args.threads if self.args.threads else cpu_count()
+
+    def read_regions(self):
+        self.output.info('Reading bed file.')
+        self.chr_length = {}
+        with open(self.args.reference + '.fai', 'r') as open_fai:
+            for eachline in open_fai.readlines():
+                spline = eachline.strip().split()
+                self.chr_length.update({spline[0]: int(spline[1])})
+        self.region_set = BedReader(self.args.bed).read_region_set(
+            self.args.bed_region).unique()
+        self.site_index = SiteIndex.from_region_set(self.region_set)
+        self.output.info(f'Completed reading {len(self.region_set)} sites.')
+
+    def read_current(self):
+        """Sum the current features of every site."""
+        self.output.info('Reading ONT current files.')
+        sites = len(self.region_set)
+        self.current_counts = np.zeros(sites, dtype=np.int64)
+        self.norm_mean_sums = self.norm_stdev_sums = self.current_sums = None
+        worker, tasks, task_sizes, unit = current_tasks(
+            self.args.current, _CURRENT_FILES_CHUNK)
+        threads = max(1, min(self.threads, len(tasks)))
+        with Progress() as progress:
+            task = progress.add_task(
+                f'[green]INFO    [cyan]Reading {sum(task_sizes)} {unit}...',
+                total=sum(task_sizes))
+            with Pool(threads, initializer=init_site_index,
+                      initargs=(self.site_index, self.args.cur_window,
+                                self.args.current_kind)) as pool:
+                for (site_ids, current_features), task_size in zip(
+                        bounded_imap(pool, worker, tasks, 2 * threads),
+                        task_sizes):
+                    progress.advance(task, task_size)
+                    if not len(site_ids):
+                        continue
+                    norm_mean, norm_stdev, current = current_features
+                    if self.current_sums is None:
+                        # float32 sums halve the memory of genome-scale runs.
+                        self.norm_mean_sums = np.zeros(
+                            (sites, norm_mean.shape[1]), dtype=np.float32)
+                        self.norm_stdev_sums = np.zeros(
+                            (sites, norm_stdev.shape[1]), dtype=np.float32)
+                        self.current_sums = np.zeros(
+                            (sites, current.shape[1]), dtype=np.float32)
+                    np.add.at(self.norm_mean_sums, site_ids, norm_mean)
+                    np.add.at(self.norm_stdev_sums, site_ids, norm_stdev)
+                    np.add.at(self.current_sums, site_ids, current)
+                    np.add.at(self.current_counts, site_ids, 1)
+        self.output.info('Completed reading current features.')
+
+    def predict_regions(self):
+        """Sweep the sites in chunks and predict them in batches."""
+        if self.current_sums is None:
+            self.output.warning('No site has current features.')
+            return None
+        ali_region_set = self.region_set.copy()
+        ali_region_set.resize(self.args.ali_window, self.chr_length)
+        seq_region_set = self.region_set.copy()
+        seq_region_set.resize(self.args.seq_window, self.chr_length)
+        indexed_bam = check_index(self.args.align, self.threads,
+                                  self.args.csi)
+        sweep_chrom_features_args_list = [
+            (chrom, [(ali_region_set[site_id], seq_region_set[site_id],
+                      int(site_id)) for site_id in chunk_index],
+             indexed_bam, self.args.reference,
+             self.args.ali_window, self.args.seq_window)
+            for chrom, chunk_index in alignment_chunks(
+                ali_region_set, np.flatnonzero(self.current_counts),
+                read_depths(indexed_bam), self.threads)]
+        if not sweep_chrom_features_args_list:
+            self.output.warning('No site has current features.')
+            return None
+        cbc = CatBoostClassifier()
+        cbc.load_model(self.args.model)
+        # sequence one-hot, alignment one-hot with insertions, quality, norm
+        # mean, norm stdev and current of every site.
+        features = 4 * self.args.seq_window + 7 * self.args.ali_window + \
+            self.norm_mean_sums.shape[1] + self.norm_stdev_sums.shape[1] + \
+            self.current_sums.shape[1]
+        if features != len(cbc.feature_names_):
+            self.output.error(
+                f'{self.args.model} expects {len(cbc.feature_names_)} '
+                f'features, sites have {features} with '
+                f'{self.current_sums.shape[1]}-point currents, check '
+                '--cur_window.')
+            raise SystemExit
+        threads = min(self.threads, len(sweep_chrom_features_args_list))
+        self.output.info(f'Using {threads} threads to sweep sites.')
+        pending_ids, pending_features = [], []
+        with open(self.args.output, 'w') as open_output, \
+                Progress() as progress:
+            task = progress.add_task(
+                '[green]INFO    [cyan]Sweeping '
+                f'{len(sweep_chrom_features_args_list)} site chunks...',
+                total=len(sweep_chrom_features_args_list))
+            # cores left over by the chunks decompress alignment blocks.
+            with Pool(threads, initializer=init_worker,
+                      initargs=(indexed_bam, self.args.reference,
+                                self.threads // threads)) as pool:
+                for chunk_features in pool.imap_unordered(
+                        sweep_chrom_features, sweep_chrom_features_args_list):
+                    site_ids, features_array = self.ensemble_features(
+                        *chunk_features)
+                    pending_ids.extend(site_ids)
+                    pending_features.append(features_array)
+                    if len(pending_ids) >= _PREDICT_CHUNK:
+                        self.write_results(
+                            open_output, predict_samples(
+                                cbc, self.site_index, pending_ids,
+                                np.concatenate(pending_features),
+                                self.threads))
+                        pending_ids, pending_features = [], []
+                    progress.advance(task)
+            if pending_ids:
+                self.write_results(open_output, predict_samples(
+                    cbc, self.site_index, pending_ids,
+                    np.concatenate(pending_features), self.threads))
+        self.output.info('Completed predicting sites.')
+
+    def ensemble_features(self, site_ids: list[int],
+                          sequence_array: np.ndarray,
+                          alignment_means: np.ndarray,
+                          quality_means: np.ndarray, valid: np.ndarray):
+        """Concatenate swept chunk features with the current features."""
+        site_ids = np.array(site_ids, dtype=np.int64)
+        counts = self.current_counts[site_ids].reshape(-1, 1)
+        features_array = np.concatenate((
+            sequence_array, alignment_means, quality_means,
+            self.norm_mean_sums[site_ids] / counts,
+            self.norm_stdev_sums[site_ids] / counts,
+            self.current_sums[site_ids] / counts), axis=1)
+        return site_ids[valid].tolist(), features_array[valid].astype(
+            np.float32)
+
+    @staticmethod
+    def write_results(open_output, samples_results: list):
+        for each_sample_result in samples_results:
+            open_output.write('\t'.join(each_sample_result) + '\n')
+        open_output.flush()
+
+    def process(self):
+        """Call the run object."""
+        self.output.info('Starting run Process.')
+        logger.debug('Starting run Process.')
+        self.read_regions()
+        self.read_current()
+        self.predict_regions()
+        self.output.info('Completed run Process.')
+        logger.debug('Completed run Process.')
+
+
+def sweep_chrom_features(
+        sweep_args: tuple[str, list[tuple[Region, Region, int]], str, str,
+                          int, int]):
+    """Sweep a chunk of sites and average their sequence-side features.
+
+    Args:
+        sweep_args (tuple): chromosome id, list of (alignment region,
+            sequence region, site id) sorted by alignment region start,
+            alignment file path, reference fasta path, alignment window and
+            sequence window.
+
+    Returns:
+        site_ids (list): site ids.
+        sequence_array (np.ndarray): (sites, seq_window * 4) sequence.
+        alignment_means (np.ndarray): (sites, ali_window * 6) mean alignment.
+        quality_means (np.ndarray): (sites, ali_window) mean quality.
+        valid (np.ndarray): (sites,) whether the site has all features.
+    """
+    (chrom, region_list, alignment_file, reference,
+        ali_window, seq_window) = sweep_args
+    context = worker_context()
+    site_ids, reads_alignment, reads_quality = sweep_chrom_alignment((
+        chrom, [(ali_region, site_id)
+                for ali_region, _, site_id in region_list],
+        context.alignment(alignment_file), ali_window))
+    counts = np.array([len(each) for each in reads_alignment])
+    alignment_means = mean_sites(
+        np.concatenate(reads_alignment), counts).reshape(len(counts), -1)
+    quality_means = mean_sites(np.concatenate(reads_quality), counts)
+    sequence_array = np.zeros((len(region_list), seq_window * 4),
+                              dtype=np.float32)
+    fasta_reader = context.fasta(reference)
+    # resized regions keep the window and run past the end of
+    # chromosomes shorter than it.
+    chrom_length = fasta_reader.fasta_file.get_reference_length(chrom)
+    full_sequence = np.array([
+        seq_region.start >= 0 and seq_region.end <= chrom_length
+        for _, seq_region, _ in region_list], dtype=bool)
+    sequence_array[full_sequence] = fasta_reader.fetch_region_set(
+        RegionSet.from_regions([
+            seq_region for (_, seq_region, _), each_full in zip(
+                region_list, full_sequence) if each_full])).reshape(
+                    -1, seq_window * 4)
+    return (site_ids, sequence_array, alignment_means, quality_means,
+            (counts > 0) & full_sequence)
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+# Copyright 2022 Shang Xie.
+# All rights reserved.
+#
+# This file is part of the CatMOD distribution and
+# governed by your choice of the "CatMOD License Agreement"
+# or the "GNU General Public License v3.0".
+# Please see the LICENSE file that should
+# have been included as part of this package.
+"""Represent a run manifest.
+
+What's here:
+
+Journal of the chunks completed by every extraction stage.
+----------------------------------------------------------
+
+Classes:
+  - RunManifest:
+
+Functions:
+  - input_checksum:
+"""
+
+import sqlite3
+import zlib
+
+from hashlib import sha256
+from json import dumps
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+MANIFEST_FILE = 'run_manifest.sqlite'
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS stages (
+    stage TEXT PRIMARY KEY, checksum TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS chunks (
+    stage TEXT NOT NULL, chunk INTEGER NOT NULL, sites BLOB,
+    PRIMARY KEY (stage, chunk));
+CREATE TABLE IF NOT EXISTS features (
+    feature TEXT PRIMARY KEY, stage TEXT NOT NULL,
+    segments INTEGER NOT NULL);
+'''
+
+
+class RunManifest(object):
+    """The run manifest of an output folder.
+
+    A small SQLite database records, for every stage, the checksum of its
+    inputs and every completed chunk with the indices of its sites, and for
+    every feature the segments of the feature store committed with the
+    last chunk. A chunk is committed in one transaction after its features
+    are flushed to the store, so a resumed run skips the completed chunks
+    and truncates the store features back to their committed segments,
+    dropping anything an interrupted run appended after them.
+
+    Attributes:
+        manifest_file (str): manifest database path.
+        connection (sqlite3.Connection): opened manifest database.
+    """
+
+    def __init__(self, manifest_file: str):
+        """Initialize RunManifest.
+
+        Args:
+            manifest_file (str): manifest database path, or a folder holding
+                the run_manifest.sqlite manifest.
+        """
+        if Path(manifest_file).is_dir():
+            manifest_file = f'{manifest_file}/{MANIFEST_FILE}'
+        self.manifest_file = manifest_file
+        self.connection = sqlite3.connect(manifest_file)
+        self.connection.executescript(_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def checksum(self, stage: str):
+        """Return the input checksum of a stage, None if never started."""
+        row = self.connection.execute(
+            'SELECT checksum FROM stages WHERE stage = ?', (stage,)).fetchone()
+        return row[0] if row else None
+
+    def start(self, stage: str, checksum: str):
+        """Start a stage from scratch, forgetting its completed chunks."""
+        with self.connection:
+            self.connection.execute(
+                'DELETE FROM chunks WHERE stage = ?', (stage,))
+            self.connection.execute(
+                'DELETE FROM features WHERE stage = ?', (stage,))
+            self.connection.execute(
+                'INSERT OR REPLACE INTO stages VALUES (?, ?)',
+                (stage, checksum))
+
+    def commit(self, stage: str, chunk, segments: dict,
+               sites: Optional[np.ndarray] = None):
+        """Record completed chunks of a stage.
+
+        Args:
+            stage (str): stage name.
+            chunk (int or list): chunk number, or numbers of the chunks
+                completed together, unique within the stage.
+            segments (dict): feature -> segments stored after the chunks.
+            sites (np.ndarray): site indices of a single chunk, default
+                None.
+        """
+        sites_blob = None if sites is None else zlib.compress(
+            np.asarray(sites, dtype=np.int64).tobytes())
+        with self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO chunks VALUES (?, ?, ?)',
+                [(stage, each_chunk, sites_blob)
+                 for each_chunk in np.atleast_1d(chunk).tolist()])
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO features VALUES (?, ?, ?)',
+                [(feature, stage, feature_segments)
+                 for feature, feature_segments in segments.items()])
+
+    def chunks(self, stage: str):
+        """Return the numbers of the completed chunks of a stage."""
+        return {chunk for chunk, in self.connection.execute(
+            'SELECT chunk FROM chunks WHERE stage = ?', (stage,))}
+
+    def sites(self, stage: str):
+        """Return the indices of the sites completed by a stage."""
+        sites_list = [
+            np.frombuffer(zlib.decompress(sites_blob), dtype=np.int64)
+            for sites_blob, in self.connection.execute(
+                'SELECT sites FROM chunks WHERE stage = ? AND '
+                'sites IS NOT NULL', (stage,))]
+        return np.concatenate(sites_list + [np.zeros(0, dtype=np.int64)])
+
+    def segments(self, stage: str):
+        """Return feature -> committed segments of a stage."""
+        return dict(self.connection.execute(
+            'SELECT feature, segments FROM features WHERE stage = ?',
+            (stage,)))
+
+    def next_chunk(self, stage: str):
+        """Return a chunk number no completed chunk of a stage uses."""
+        row = self.connection.execute(
+            'SELECT MAX(chunk) FROM chunks WHERE stage = ?',
+            (stage,)).fetchone()
+        return 0 if row[0] is None else row[0] + 1
+
+
+def input_checksum(input_files: list, **parameters):
+    """Checksum the size and modification time of input files and the
+    parameters of a stage, so that inputs are never read to resume."""
+    inputs = {}
+    for input_file in input_files:
+        if input_file is None:
+            continue
+        input_stat = Path(input_file).stat()
+        inputs[str(Path(input_file).resolve())] = [
+            input_stat.st_size, input_stat.st_mtime_ns]
+    return sha256(dumps({'inputs': inputs, 'parameters': parameters},
+                        sort_keys=True).encode()).hexdigest()
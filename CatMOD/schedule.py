@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+# Copyright 2022 Shang Xie.
+# All rights reserved.
+#
+# This file is part of the CatMOD distribution and
+# governed by your choice of the "CatMOD License Agreement"
+# or the "GNU General Public License v3.0".
+# Please see the LICENSE file that should
+# have been included as part of this package.
+"""Represent a schedule of pool tasks.
+
+What's here:
+
+Genomically contiguous site chunks balanced by read depth.
+----------------------------------------------------------
+
+Functions:
+  - alignment_chunks:
+  - bounded_imap:
+"""
+
+from collections import deque
+from itertools import islice
+
+import numpy as np
+
+from CatMOD.region import RegionSet
+
+_CHUNK_SITES = 1024
+_CHUNKS_PER_THREAD = 8
+_CHUNK_GAP = 1 << 16
+
+
+def alignment_chunks(region_set: RegionSet, index, depths: dict,
+                     threads: int, max_sites: int = _CHUNK_SITES):
+    """Group resized regions into chunks for the alignment sweep.
+
+    Regions are sorted by chromosome and start and cut into contiguous
+    chunks at gaps longer than _CHUNK_GAP, at max_sites regions and
+    whenever the estimated cost of a chunk exceeds its share of the
+    total. The cost of a region is its window in reads plus one, and the
+    cost of a gap is the reads swept over it, both from the mapped reads
+    per base of its chromosome. Chunks are returned by decreasing cost, so
+    a pool handing them out in order schedules the longest tasks first.
+
+    Args:
+        region_set (RegionSet): resized regions.
+        index (np.ndarray): indices of the regions to sweep.
+        depths (dict): chromosome id -> mapped reads per base, see
+            read_depths. Chromosomes without a depth take the mean depth.
+        threads (int): worker processes.
+        max_sites (int): most regions of a chunk.
+
+    Returns:
+        list: (chromosome id, region indices sorted by start) of every
+            chunk.
+    """
+    mean_depth = np.mean(list(depths.values())) if depths else 1.0
+    chrom_chunks, chrom_costs = [], []
+    for chrom, chrom_index in region_set.chrom_groups(index):
+        depth = depths.get(chrom, mean_depth)
+        starts = region_set.start[chrom_index]
+        ends = region_set.end[chrom_index]
+        swept_ends = np.maximum.accumulate(ends)
+        gaps = np.maximum(starts[1:] - swept_ends[:-1], 0)
+        gap_breaks = gaps > _CHUNK_GAP
+        chrom_chunks.append((chrom, chrom_index, gap_breaks))
+        chrom_costs.append(np.concatenate((
+            [0.0], depth * np.where(gap_breaks, 0, gaps))) +
+            depth * (ends - starts) + 1)
+    if not chrom_chunks:
+        return []
+    target_cost = max(sum(costs.sum() for costs in chrom_costs) / (
+        max(threads, 1) * _CHUNKS_PER_THREAD), 1.0)
+    chunks, chunk_costs = [], []
+    for (chrom, chrom_index, gap_breaks), costs in zip(
+            chrom_chunks, chrom_costs):
+        # a chunk ends at a gap, at max_sites or past target_cost.
+        segment = np.concatenate(([0], np.cumsum(gap_breaks)))
+        segment_starts = np.flatnonzero(np.diff(segment, prepend=-1))
+        segment_base = np.repeat(segment_starts, np.diff(
+            np.append(segment_starts, len(segment))))
+        cumulative_costs = np.cumsum(costs)
+        within_costs = cumulative_costs - costs - np.concatenate(
+            ([0.0], cumulative_costs))[segment_base]
+        rank = np.arange(len(chrom_index)) - segment_base
+        keys = np.stack((segment, (within_costs // target_cost).astype(
+            np.int64), rank // max_sites), axis=1)
+        bounds = np.flatnonzero(np.concatenate((
+            [True], (keys[1:] != keys[:-1]).any(axis=1), [True])))
+        for chunk_start, chunk_end in zip(bounds[:-1], bounds[1:]):
+            chunks.append((chrom, chrom_index[chunk_start:chunk_end]))
+            chunk_costs.append(costs[chunk_start:chunk_end].sum())
+    order = np.argsort(chunk_costs, kind='stable')[::-1]
+    return [chunks[chunk] for chunk in order]
+
+
+def bounded_imap(pool, worker, tasks, in_flight: int):
+    """Map tasks on a pool in order like Pool.imap, with at most in_flight
+    tasks submitted but not yet consumed, so results do not pile up in the
+    parent when it falls behind the workers.
+
+    Args:
+        pool (Pool): multiprocessing pool.
+        worker (function): function called with every task.
+        tasks (iterable): worker arguments.
+        in_flight (int): tasks submitted ahead of the consumer.
+
+    Yields:
+        result of every task in order.
+    """
+    tasks = iter(tasks)
+    pending = deque(pool.apply_async(worker, (each_task,))
+                    for each_task in islice(tasks, max(1, in_flight)))
+    while pending:
+        result = pending.popleft().get()
+        for each_task in islice(tasks, 1):
+            pending.append(pool.apply_async(worker, (each_task,)))
+        yield result
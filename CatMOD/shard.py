@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+# Copyright 2022 Shang Xie.
+# All rights reserved.
+#
+# This file is part of the CatMOD distribution and
+# governed by your choice of the "CatMOD License Agreement"
+# or the "GNU General Public License v3.0".
+# Please see the LICENSE file that should
+# have been included as part of this package.
+"""Represent a genomic shard.
+
+What's here:
+
+Deterministic partition of sites into genomic shards.
+-----------------------------------------------------
+
+Functions:
+  - parse_shard:
+  - shard_index:
+  - site_key:
+"""
+
+from typing import Optional
+
+import numpy as np
+
+from CatMOD.region import RegionSet
+
+_SHARD_BIN = 1 << 20
+
+
+def parse_shard(shard: str):
+    """Parse a K/N shard, K counting from 1.
+
+    Returns:
+        shard (int): shard number K.
+        shards (int): number of shards N.
+    """
+    try:
+        shard_number, shards = (int(each) for each in shard.split('/'))
+    except ValueError:
+        raise ValueError(f'Shard should be K/N, got {shard}.') from None
+    if not 1 <= shard_number <= shards:
+        raise ValueError(f'Shard {shard} should have 1 <= K <= N.')
+    return shard_number, shards
+
+
+def shard_index(region_set: RegionSet, shard: str,
+                depths: Optional[dict] = None, bin_size: int = _SHARD_BIN):
+    """Return the indices of the sites of a shard.
+
+    Sites are binned by chromosome and start // bin_size, the bins are
+    sorted by chromosome name and position, and the sorted bins are cut
+    into N runs of about equal weight, every bin going to the run its
+    middle weight falls in. A bin weighs its sites, or with depths its
+    sites times one plus the mapped reads per base of its chromosome, so
+    every node computes the same shards from the same inputs and the
+    shards in order cover the genome in order.
+
+    Args:
+        region_set (RegionSet): unique sites.
+        shard (str): K/N shard, see parse_shard.
+        depths (dict): chromosome id -> mapped reads per base, see
+            read_depths, default None weighing sites only.
+        bin_size (int): bin length, default 1 Mb.
+
+    Returns:
+        np.ndarray: indices of the sites of the shard in order.
+    """
+    shard_number, shards = parse_shard(shard)
+    if not len(region_set):
+        return np.zeros(0, dtype=np.int64)
+    chrom_rank = np.argsort(np.argsort(region_set.chroms, kind='stable'))
+    bins, inverse, sites = np.unique(
+        np.stack((chrom_rank[region_set.chrom],
+                  region_set.start // bin_size), axis=1),
+        axis=0, return_inverse=True, return_counts=True)
+    weights = sites.astype(np.float64)
+    if depths is not None:
+        mean_depth = np.mean(list(depths.values())) if depths else 0.0
+        chrom_depths = np.array([depths.get(chrom, mean_depth)
+                                 for chrom in region_set.chroms])
+        weights *= 1 + chrom_depths[np.argsort(chrom_rank)][bins[:, 0]]
+    middle_weights = np.cumsum(weights) - weights / 2
+    bin_shards = np.minimum(
+        (middle_weights * shards / weights.sum()).astype(np.int64),
+        shards - 1)
+    return np.flatnonzero(bin_shards[inverse.ravel()] == shard_number - 1)
+
+
+def site_key(region_string: str):
+    """Return the chromosome, start, end and strand sorting a region
+    string."""
+    chrom, strand, span = region_string.rsplit('_', 2)
+    start, end = span.split('-')
+    return chrom, int(start), int(end), strand
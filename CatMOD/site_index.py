@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+# Copyright 2022 Shang Xie.
+# All rights reserved.
+#
+# This file is part of the CatMOD distribution and
+# governed by your choice of the "CatMOD License Agreement"
+# or the "GNU General Public License v3.0".
+# Please see the LICENSE file that should
+# have been included as part of this package.
+"""Represent a site index.
+
+What's here:
+
+Integer site ids with vectorized lookup.
+----------------------------------------
+
+Classes:
+  - SiteIndex
+"""
+
+import numpy as np
+
+from CatMOD.region import RegionSet, STRANDS
+
+_POSITION_BITS = 40
+
+
+class SiteIndex(object):
+    """The integer index of unique sites.
+
+    Site ids are the positions of the sites in the order they are given.
+    Sites are sorted by a (chromosome, strand, start) int64 key, ties by
+    end, so positions are looked up by binary search without building
+    site strings.
+
+    Attributes:
+        chroms (list): chromosome ids.
+        chrom_codes (dict): chromosome id -> chromosome code.
+        chrom (np.ndarray): (sites,) int32 chromosome code of every site.
+        strand (np.ndarray): (sites,) int8 index into STRANDS.
+        start (np.ndarray): (sites,) int64 start position.
+        end (np.ndarray): (sites,) int64 end position.
+    """
+
+    def __init__(self, chroms: list[str], chrom: np.ndarray,
+                 strand: np.ndarray, start: np.ndarray, end: np.ndarray):
+        """Initialize SiteIndex.
+
+        Args:
+            chroms (list): chromosome ids.
+            chrom (np.ndarray): chromosome code of every site.
+            strand (np.ndarray): strand code of every site.
+            start (np.ndarray): start position of every site.
+            end (np.ndarray): end position of every site.
+        """
+        self.chroms = list(chroms)
+        self.chrom_codes = {chrom_id: code
+                            for code, chrom_id in enumerate(self.chroms)}
+        self.chrom = np.asarray(chrom, dtype=np.int32)
+        self.strand = np.asarray(strand, dtype=np.int8)
+        self.start = np.asarray(start, dtype=np.int64)
+        self.end = np.asarray(end, dtype=np.int64)
+        if len(self.start) and self.start.max() >= 1 << _POSITION_BITS:
+            raise ValueError(
+                f'Site positions should be below {1 << _POSITION_BITS}.')
+        keys = self.site_keys(self.chrom, self.strand, self.start)
+        self._order = np.lexsort((self.end, keys))
+        self._keys = keys[self._order]
+        duplicated = (self._keys[1:] == self._keys[:-1]) & (
+            self.end[self._order[1:]] == self.end[self._order[:-1]])
+        if duplicated.any():
+            raise ValueError(
+                'Duplicated site ' +
+                self.site_string(self._order[np.argmax(duplicated)]) + '.')
+
+    def __len__(self):
+        return len(self.start)
+
+    @classmethod
+    def from_region_set(cls, region_set: RegionSet):
+        """Index the unique regions of a RegionSet."""
+        return cls(region_set.chroms, region_set.chrom, region_set.strand,
+                   region_set.start, region_set.end)
+
+    @staticmethod
+    def site_keys(chrom: np.ndarray, strand: np.ndarray,
+                  start: np.ndarray):
+        """Return the int64 sort key of sites."""
+        return ((np.asarray(chrom, dtype=np.int64) * 2 + strand)
+                << _POSITION_BITS) | np.asarray(start, dtype=np.int64)
+
+    def lookup_codes(self, chrom: np.ndarray, strand: np.ndarray,
+                     start: np.ndarray, end=None):
+        """Look up sites by chromosome and strand codes.
+
+        Args:
+            chrom (np.ndarray): chromosome codes, negative if unknown.
+            strand (np.ndarray): strand codes.
+            start (np.ndarray): start positions.
+            end (np.ndarray): end positions, default any end.
+
+        Returns:
+            np.ndarray: int64 site ids, -1 for missing sites.
+        """
+        chrom, strand, start = np.broadcast_arrays(
+            np.asarray(chrom, dtype=np.int64), np.asarray(strand),
+            np.asarray(start, dtype=np.int64))
+        if not len(self):
+            return np.full(chrom.shape, -1, dtype=np.int64)
+        keys = self.site_keys(chrom, strand, start)
+        left = np.minimum(np.searchsorted(self._keys, keys, side='left'),
+                          len(self._keys) - 1)
+        found = (self._keys[left] == keys) & (chrom >= 0) & (
+            start >= 0) & (start < 1 << _POSITION_BITS)
+        site_ids = np.where(found, self._order[left], -1)
+        if end is None:
+            return site_ids
+        end = np.broadcast_to(np.asarray(end, dtype=np.int64), keys.shape)
+        mismatched = np.flatnonzero(found & (self.end[site_ids] != end))
+        for index in mismatched:
+            # sites sharing a start are adjacent and sorted by end.
+            site_ids.flat[index] = -1
+            position = left.flat[index] + 1
+            while position < len(self._keys) and \
+                    self._keys[position] == keys.flat[index]:
+                if self.end[self._order[position]] == end.flat[index]:
+                    site_ids.flat[index] = self._order[position]
+                    break
+                position += 1
+        return site_ids
+
+    def lookup(self, chrom: str, strand: str, start: np.ndarray, end=None):
+        """Look up positions of a chromosome strand, see lookup_codes."""
+        return self.lookup_codes(self.chrom_codes.get(chrom, -1),
+                                 STRANDS.index(strand), start, end)
+
+    def lookup_sites(self, chroms: list[str], strands: list[str],
+                     start: np.ndarray, end=None):
+        """Look up sites given by chromosome ids and strands, missing like
+        unknown chromosomes for strands other than '+' and '-'."""
+        strands = np.asarray(strands, dtype=str)
+        chrom_codes = self.chrom_codes
+        chrom = np.array([chrom_codes.get(chrom, -1) for chrom in chroms],
+                         dtype=np.int64)
+        chrom[~np.isin(strands, ('+', '-'))] = -1
+        return self.lookup_codes(
+            chrom, (strands == '-').astype(np.int8), start, end)
+
+    def site_string(self, site_id: int):
+        """Return the region string of a site."""
+        return (f'{self.chroms[self.chrom[site_id]]}_'
+                f'{STRANDS[self.strand[site_id]]}_'
+                f'{self.start[site_id]}-{self.end[site_id]}')
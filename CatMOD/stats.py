@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+# Copyright 2022 Shang Xie.
+# All rights reserved.
+#
+# This file is part of the CatMOD distribution and
+# governed by your choice of the "CatMOD License Agreement"
+# or the "GNU General Public License v3.0".
+# Please see the LICENSE file that should
+# have been included as part of this package.
+"""Represent per-site running statistics.
+
+What's here:
+
+Read counts, means and variances of site features.
+--------------------------------------------------
+
+Classes:
+  - RunningStats
+
+Functions:
+  - summary_features
+"""
+
+import numpy as np
+
+
+SUMMARY_SUFFIXES = ('_count', '_mean', '_m2')
+
+
+def summary_features(feature: str):
+    """Return the count, mean and m2 store feature names of a feature."""
+    return tuple(feature + suffix for suffix in SUMMARY_SUFFIXES)
+
+
+class RunningStats(object):
+    """The running count, mean and sum of squared deviations of sites.
+
+    Rows are summarized with a two-pass mean and m2 per site, and
+    summaries of the same site are combined with the pairwise update of
+    Chan et al., so sites can be summarized chunk by chunk without keeping
+    their rows.
+
+    Attributes:
+        count (np.ndarray): (sites,) int64 number of rows.
+        mean (np.ndarray): (sites, *row_shape) float64 mean.
+        m2 (np.ndarray): (sites, *row_shape) float64 sum of squared
+            deviations from the mean.
+    """
+
+    def __init__(self, count: np.ndarray, mean: np.ndarray, m2: np.ndarray):
+        self.count = np.asarray(count, dtype=np.int64)
+        self.mean = np.asarray(mean, dtype=np.float64)
+        self.m2 = np.asarray(m2, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.count)
+
+    @property
+    def variance(self):
+        """Sample variance, zeros for sites with less than two rows."""
+        count = self.count.reshape(-1, *[1] * (self.mean.ndim - 1))
+        return np.divide(self.m2, count - 1, out=np.zeros_like(self.m2),
+                         where=count > 1)
+
+    @classmethod
+    def from_rows(cls, values: np.ndarray, counts: np.ndarray):
+        """Summarize rows grouped by site.
+
+        Args:
+            values (np.ndarray): rows of all sites concatenated in order.
+            counts (np.ndarray): (sites,) rows of every site.
+        """
+        counts = np.asarray(counts, dtype=np.int64)
+        values = np.asarray(values, dtype=np.float64)
+        mean = np.zeros((len(counts), *values.shape[1:]), dtype=np.float64)
+        m2 = np.zeros_like(mean)
+        nonempty = counts > 0
+        if nonempty.any():
+            starts = (np.cumsum(counts) - counts)[nonempty]
+            nonempty_counts = counts[nonempty].reshape(
+                -1, *[1] * (values.ndim - 1))
+            mean[nonempty] = np.add.reduceat(
+                values, starts, axis=0) / nonempty_counts
+            deviations = values - np.repeat(mean, counts, axis=0)
+            m2[nonempty] = np.add.reduceat(
+                deviations * deviations, starts, axis=0)
+        return cls(counts, mean, m2)
+
+    @classmethod
+    def combine(cls, count: np.ndarray, mean: np.ndarray, m2: np.ndarray,
+                segments: np.ndarray):
+        """Combine summaries grouped by site.
+
+        Args:
+            count (np.ndarray): (summaries,) counts of all summaries.
+            mean (np.ndarray): (summaries, *row_shape) means.
+            m2 (np.ndarray): (summaries, *row_shape) m2.
+            segments (np.ndarray): (sites,) summaries of every site.
+        """
+        count = np.asarray(count, dtype=np.int64)
+        mean = np.asarray(mean, dtype=np.float64)
+        m2 = np.asarray(m2, dtype=np.float64)
+        segments = np.asarray(segments, dtype=np.int64)
+        site_count = np.zeros(len(segments), dtype=np.int64)
+        site_mean = np.zeros((len(segments), *mean.shape[1:]),
+                             dtype=np.float64)
+        site_m2 = np.zeros_like(site_mean)
+        nonempty = segments > 0
+        if nonempty.any():
+            starts = (np.cumsum(segments) - segments)[nonempty]
+            site_count[nonempty] = np.add.reduceat(count, starts)
+            row_shape = (-1, *[1] * (mean.ndim - 1))
+            weights = count.reshape(row_shape)
+            totals = site_count[nonempty].reshape(row_shape)
+            mean_sums = np.add.reduceat(mean * weights, starts, axis=0)
+            site_mean[nonempty] = np.divide(
+                mean_sums, totals, out=np.zeros_like(mean_sums),
+                where=totals > 0)
+            deviations = mean - np.repeat(site_mean, segments, axis=0)
+            site_m2[nonempty] = np.add.reduceat(
+                m2 + weights * deviations * deviations, starts, axis=0)
+        return cls(site_count, site_mean, site_m2)
+
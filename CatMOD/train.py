@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+# Copyright 2022 Shang Xie.
+# All rights reserved.
+#
+# This file is part of the CatMOD distribution and
+# governed by your choice of the "CatMOD License Agreement"
+# or the "GNU General Public License v3.0".
+# Please see the LICENSE file that should
+# have been included as part of this package.
+"""Represent a train process.
+
+What's here:
+
+Train a CatBoost model on the features of labelled sites.
+---------------------------------------------------------
+
+Classes:
+  - Train:
+"""
+
+from json import dump, load
+from logging import getLogger
+from multiprocessing import cpu_count
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import numpy as np
+
+from catboost import CatBoostClassifier, Pool
+from catboost.utils import quantize
+from rich.progress import Progress
+
+from CatMOD.feature_store import FeatureStore, STORE_FILE
+from CatMOD.predict import ensemble_features
+from CatMOD.reader.bed import BedReader
+from CatMOD.sys_output import Output
+
+logger = getLogger(__name__)  # pylint: disable=invalid-name
+
+_SITE_BLOCK = 4096
+_POOL_CACHE_INDEX_SUFFIX = '.json'
+
+
+class Train(object):
+    """The train process.
+
+    Ensemble features of the labelled sites are assembled block by block
+    from the feature store of every dataset into a scratch tsv file, which
+    CatBoost quantizes into a Pool while reading it, so raw features are
+    held in memory one block at a time and only the quantized pool in
+    full. The quantized pool can be cached on disk and is reused by later
+    runs on the same inputs. A cached pool is always trained on as loaded
+    from disk, so runs building and reusing it train the same model.
+
+    Attributes:
+      - args: Arguments.
+      - output: Output info, warning and error.
+    """
+
+    def __init__(self, arguments):
+        """Initialize Train."""
+        self.args = arguments
+        self.output = Output()
+        self.output.info(
+            f'Initializing {self.__class__.__name__}: (args: {arguments}.')
+        logger.debug(
+            f'Initializing {self.__class__.__name__}: (args: {arguments}.')
+        for datasets in self.args.datasets:
+            if not (Path(datasets) / STORE_FILE).is_file():
+                raise FileNotFoundError(
+                    f'{datasets} lacks {STORE_FILE} feature store.')
+        self.threads = self.args.threads if self.args.threads else cpu_count()
+
+    def get_all_samples(self):
+        """Read the positive and negative sites."""
+        self.output.info('Reading bed files.')
+        positive_strings = self.read_region_strings(self.args.positive)
+        negative_strings = self.read_region_strings(self.args.negative)
+        positive_set = set(positive_strings)
+        labelled_negative = [region_string
+                             for region_string in negative_strings
+                             if region_string not in positive_set]
+        if len(labelled_negative) < len(negative_strings):
+            self.output.warning(
+                f'Skipping {len(negative_strings) - len(labelled_negative)} '
+                'negative sites that are also positive.')
+        self.region_list = positive_strings + labelled_negative
+        self.labels = np.zeros(len(self.region_list), dtype=np.int8)
+        self.labels[:len(positive_strings)] = 1
+        self.output.info(
+            f'Read {len(positive_strings)} positive and '
+            f'{len(labelled_negative)} negative sites.')
+
+    @staticmethod
+    def read_region_strings(bed_files: list[str]):
+        """Return the unique region strings of bed files in order."""
+        region_strings = {}
+        for bed_file in bed_files:
+            region_strings.update(dict.fromkeys(
+                BedReader(bed_file).read_region_set().unique().strings()))
+        return list(region_strings)
+
+    def pool_cache_index(self):
+        """Describe the inputs of the quantized pool."""
+        inputs = {}
+        for input_file in (self.args.positive + self.args.negative + [
+                str(Path(datasets) / STORE_FILE)
+                for datasets in self.args.datasets]):
+            input_stat = Path(input_file).stat()
+            inputs[str(Path(input_file).resolve())] = [
+                input_stat.st_size, input_stat.st_mtime_ns]
+        return {'inputs': inputs, 'border_count': self.args.border_count}
+
+    def load_pool(self):
+        """Load the cached quantized pool of the same inputs, if any."""
+        if not self.args.pool_cache or self.args.overwrite:
+            return None
+        index_path = Path(self.args.pool_cache + _POOL_CACHE_INDEX_SUFFIX)
+        if not Path(self.args.pool_cache).is_file() or \
+                not index_path.is_file():
+            return None
+        with open(index_path, 'r') as open_index:
+            if load(open_index) != self.pool_cache_index():
+                self.output.warning(
+                    f'{self.args.pool_cache} was built from other inputs, '
+                    'rebuilding it.')
+                return None
+        self.output.info(f'Loading quantized pool {self.args.pool_cache}.')
+        return Pool('quantized://' + self.args.pool_cache)
+
+    def build_pool(self):
+        """Assemble the features of all datasets into a quantized pool."""
+        labels_index = {region_string: label for region_string, label in zip(
+            self.region_list, self.labels.tolist())}
+        scratch_folder = Path(self.args.pool_cache or self.args.output).parent
+        with TemporaryDirectory(dir=scratch_folder) as scratch_path, \
+                open(f'{scratch_path}/features.tsv', 'w') as open_features, \
+                Progress() as progress:
+            task = progress.add_task(
+                '[green]INFO    [cyan]Assembling features of '
+                f'{len(self.region_list)} sites in '
+                f'{len(self.args.datasets)} datasets...',
+                total=len(self.region_list) * len(self.args.datasets))
+            rows, positive_rows = 0, 0
+            for datasets in self.args.datasets:
+                with FeatureStore(datasets, 'r') as store:
+                    for block_start in range(
+                            0, len(self.region_list), _SITE_BLOCK):
+                        try:
+                            region_strings, features_array = \
+                                ensemble_features(store, self.region_list[
+                                    block_start:block_start+_SITE_BLOCK])
+                        except ValueError as error:
+                            self.output.error(f'{datasets}: {error}')
+                            raise SystemExit
+                        progress.advance(task, min(
+                            _SITE_BLOCK, len(self.region_list) - block_start))
+                        if not len(region_strings):
+                            continue
+                        labels = np.array([
+                            labels_index[region_string]
+                            for region_string in region_strings])
+                        # the label column comes first, float32 values are
+                        # written with the digits to read them back exactly.
+                        np.savetxt(open_features, np.column_stack((
+                            labels, features_array)), fmt='%.9g',
+                            delimiter='\t')
+                        rows += len(region_strings)
+                        positive_rows += int(labels.sum())
+            if not rows:
+                self.output.error('No labelled site has all features.')
+                raise SystemExit
+            self.output.info(
+                f'Assembled {rows} samples, {positive_rows} positive.')
+            open_features.close()
+            pool = quantize(f'{scratch_path}/features.tsv',
+                            border_count=self.args.border_count,
+                            thread_count=self.threads)
+        if self.args.pool_cache:
+            pool.save(self.args.pool_cache)
+            with open(self.args.pool_cache + _POOL_CACHE_INDEX_SUFFIX,
+                      'w') as open_index:
+                dump(self.pool_cache_index(), open_index, indent=1)
+            self.output.info(f'Saved quantized pool {self.args.pool_cache}.')
+            return Pool('quantized://' + self.args.pool_cache)
+        return pool
+
+    def train(self):
+        pool = self.load_pool()
+        if pool is None:
+            pool = self.build_pool()
+        self.output.info(
+            f'Using {self.threads} threads to train on '
+            f'{pool.num_row()} samples.')
+        cbc = CatBoostClassifier(
+            iterations=self.args.iterations,
+            learning_rate=self.args.learning_rate,
+            depth=self.args.depth,
+            random_seed=self.args.seed,
+            thread_count=self.threads,
+            allow_writing_files=False,
+            verbose=max(self.args.iterations // 10, 1))
+        cbc.fit(pool)
+        cbc.save_model(self.args.output, format='cbm')
+        self.output.info(f'Saved model {self.args.output}.')
+
+    def process(self):
+        """Call the training object."""
+        self.output.info('Starting training Process.')
+        logger.debug('Starting training Process.')
+        self.get_all_samples()
+        self.train()
+        self.output.info('Completed training Process.')
+        logger.debug('Completed training Process.')
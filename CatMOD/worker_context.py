@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+# Copyright 2022 Shang Xie.
+# All rights reserved.
+#
+# This file is part of the CatMOD distribution and
+# governed by your choice of the "CatMOD License Agreement"
+# or the "GNU General Public License v3.0".
+# Please see the LICENSE file that should
+# have been included as part of this package.
+"""Represent a worker process context.
+
+What's here:
+
+Alignment and reference files opened once per worker process.
+-------------------------------------------------------------
+
+Classes:
+  - WorkerContext:
+
+Functions:
+  - init_worker:
+  - worker_context:
+"""
+
+from typing import Optional
+
+from CatMOD.reader.bam import open_xam
+from CatMOD.reader.fasta import FastaReader
+
+
+class WorkerContext(object):
+    """The files kept open by a worker process.
+
+    Files are opened the first time a task uses them and reused for every
+    later task of the worker: alignment files with their index, with
+    threads decompressing their blocks and, for cram, with the reference.
+
+    Attributes:
+        reference (str): reference fasta path, also used to decode cram.
+        threads (int): threads decompressing alignment file blocks.
+        alignment_files (dict): alignment file path -> AlignmentFile.
+        fasta_readers (dict): fasta path -> FastaReader.
+    """
+
+    def __init__(self, alignment_file: Optional[str] = None,
+                 reference: Optional[str] = None, threads: int = 1):
+        """Initialize WorkerContext.
+
+        Args:
+            alignment_file (str): bam or cram file to open at once.
+            reference (str): reference fasta to open at once.
+            threads (int): threads decompressing alignment file blocks,
+                default 1.
+        """
+        self.reference = reference
+        self.threads = threads
+        self.alignment_files = {}
+        self.fasta_readers = {}
+        if alignment_file:
+            self.alignment(alignment_file)
+        if reference:
+            self.fasta(reference)
+
+    def alignment(self, alignment_file: str):
+        """Return the open alignment file."""
+        if alignment_file not in self.alignment_files:
+            self.alignment_files[alignment_file], _ = open_xam(
+                alignment_file, self.reference, self.threads)
+        return self.alignment_files[alignment_file]
+
+    def fasta(self, reference: Optional[str] = None):
+        """Return the open reference, default the context reference."""
+        reference = reference or self.reference
+        if reference not in self.fasta_readers:
+            self.fasta_readers[reference] = FastaReader(
+                reference, cache_chroms=False)
+        return self.fasta_readers[reference]
+
+    def close(self):
+        for alignment_file in self.alignment_files.values():
+            alignment_file.close()
+        for fasta_reader in self.fasta_readers.values():
+            fasta_reader.fasta_file.close()
+        self.alignment_files, self.fasta_readers = {}, {}
+
+
+_worker_context = None
+
+
+def init_worker(alignment_file: Optional[str] = None,
+                reference: Optional[str] = None, threads: int = 1):
+    """Pool initializer opening the files of a worker process.
+
+    Args:
+        alignment_file (str): bam or cram file path.
+        reference (str): reference fasta path.
+        threads (int): threads decompressing alignment file blocks.
+    """
+    global _worker_context
+    if _worker_context is not None:
+        _worker_context.close()
+    _worker_context = WorkerContext(alignment_file, reference, threads)
+
+
+def worker_context():
+    """Return the context of this process, opening files on first use when
+    the pool has no initializer."""
+    global _worker_context
+    if _worker_context is None:
+        _worker_context = WorkerContext()
+    return _worker_context
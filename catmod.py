@@ -48,6 +48,14 @@ def main():
         subparser,
         'data_process',
         """.""")
+    index_reference = fullhelp_argumentparser.IndexReferenceArgs(
+        subparser,
+        'index_reference',
+        """.""")
+    convert_current = fullhelp_argumentparser.ConvertCurrentArgs(
+        subparser,
+        'convert_current',
+        """.""")
     extract_features = fullhelp_argumentparser.EFArgs(
         subparser,
         'extract_features',
@@ -60,6 +68,14 @@ def main():
         subparser,
         'predict',
         """.""")
+    run = fullhelp_argumentparser.RunArgs(
+        subparser,
+        'run',
+        """.""")
+    merge = fullhelp_argumentparser.MergeArgs(
+        subparser,
+        'merge',
+        """.""")
 
     def bad_args(args):
         """Print help on bad arguments."""
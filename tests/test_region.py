@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+# Copyright 2022 Shang Xie.
+# All rights reserved.
+#
+# This file is part of the CatMOD distribution and
+# governed by your choice of the "CatMOD License Agreement"
+# or the "GNU General Public License v3.0".
+# Please see the LICENSE file that should
+# have been included as part of this package.
+"""Test the region encodings against their per-read and per-region
+originals.
+
+What's here:
+
+Randomized comparisons keeping the shipped models' features unchanged.
+----------------------------------------------------------------------
+
+Classes:
+  - TestReadEncoding:
+  - TestRegionSetResize:
+
+Functions:
+  - get_read_alignment:
+  - random_read:
+"""
+
+import random
+import unittest
+
+import numpy as np
+import pysam
+
+from CatMOD.region import (
+    get_reads_alignment, insert_requality, insert_seq_index, ReadEncoding,
+    Region, RegionSet, STRANDS)
+
+_BASE_INTS = {'A': 0, 'C': 1, 'G': 2, 'T': 3}
+# CIGAR operations consuming query bases: M, I, S, =, X.
+_QUERY_OPS = (0, 1, 4, 7, 8)
+_HEADER = pysam.AlignmentHeader.from_dict(
+    {'SQ': [{'SN': 'chr1', 'LN': 100000}]})
+
+
+def get_read_alignment(read, region: Region, ali_window: int):
+    """Encode a read in a region window by walking its aligned pairs.
+
+    This is the encoder the shipped models were trained with, kept as the
+    reference ReadEncoding has to reproduce.
+
+    Returns:
+        dict: alignment and quality arrays, empty if nothing is encoded.
+    """
+    read_strand = '-' if read.is_reverse else '+'
+    if read_strand != region.strand:
+        return {}
+    range_one_hot = np.zeros((ali_window, 6), dtype=np.int64)
+    range_quality = np.zeros(ali_window, dtype=np.float32)
+    in_range, insert_seq_list, insert_qual_list = False, [], []
+    for read_index, ref_index in read.get_aligned_pairs():
+        if ref_index == region.start:
+            in_range = True
+        elif ref_index:
+            if ref_index >= region.end:
+                break
+        if in_range:
+            if read_index:
+                if ref_index:
+                    # match encoding
+                    if insert_seq_list:
+                        if region.strand == '+':
+                            range_one_hot[ref_index-region.start-1, 5] = \
+                                insert_seq_index(insert_seq_list)
+                            range_quality[ref_index-region.start-1] = \
+                                insert_requality(
+                                    [range_quality[ref_index-region.start-1]] +
+                                    insert_qual_list)
+                        else:
+                            range_one_hot[ref_index-region.start, 5] = \
+                                insert_seq_index(insert_seq_list)
+                            range_one_hot[
+                                ref_index-region.start,
+                                _BASE_INTS[read.query_sequence[
+                                    read_index]]] = 1
+                            range_quality[ref_index-region.start] = \
+                                insert_requality(insert_qual_list + [
+                                    read.query_qualities[read_index]])
+                        insert_seq_list, insert_qual_list = [], []
+                    else:
+                        range_one_hot[ref_index-region.start,
+                                      _BASE_INTS[read.query_sequence[
+                                          read_index]]] = 1
+                        range_quality[ref_index-region.start] = \
+                            read.query_qualities[read_index]
+                else:
+                    # insertion encoding
+                    if insert_seq_list and insert_qual_list:
+                        insert_seq_list.append(read.query_sequence[read_index])
+                        insert_qual_list.append(
+                            read.query_qualities[read_index])
+                    else:
+                        insert_seq_list = [read.query_sequence[read_index]]
+                        insert_qual_list = [read.query_qualities[read_index]]
+            elif ref_index:
+                # deletion encoding
+                if insert_seq_list:
+                    if region.strand == '+':
+                        range_one_hot[ref_index-region.start-1, 5] = \
+                            insert_seq_index(insert_seq_list)
+                        range_quality[ref_index-region.start-1] = \
+                            insert_requality([range_quality[
+                                ref_index-region.start-1]]+insert_qual_list)
+                    else:
+                        range_one_hot[ref_index-region.start, 5] = \
+                            insert_seq_index(insert_seq_list)
+                        range_one_hot[ref_index-region.start, 4] = 1
+                    insert_seq_list, insert_qual_list = [], []
+                else:
+                    range_one_hot[ref_index-region.start, 4] = 1
+    if range_one_hot.any():
+        return {'alignment': range_one_hot, 'quality': range_quality}
+    return {}
+
+
+def random_read(rng: random.Random, name: str):
+    """Return an aligned read with a random CIGAR, sequence and qualities.
+
+    CIGARs may start and end with soft clips, and often start with a
+    deletion or skip followed by an insertion.
+    """
+    cigar = []
+    if rng.random() < 0.3:
+        cigar.append((4, rng.randint(1, 3)))
+    if rng.random() < 0.4:
+        cigar.append((rng.choice((2, 3)), rng.randint(1, 3)))
+        cigar.append((1, rng.randint(1, 3)))
+    for _ in range(rng.randint(1, 6)):
+        cigar.append((rng.choice((0, 0, 1, 2, 3, 7, 8)), rng.randint(1, 4)))
+    cigar.append((0, rng.randint(1, 4)))
+    if rng.random() < 0.3:
+        cigar.append((4, rng.randint(1, 3)))
+    query_length = sum(length for op, length in cigar if op in _QUERY_OPS)
+    read = pysam.AlignedSegment(_HEADER)
+    read.query_name = name
+    read.reference_id = 0
+    read.reference_start = rng.choice((0, 1, 2, 5, 50))
+    read.query_sequence = ''.join(
+        rng.choice('ACGT') for _ in range(query_length))
+    read.query_qualities = pysam.qualitystring_to_array(''.join(
+        chr(33 + rng.randint(2, 40)) for _ in range(query_length)))
+    read.cigartuples = cigar
+    read.is_reverse = rng.random() < 0.5
+    return read
+
+
+class TestReadEncoding(unittest.TestCase):
+    """ReadEncoding encodes every window like the aligned pairs walk."""
+
+    def test_random_reads(self):
+        rng = random.Random(0)
+        for read_number in range(2000):
+            read = random_read(rng, f'read{read_number}')
+            read_encoding = ReadEncoding(read)
+            for start in range(max(0, read.reference_start - 3),
+                               read.reference_end + 2):
+                for ali_window in (1, 5, 41):
+                    region = Region('chr1', start, start + ali_window,
+                                    read_encoding.strand)
+                    expected = get_read_alignment(read, region, ali_window)
+                    alignment, quality = get_reads_alignment(
+                        [read_encoding], region, ali_window)
+                    message = (f'{read.cigarstring} at '
+                               f'{read.reference_start}, window {region}')
+                    if not expected:
+                        self.assertEqual(len(alignment), 0, message)
+                        continue
+                    self.assertEqual(len(alignment), 1, message)
+                    np.testing.assert_array_equal(
+                        alignment[0], expected['alignment'], message)
+                    np.testing.assert_array_equal(
+                        quality[0], expected['quality'], message)
+
+    def test_other_strand(self):
+        read = random_read(random.Random(1), 'read')
+        read_encoding = ReadEncoding(read)
+        region = Region('chr1', read.reference_start,
+                        read.reference_start + 5,
+                        '+' if read.is_reverse else '-')
+        alignment, _ = get_reads_alignment([read_encoding], region, 5)
+        self.assertEqual(len(alignment), 0)
+
+
+class TestRegionSetResize(unittest.TestCase):
+    """RegionSet.resize resizes every region like Region.resize."""
+
+    def test_random_regions(self):
+        rng = random.Random(0)
+        chrom_lengths = {'chr1': 1000, 'chr2': 120, 'chr3': 40}
+        for _ in range(200):
+            regions = []
+            for _ in range(50):
+                chrom = rng.choice(('chr1', 'chr2', 'chr3', 'chr4'))
+                limit = chrom_lengths.get(chrom, 1000)
+                start = rng.randrange(0, limit)
+                end = min(limit, start + rng.choice((0, 1, 2, 5, 40, 200)))
+                regions.append(Region(chrom, start, end, rng.choice(STRANDS),
+                                      offset=rng.choice((0, 1))))
+            window = rng.choice((1, 2, 5, 41, 101))
+            with_limits = rng.random() < 0.5
+            region_set = RegionSet.from_regions(regions)
+            region_set.resize(window, chrom_lengths if with_limits else None)
+            for index, region in enumerate(regions):
+                region.resize(window, chrom_lengths.get(region.chrom)
+                              if with_limits else None)
+                self.assertEqual(
+                    (region.start, region.end, region.offset),
+                    (int(region_set.start[index]),
+                     int(region_set.end[index]),
+                     int(region_set.offset[index])), str(region))
+
+
+if __name__ == '__main__':
+    unittest.main()